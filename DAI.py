@@ -1,66 +1,329 @@
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 import pox.lib.packet as pkt
-from pox.lib.util import dpid_to_str
+from pox.lib.util import dpid_to_str, str_to_bool
+from pox.lib.addresses import IPAddr, EthAddr
+from pox.lib.revent import EventHalt
+
+from .batching import batched
+from .bindings import BindingStore, mac_to_int, ip_to_int
+from .bindings import int_to_mac, int_to_ip
+from . import bindingfile
+from .flowpager import FlowPager, table_miss_flow
+from .seclog import EventLog
+from .spoofing import SpooferTracker
+from . import fastpath
+from . import metrics
+from . import portSecurity
+from . import proxyarp
 
 log = core.getLogger ()
+slog = EventLog(log)
+_metrics = metrics.component("DAI")
+
+class DynamicARPInspection (object):
 
-class ARPSpoofer (object):
-    threshold = 1
+    # Priorities of the flows used when ARP checking is offloaded to the
+    # switches.  ARP requests matching a located binding (or, in proactive
+    # mode, any binding) are flooded by the switch; all other ARP is sent
+    # to us.  Replies are unicast, so once checked they're forwarded by
+    # the learning switch like any other packet, not flooded.
+    allow_priority = of.OFP_DEFAULT_PRIORITY + 300
+    punt_priority = of.OFP_DEFAULT_PRIORITY + 299
 
-    def __init__ (self):
-        self.inport = 0
-        self.count = 0
+    # Priority of the flow sending all ARP requests to us when we answer
+    # them by proxy.  It's above the allow flows, so a bound host's
+    # requests come to us rather than being flooded.  That's above port
+    # security's violation flows too, so answer() has port security
+    # learn the sender first.
+    proxy_priority = of.OFP_DEFAULT_PRIORITY + 301
 
-class DynamicARPInspection (object):
-    
+    # Bindings used when no bindings file is given
     secARPtable = {
         "10.0.0.1" : "00:00:00:00:00:01",
         "10.0.0.2" : "00:00:00:00:00:02",
         "10.0.0.3" : "00:00:00:00:00:03"
         }
 
-    def __init__(self):
-        core.openflow.addListeners (self)
+    def __init__(self, bindings = None, snoop = False, flows = False,
+                 threshold = 1, window = 10, block_time = 300,
+                 standalone = True, proactive = False, proxy_arp = False,
+                 watch = 0, ignore = None):
+        # When not standalone, we're a stage of the security pipeline and
+        # it calls check() and install_flows() for us.  When answering ARP
+        # by proxy, we must see PacketIns before the learning switch, so
+        # we can stop it flooding the requests we answer.
+        if standalone:
+            core.openflow.addListeners (self,
+                                        priority = 1 if proxy_arp else None)
+        # DPIDs of switches we leave alone
+        self.ignore = set(ignore) if ignore else ()
         log.info("Starting DynamicARPInspection component")
-        self.spoofers = dict()
+        self.spoofers = SpooferTracker("DAI", threshold, window, block_time)
+        self.bindings = BindingStore()
+        self.flows = flows or proactive
+        metrics.gauge("dai_bindings", self.bindings.__len__)
+        self.proactive = proactive
+        self.proxy_arp = proxy_arp
+        self.proxied = 0 # ARP requests answered by proxy
+        if bindings is None:
+            for ip, mac in DynamicARPInspection.secARPtable.items():
+                self.add_binding(IPAddr(ip), EthAddr(mac), static = True)
+        else:
+            f = bindingfile.open_bindings(bindings,
+                                          self._handle_bindings_changed, watch)
+            for ip, (mac, dpid, port) in f.bindings.items():
+                self.bindings.add(ip, mac, dpid, port, static = True)
+        if snoop:
+            core.listen_to_dependencies(self, ['dhcp_snooping'])
+
+    def add_binding (self, ip, mac, dpid = None, port = None, static = False):
+        """
+        Adds an IP -> MAC binding (IPAddr and EthAddr)
+        """
+        return self._add(ip_to_int(ip), mac_to_int(mac), dpid, port, static)
+
+    def _add (self, ip, mac, dpid, port, static):
+        # ip and mac are integers
+        old = self._located(ip)
+        if not self.bindings.add(ip, mac, dpid, port, static):
+            return False
+        self._update_allow_flow(ip, old)
+        return True
+
+    def remove_binding (self, ip, mac = None, static = False):
+        """
+        Removes the binding for ip (an IPAddr)
+        """
+        if mac is not None: mac = mac_to_int(mac)
+        return self._remove(ip_to_int(ip), mac, static)
+
+    def _remove (self, ip, mac, static):
+        old = self._located(ip)
+        if not self.bindings.remove(ip, mac, static):
+            return False
+        self._update_allow_flow(ip, old)
+        return True
+
+    def _handle_bindings_changed (self, added, removed):
+        """
+        Applies the changes to the bindings file
+
+        Only the allow flows of changed bindings are sent.
+        """
+        for ip, (mac, dpid, port) in removed.items():
+            if ip not in added: self._remove(ip, mac, static = True)
+        for ip, (mac, dpid, port) in added.items():
+            self._add(ip, mac, dpid, port, static = True)
+
+    def _located (self, ip):
+        """
+        Returns (MAC, DPID, port) for ip if it should have an allow flow
+
+        That's if its location is known or, in proactive mode, if it's
+        bound at all (with DPID and port None if it isn't located).
+        """
+        loc = self.bindings.location_of(ip)
+        if loc is None:
+            if not self.proactive: return None
+            mac = self.bindings.mac_for(ip)
+            if mac is None: return None
+            return (mac, None, None)
+        return (self.bindings.mac_for(ip),) + loc
+
+    def _update_allow_flow (self, ip, old):
+        if not self.flows: return
+        new = self._located(ip)
+        if new == old: return
+        if old is not None:
+            self._send_allow_flow(ip, *old, command = of.OFPFC_DELETE_STRICT)
+        if new is not None:
+            self._send_allow_flow(ip, *new)
+
+    def _send_allow_flow (self, ip, mac, dpid, port, command = of.OFPFC_ADD,
+                          connection = None):
+        """
+        Lets the switch flood ARP requests from a bound host without
+        asking us
+
+        A binding with no location (DPID None) is allowed on any port of
+        every switch.
+        """
+        if connection is not None:
+            connections = [connection]
+        elif dpid is None:
+            connections = [c for c in core.openflow.connections.values()
+                           if c.dpid not in self.ignore]
+        else:
+            if dpid in self.ignore: return
+            connection = core.openflow.getConnection(dpid)
+            if connection is None: return
+            connections = [connection]
+        msg = self._allow_flow(ip, mac, port, command)
+        for connection in connections:
+            batched(connection).send(msg)
+
+    def _allow_flow (self, ip, mac, port, command = of.OFPFC_ADD):
+        """
+        Returns the flow_mod for the allow flow of a binding
 
-    def _handle_ConnectionUP (self, event):
+        OpenFlow 1.0 can't match the ARP sender hardware address, so the
+        Ethernet source stands in for it.  nw_proto matches the ARP
+        opcode; only requests are flooded.
+        """
+        msg = of.ofp_flow_mod(command = command)
+        msg.match = of.ofp_match(in_port = port,
+                                 dl_type = pkt.ethernet.ARP_TYPE,
+                                 nw_proto = pkt.arp.REQUEST,
+                                 dl_src = int_to_mac(mac),
+                                 nw_src = int_to_ip(ip))
+        msg.priority = DynamicARPInspection.allow_priority
+        if command == of.OFPFC_ADD:
+            msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
+        return msg
+
+    def _handle_dhcp_snooping_BindingAdded (self, event):
+        b = event.binding
+        self.add_binding(b.ip, b.mac, event.dpid, b.port)
+
+    def _handle_dhcp_snooping_BindingRemoved (self, event):
+        b = event.binding
+        self.remove_binding(b.ip, b.mac)
+
+    def _handle_ConnectionUp (self, event):
         log.info("Switch %s connected", dpid_to_str(event.dpid))
+        self.install_flows(event.connection)
+
+    def install_flows (self, connection):
+        """
+        Sends a newly connected switch the flows it needs, if any
+        """
+        if not self.flows and not self.proxy_arp: return
+        if connection.dpid in self.ignore: return
+        FlowPager(connection, self._switch_flows(connection.dpid))
+
+    def _switch_flows (self, dpid):
+        """
+        Yields the flows a newly connected switch needs
+        """
+        if self.proxy_arp:
+            # In OpenFlow 1.0, nw_proto matches the ARP opcode
+            msg = of.ofp_flow_mod()
+            msg.match = of.ofp_match(dl_type = pkt.ethernet.ARP_TYPE,
+                                     nw_proto = pkt.arp.REQUEST)
+            msg.priority = DynamicARPInspection.proxy_priority
+            msg.actions.append(of.ofp_action_output(port = of.OFPP_CONTROLLER))
+            yield msg
+        if not self.flows: return
+        msg = of.ofp_flow_mod()
+        msg.match = of.ofp_match(dl_type = pkt.ethernet.ARP_TYPE)
+        msg.priority = DynamicARPInspection.punt_priority
+        msg.actions.append(of.ofp_action_output(port = of.OFPP_CONTROLLER))
+        yield msg
+        if self.proactive:
+            yield table_miss_flow()
+        for ip, mac, bound_dpid, port in self.bindings.items():
+            if bound_dpid == dpid:
+                yield self._allow_flow(ip, mac, port)
+            elif bound_dpid is None and self.proactive:
+                yield self._allow_flow(ip, mac, None)
 
     def _handle_PacketIn (self, event):
-        packet = event.parsed
-        inport = event.port
-        arp = packet.find ('arp')
-        if arp is not None and arp.opcode == pkt.arp.REPLY:
-            senderIP = arp.protosrc.toStr()
-            senderMAC = arp.hwsrc.toStr()
-            try:
-                entry = DynamicARPInspection.secARPtable[senderIP]
-            except KeyError:
-                return
-            if entry != senderMAC:
-                log.info("ARP spoofing detected!! From MAC=%s, forging IP=%s",senderMAC,senderIP)
-                if senderMAC in self.spoofers.keys():
-                    self.spoofers[senderMAC].count += 1
-                    self.spoofers[senderMAC].inport = inport
-                else:
-                    self.spoofers[senderMAC] = ARPSpoofer()
-                    self.spoofers[senderMAC].inport = inport
-            
-                if self.spoofers[senderMAC].count >= ARPSpoofer.threshold:
-                    log.info("ARP Spoofing threshold achieved. Blocking port %d", self.spoofers[senderMAC].inport)
-                    self.blockSpoofer (senderMAC, event)
-
-    def blockSpoofer (self, mac, event):
-        spoofer = self.spoofers[mac]
-        match = of.ofp_match(in_port = spoofer.inport)
-        msg = of.ofp_flow_mod (match=match)
-        msg.priprity = 100
-        msg.idle_timeout = of.OFP_FLOW_PERMANENT
-        msg.hard_timeout = of.OFP_FLOW_PERMANENT
-        event.connection.send (msg)
-        spoofer.count = 0
-
-def launch ():
-    core.registerNew (DynamicARPInspection)
+        t = t0 = _metrics.start()
+        h = fastpath.headers(event)
+        if h is None or h.arp_op is None:
+            _metrics.done(t0, "not_arp")
+            return
+        if t: t = _metrics.lap("parse", t)
+        if not self.check_headers(event, h):
+            _metrics.done(t0, "spoofed")
+            return
+        if t: t = _metrics.lap("check", t)
+        if self.proxy_arp and h.arp_op == pkt.arp.REQUEST:
+            packet = event.parsed
+            arp = packet.find('arp')
+            if arp is not None and self.answer(event, packet, arp):
+                if t: _metrics.lap("proxy_arp", t)
+                _metrics.done(t0, "proxied")
+                return EventHalt
+        _metrics.done(t0, "allowed")
+
+    def resolve (self, ip):
+        """
+        Returns the EthAddr bound to ip (an IPAddr), or None
+        """
+        mac = self.bindings.mac_for(ip.toUnsigned())
+        return None if mac is None else int_to_mac(mac)
+
+    def answer (self, event, packet, arp):
+        """
+        Answers arp by proxy if it's a request for a bound address
+
+        Returns True if it did.  The sender is learned by port security
+        first (we answer before it sees the request), and isn't answered
+        if port security won't have it.
+        """
+        if not proxyarp.should_answer(arp): return False
+        mac = self.resolve(arp.protodst)
+        if mac is None or mac == arp.hwsrc: return False
+        if not portSecurity.learn(event.dpid, packet.src, event.port):
+            return False
+        proxyarp.answer(batched(event.connection), event, packet, arp, mac)
+        self.proxied += 1
+        return True
+
+    def check (self, event, packet, arp):
+        """
+        Returns False if arp's sender doesn't match its binding
+        """
+        return self._check(event, arp.opcode, mac_to_int(arp.hwsrc),
+                           arp.protosrc.toUnsigned(), mac_to_int(packet.src))
+
+    def check_headers (self, event, h):
+        """
+        Like check(), from an ARP's fastpath Headers
+        """
+        return self._check(event, h.arp_op, h.arp_sha, h.arp_spa, h.src)
+
+    def _check (self, event, opcode, sha, spa, src):
+        # MACs and IPs are integers
+        if opcode != pkt.arp.REPLY and opcode != pkt.arp.REQUEST:
+            return True
+        expected = self.bindings.mac_for(spa)
+        if expected is None: return True
+        if expected == sha: return True
+
+        slog.event("arp_spoof", "From MAC=%s, forging IP=%s on %s.%d",
+                   int_to_mac(sha), int_to_ip(spa), dpid_to_str(event.dpid),
+                   event.port)
+        self.spoofers.report(event, int_to_mac(src))
+        return False
+
+def launch (bindings = None, snoop = False, flows = False, proactive = False,
+            proxy_arp = False, threshold = 1, window = 10, block_time = 300,
+            watch = 0):
+    """
+    Starts Dynamic ARP Inspection
+
+    bindings is a file of bindings to check ARP against, as lines of
+    "IP MAC [DPID port]", CSV or JSON (see bindingfile); the built-in
+    secARPtable is used if it's not given.  With watch, the file is
+    checked for changes every watch seconds, and only the bindings which
+    changed are updated.  With snoop, leases learned by the dhcp_snooping
+    component are added too.  With flows, switches check ARP requests
+    from bindings with a known location themselves and only send us the
+    rest.  proactive goes further and has switches allow ARP requests
+    from every binding (on any port, for those with no location) from
+    the moment they connect; the flows are sent in pages (see
+    flowpager).  With proxy_arp, switches send us every ARP request, and
+    we answer those for bound addresses ourselves instead of letting
+    them be flooded.
+
+    A sender is blocked for block_time seconds once it sends threshold
+    spoofed ARPs within window seconds.
+    """
+    core.registerNew (DynamicARPInspection, bindings, str_to_bool(snoop),
+                      str_to_bool(flows), int(threshold), float(window),
+                      int(block_time), proactive = str_to_bool(proactive),
+                      proxy_arp = str_to_bool(proxy_arp),
+                      watch = float(watch))
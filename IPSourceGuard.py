@@ -1,24 +1,88 @@
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 import pox.lib.packet as pkt
-from pox.lib.util import dpid_to_str
+from pox.lib.util import dpid_to_str, str_to_bool
 from pox.lib.packet.ipv4 import ipv4
-from pox.lib.addresses import IPAddr, EthAddr
+from pox.lib.addresses import IPAddr, EthAddr, IP_ANY
 
-log = core.getLogger ()
-
-class IPSpoofer (object):
-    threshold = 1
+from .batching import batched
+from .bindings import mac_to_int, ip_to_int, int_to_mac, int_to_ip
+from . import bindingfile
+from .flowpager import FlowPager, table_miss_flow
+from .learning import L2Forwarder
+from . import fastpath
+from . import metrics
+from .seclog import EventLog
+from .spoofing import SpooferTracker
 
-    def __init__ (self):
-        self.inport = 0
-        self.count = 0
+log = core.getLogger ()
+slog = EventLog(log)
+_metrics = metrics.component("IPSourceGuard")
 
 def dpid_to_mac (dpid):
   return EthAddr("%012x" % (dpid & 0xffFFffFFffFF,))
 
+class GuardedSwitch (object):
+    """
+    A learning switch which only forwards IPv4 from valid sources
+
+    Each packet is first checked by the IPSourceGuard; packets that pass
+    are learned and forwarded by an L2Forwarder, which installs an
+    exact-match flow (including in_port, dl_src and nw_src) so later
+    packets of the flow never come back to the controller.
+    """
+    def __init__ (self, connection, guard):
+        self.connection = connection
+        self.guard = guard
+        self.forwarder = L2Forwarder(connection, False)
+        self.macToPort = self.forwarder.macToPort
+        # Each new source IP must come to us to be checked
+        self.forwarder.limit_granularity("exact")
+        # Answer ARP requests for known sources instead of flooding them
+        self.forwarder.arp_resolver = guard.resolve
+        connection.addListeners(self)
+
+    def _handle_PacketIn (self, event):
+        t = t0 = _metrics.start()
+        # Spoofed IPv4 is dropped without parsing it
+        h = fastpath.headers(event)
+        if h is not None and h.ip_src is not None:
+            if not self.guard.check_headers(event, h):
+                self.forwarder.drop(event)
+                _metrics.done(t0, "spoofed")
+                return
+            valid = True
+        else:
+            valid = h is not None # Not IPv4
+        if t: t = _metrics.lap("check", t)
+
+        packet = event.parsed
+        if not packet.parsed:
+            log.warning("Ignoring incomplete packet")
+            _metrics.done(t0, "incomplete")
+            return
+        if not valid and not self.guard.validate(event, packet):
+            self.forwarder.drop(event)
+            _metrics.done(t0, "spoofed")
+            return
+        if t: t = _metrics.lap("parse", t)
+
+        self.macToPort[packet.src] = event.port
+        if t: t = _metrics.lap("learn", t)
+        self.forwarder.forward(event, packet, _metrics, t)
+        _metrics.done(t0, "forwarded")
+
 class IPSourceGuard (object):
-    
+
+    # Priorities of the flows used in proactive mode.  IPv4 from a valid
+    # source's MAC with its own IP is sent to us (to be forwarded); other
+    # IPv4 from it, and IPv4 from unknown MACs, is dropped by the switch.
+    # All are below the learning switch's forwarding flows, so traffic we
+    # have validated and forwarded is then forwarded by the switch.
+    punt_priority = of.OFP_DEFAULT_PRIORITY - 100
+    spoof_priority = of.OFP_DEFAULT_PRIORITY - 101
+    unknown_priority = of.OFP_DEFAULT_PRIORITY - 102
+
     ipSecTable = {
         "00:00:00:00:00:01" : "10.0.0.1",
         "00:00:00:00:00:02" : "10.0.0.2",
@@ -26,62 +90,238 @@ class IPSourceGuard (object):
         "00:00:de:ad:be:ef" : "10.0.0.5"
         }
 
-    def __init__(self):
-        core.openflow.addListeners (self)
+    def __init__(self, threshold = 1, window = 10, block_time = 300,
+                 standalone = True, proactive = False, bindings = None,
+                 watch = 0, ignore = None):
+        # When not standalone, we're a stage of the security pipeline and
+        # it calls check() for us.
+        if standalone:
+            core.openflow.addListeners (self)
+        # DPIDs of switches we leave alone
+        self.ignore = set(ignore) if ignore else ()
         log.info("Starting IPSource Guard component")
-        self.spoofers = dict()
+        self.spoofers = SpooferTracker("IPSourceGuard", threshold, window,
+                                       block_time)
+        self.proactive = proactive
 
-    def _handle_ConnectionUP (self, event):
+        # MAC -> its IP, from the bindings file or ipSecTable, as integers
+        if bindings is None:
+            table = IPSourceGuard.ipSecTable
+            self.static = dict((mac_to_int(EthAddr(mac)),
+                                ip_to_int(IPAddr(ip)))
+                               for mac, ip in table.items())
+        else:
+            f = bindingfile.open_bindings(bindings,
+                                          self._handle_bindings_changed, watch)
+            self.static = dict((mac, ip) for ip, (mac, dpid, port)
+                               in f.bindings.items())
+        # ...along with leases snooped by DHCP snooping, which take
+        # precedence while they last
+        self.sources = dict(self.static)
+        # ...and the other way round, for proxy ARP
+        self.owners = dict((ip, mac) for mac, ip in self.sources.items())
+
+    def _handle_ConnectionUp (self, event):
         log.info("Switch %s connected", dpid_to_str(event.dpid))
+        GuardedSwitch(event.connection, self)
+        if self.proactive:
+            FlowPager(event.connection, self.switch_flows())
+
+    def switch_flows (self):
+        """
+        Yields the flows a switch needs in proactive mode
+
+        OpenFlow 1.0 has a single table and can't match "source IP isn't
+        this one", so the switch can drop spoofed and unknown sources by
+        itself, but can't also forward a valid source's packets without
+        knowing where its destination is; the first packet of each flow
+        from a valid source still comes to us.
+        """
+        yield table_miss_flow()
         msg = of.ofp_flow_mod()
-        msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
-        event.connection.send(msg)
-        log.info("Hubifying %s", dpidToStr(event.dpid))
+        msg.match = of.ofp_match(dl_type = pkt.ethernet.IP_TYPE)
+        msg.priority = IPSourceGuard.unknown_priority
+        yield msg
+        for mac, ip in self.sources.items():
+            for msg in self._source_flows(mac, ip):
+                yield msg
 
+    def _source_flows (self, mac, ip):
+        """
+        Returns the flow_mods dropping spoofed IPv4 from mac (an integer)
+        and sending us IPv4 from its own IP
+        """
+        mac = int_to_mac(mac)
+        drop = of.ofp_flow_mod()
+        drop.match = of.ofp_match(dl_type = pkt.ethernet.IP_TYPE,
+                                  dl_src = mac)
+        drop.priority = IPSourceGuard.spoof_priority
+        punt = of.ofp_flow_mod()
+        punt.match = of.ofp_match(dl_type = pkt.ethernet.IP_TYPE,
+                                  dl_src = mac, nw_src = int_to_ip(ip))
+        punt.priority = IPSourceGuard.punt_priority
+        punt.actions.append(of.ofp_action_output(port = of.OFPP_CONTROLLER))
+        return drop, punt
 
-    def _handle_PacketIn (self, event):
-        dpid = event.connection.dpid
-        packet = event.parsed
-        inport = event.port
+    def _revoke_flows (self, mac, ip):
+        """
+        Returns the flow_mods removing a source's flows from a switch
+
+        That's the forwarding flows for its traffic, and in proactive
+        mode, those of _source_flows().
+        """
+        msg = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+        msg.match = of.ofp_match(dl_type = pkt.ethernet.IP_TYPE,
+                                 dl_src = int_to_mac(mac),
+                                 nw_src = int_to_ip(ip))
+        msgs = [msg]
+        if self.proactive:
+            msg = of.ofp_flow_mod(command = of.OFPFC_DELETE_STRICT)
+            msg.match = of.ofp_match(dl_type = pkt.ethernet.IP_TYPE,
+                                     dl_src = int_to_mac(mac))
+            msg.priority = IPSourceGuard.spoof_priority
+            msgs.append(msg)
+        return msgs
+
+    def _add_source (self, mac, ip):
+        """
+        Makes ip the valid source of mac (both integers)
+
+        Returns the flow_mods the switches need for the change.
+        """
+        old = self.sources.get(mac)
+        if old == ip: return []
+        msgs = []
+        if old is not None:
+            # The MAC's previous IP was another binding's
+            if self.owners.get(old) == mac: del self.owners[old]
+            msgs.extend(self._revoke_flows(mac, old))
+        self.sources[mac] = ip
+        self.owners[ip] = mac
+        if self.proactive:
+            msgs.extend(self._source_flows(mac, ip))
+        return msgs
+
+    def _remove_source (self, mac, ip):
+        """
+        Removes ip as the valid source of mac; returns the flow_mods needed
+        """
+        if self.sources.get(mac) != ip: return []
+        del self.sources[mac]
+        if self.owners.get(ip) == mac: del self.owners[ip]
+        return self._revoke_flows(mac, ip)
+
+    def _send (self, msgs):
+        if not msgs: return
+        for connection in core.openflow.connections.values():
+            if connection.dpid in self.ignore: continue
+            b = batched(connection)
+            for msg in msgs:
+                b.send(msg)
+
+    def _handle_bindings_changed (self, added, removed):
+        """
+        Applies the changes to the bindings file
+
+        Only the flows of sources which changed are sent to the switches.
+        We don't care where a source is, so a binding which has only moved
+        is left alone.
+        """
+        msgs = []
+        for ip, (mac, dpid, port) in removed.items():
+            if ip in added and added[ip][0] == mac: continue
+            if self.static.get(mac) == ip: del self.static[mac]
+            msgs.extend(self._remove_source(mac, ip))
+        for ip, (mac, dpid, port) in added.items():
+            self.static[mac] = ip
+            msgs.extend(self._add_source(mac, ip))
+        self._send(msgs)
+
+    def _handle_dhcp_snooping_BindingAdded (self, event):
+        b = event.binding
+        self._send(self._add_source(mac_to_int(b.mac), ip_to_int(b.ip)))
+
+    def _handle_dhcp_snooping_BindingRemoved (self, event):
+        b = event.binding
+        mac, ip = mac_to_int(b.mac), ip_to_int(b.ip)
+        static = self.static.get(mac)
+        if static == ip: return
+        msgs = self._remove_source(mac, ip)
+        if static is not None and msgs:
+            # Back to the address the MAC is bound to statically
+            msgs.extend(self._add_source(mac, static))
+        self._send(msgs)
+
+    def resolve (self, ip):
+        """
+        Returns the EthAddr of the valid source with IP ip, or None
+        """
+        mac = self.owners.get(ip.toUnsigned())
+        return None if mac is None else int_to_mac(mac)
+
+    def validate (self, event, packet):
+        """
+        Returns False if packet must not be forwarded
+
+        Non-IPv4 traffic is always allowed.  IPv4 is only allowed from
+        valid source MACs using their own IP address.
+        """
         packetv4 = packet.find('ipv4')
+        if packetv4 is None: return True
+        return self.check(event, packet, packetv4)
 
-        if packetv4 is not None:
-            log.info("%s %s => %s %s", packet.src, packetv4.srcip.toStr(),
-                     packet.dst, packetv4.dstip.toStr())
-            try:
-                entry = IPSourceGuard.ipSecTable[(packet.src).toStr()]
-            except KeyError:
-                return
-            if entry != packetv4.srcip.toStr():
-                log.info("IP spoofing detected!! From MAC=%s, forging IP=%s",packet.src, packetv4.srcip.toStr())
-                senderMAC = (packet.src).toStr()
-                if senderMAC in self.spoofers.keys():
-                    self.spoofers[senderMAC].count += 1
-                    self.spoofers[senderMAC].inport = inport
-                else:
-                    self.spoofers[senderMAC] = IPSpoofer()
-                    self.spoofers[senderMAC].inport = inport
-            
-                if self.spoofers[senderMAC].count >= IPSpoofer.threshold:
-                    log.info("IP Spoofing threshold achieved. Blocking port %d", self.spoofers[senderMAC].inport)
-                    self.blockSpoofer (senderMAC, event)
-                return
+    def check (self, event, packet, packetv4):
+        """
+        Returns False if the IPv4 packet packetv4 has a bad source
+
+        DHCP clients asking for an address (from 0.0.0.0) are let through.
+        """
+        if packetv4.srcip == IP_ANY:
+            udp = packetv4.find('udp')
+            if (udp is not None and udp.srcport == pkt.dhcp.CLIENT_PORT
+                and udp.dstport == pkt.dhcp.SERVER_PORT):
+                return True
+        return self._check(event, mac_to_int(packet.src),
+                           packetv4.srcip.toUnsigned())
+
+    def check_headers (self, event, h):
+        """
+        Like check(), from an IPv4 packet's fastpath Headers
+        """
+        if h.ip_src == 0 and fastpath.is_dhcp_client(h): return True
+        return self._check(event, h.src, h.ip_src)
+
+    def _check (self, event, mac, ip):
+        entry = self.sources.get(mac)
+        if entry is None:
+            slog.event("unknown_source", "IPv4 from unknown MAC %s (IP %s)",
+                       int_to_mac(mac), int_to_ip(ip))
+            return False
+        if entry != ip:
+            mac = int_to_mac(mac)
+            slog.event("ip_spoof", "From MAC=%s, forging IP=%s on %s.%d",
+                       mac, int_to_ip(ip), dpid_to_str(event.dpid),
+                       event.port)
+            self.spoofers.report(event, mac)
+            return False
+        return True
+
+def launch (threshold = 1, window = 10, block_time = 300, proactive = False,
+            bindings = None, watch = 0):
+    """
+    Starts IP Source Guard
+
+    A sender is blocked for block_time seconds once it sends threshold
+    spoofed packets within window seconds.  With proactive, switches are
+    given flows for the valid sources when they connect, so they drop
+    spoofed and unknown sources without asking us.
 
-        msg = of.ofp_packet_out()
-        msg.data = event.ofp
-        msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
-        event.connection.send(msg)
-
-    def blockSpoofer (self, mac, event):
-        spoofer = self.spoofers[mac]
-        match = of.ofp_match(in_port = spoofer.inport)
-        msg = of.ofp_flow_mod (match=match)
-        msg.priprity = 100
-        msg.idle_timeout = of.OFP_FLOW_PERMANENT
-        msg.hard_timeout = of.OFP_FLOW_PERMANENT
-        event.connection.send (msg)
-        spoofer.count = 0
-
-def launch ():
-    core.registerNew (IPSourceGuard)
+    bindings is a file of valid sources in any of DAI's formats (see
+    bindingfile); the built-in ipSecTable is used if it's not given.
+    With watch, the file is checked for changes every watch seconds;
+    sources which are removed have their flows deleted.
+    """
+    core.registerNew (IPSourceGuard, int(threshold), float(window),
+                      int(block_time), proactive = str_to_bool(proactive),
+                      bindings = bindings, watch = float(watch))
 
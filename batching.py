@@ -0,0 +1,159 @@
+"""
+Batching of the messages the components send to switches.
+
+Components send through batched(connection) instead of the connection
+itself.  Messages sent while handling an event are queued per switch,
+and at the end of the cooperative thread's current task they are packed
+and written to the switch in one send, so a burst of PacketIns handled
+in one go costs one write instead of one (or more) per PacketIn.
+
+Within a batch, an add flow_mod identical (same priority, match, actions,
+timeouts, flags and cookie) to one already queued isn't sent again.  If
+it carries a packet (a buffer_id or data), the packet is sent out with a
+packet_out instead, which has the same effect now that the flow is
+there.  Any other flow_mod (e.g., a delete) may undo what was queued
+before it, so adds queued before it aren't matched against.
+
+Optionally a barrier request is appended to each batch containing
+flow_mods, so the switch reports when the batch's flows are in place.
+
+Run this as a component to change the defaults, e.g.:
+  batching --barrier=True --max_batch=200
+or --enabled=False to send every message as soon as it's made.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.util import str_to_bool
+
+log = core.getLogger()
+
+# Whether batched() batches at all
+_enabled = True
+
+# Append a barrier request to batches containing flow_mods
+_barrier = False
+
+# A batch is written as soon as it has this many messages
+_max_batch = 500
+
+# Connection -> MessageBatcher
+_batchers = {}
+
+# Class of message -> number sent through batched connections
+_sent = {}
+
+
+class MessageBatcher (object):
+  """
+  Queues messages for a connection and writes them out in batches
+
+  Looks like the connection otherwise: other attributes are the
+  connection's.
+  """
+  def __init__ (self, connection):
+    self.connection = connection
+    self._queue = []
+    self._flow_mods = {} # Key of each add since the last other flow_mod
+    self._has_flow_mods = False
+    self._flush_scheduled = False
+    connection.addListenerByName("ConnectionDown", self._handle_ConnectionDown)
+
+  def __getattr__ (self, name):
+    return getattr(self.connection, name)
+
+  def send (self, msg):
+    cls = msg.__class__
+    _sent[cls] = _sent.get(cls, 0) + 1
+    if cls is of.ofp_flow_mod:
+      self._has_flow_mods = True
+      if msg.command != of.OFPFC_ADD:
+        # It may delete or change flows added earlier in the batch
+        self._flow_mods = {}
+      else:
+        msg = self._dedup(msg)
+        if msg is None: return
+    self._queue.append(msg)
+    if len(self._queue) >= _max_batch:
+      self.flush()
+    elif not self._flush_scheduled:
+      self._flush_scheduled = True
+      core.callLater(self._scheduled_flush)
+
+  def _dedup (self, msg):
+    """
+    Returns what to queue for an add flow_mod (None for nothing)
+    """
+    key = (msg.priority, msg.match.pack(),
+           b"".join(a.pack() for a in msg.actions), msg.idle_timeout,
+           msg.hard_timeout, msg.flags, msg.cookie)
+    if key not in self._flow_mods:
+      self._flow_mods[key] = True
+      return msg
+    if msg.data is None and msg.buffer_id is None: return None
+    po = of.ofp_packet_out(actions = msg.actions)
+    if msg.data is not None:
+      po.data = msg.data
+    else:
+      po.buffer_id = msg.buffer_id
+      if msg.match.in_port is not None: po.in_port = msg.match.in_port
+    return po
+
+  def _scheduled_flush (self):
+    self._flush_scheduled = False
+    self.flush()
+
+  def flush (self):
+    """
+    Writes out the queued messages
+    """
+    queue = self._queue
+    if not queue: return
+    if _barrier and self._has_flow_mods:
+      queue.append(of.ofp_barrier_request())
+    self._queue = []
+    self._flow_mods = {}
+    self._has_flow_mods = False
+    self.connection.send(b"".join(m if isinstance(m, bytes) else m.pack()
+                                  for m in queue))
+
+  def _handle_ConnectionDown (self, event):
+    self._queue = []
+    self._flow_mods = {}
+    self._has_flow_mods = False
+    _batchers.pop(self.connection, None)
+
+
+def batched (connection):
+  """
+  Returns the MessageBatcher for connection (or connection itself, if
+  batching is off)
+  """
+  if not _enabled or isinstance(connection, MessageBatcher):
+    return connection
+  b = _batchers.get(connection)
+  if b is None:
+    b = _batchers[connection] = MessageBatcher(connection)
+  return b
+
+
+def sent_counts ():
+  """
+  Returns the number of messages sent (through batched()) by type name
+  """
+  return dict((cls.__name__, n) for cls, n in _sent.items())
+
+
+def flush_all ():
+  """
+  Writes out all queued messages now
+  """
+  for b in list(_batchers.values()):
+    b.flush()
+
+
+def launch (enabled = _enabled, barrier = _barrier, max_batch = _max_batch):
+  global _enabled, _barrier, _max_batch
+  _enabled = str_to_bool(enabled)
+  _barrier = str_to_bool(barrier)
+  _max_batch = int(max_batch)
@@ -0,0 +1,177 @@
+"""
+Offline PacketIn benchmark for the security components.
+
+Replays frames from a capture file (or a generated traffic mix) as
+PacketIns into whatever components are loaded after it, using a fake
+OpenFlow nexus and switch connection, then reports PacketIns/second,
+per-packet latency percentiles, OpenFlow messages sent per packet and
+peak memory.  No switches, Mininet or root needed; OpenFlow must not be
+loaded, and the benchmark must come before the component under test:
+
+  ./pox.py --no-openflow NetworkSystemsAssignment1.benchmark \
+      --pcap=attack.pcapng NetworkSystemsAssignment1.portSecurity
+
+Without --pcap, a mix of unicast UDP and ARP between --hosts hosts on
+--ports ports is generated (--packets frames, seeded by --seed), or with
+--scenario, one of the attack scenarios from trafficgen (arpspoof,
+ipspoof, macflood or rogue_dhcp) with --hosts hosts.
+
+PacketIns are given reason OFPR_NO_MATCH, as on a table miss, except for
+the kinds of frame listed in --trapped (dhcp and/or arp), which are
+given OFPR_ACTION, as if sent by a flow.  Use --trapped=dhcp to
+benchmark dhcp_snooping --trap_dhcp, which only inspects DHCP sent to it
+by its trap flows.
+
+With message batching on (see batching), sends are counted as writes
+("raw") rather than by message type; load batching --enabled=False
+before the component under test to count individual messages.
+"""
+
+from pox.core import core
+import pox.lib.packet as pkt
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.lib.util import str_to_dpid
+from array import array
+import random
+import resource
+import timeit
+
+from .replay import install_nexus, RecordingConnection, PortAssigner
+from .replay import make_packet_in, packet_in_reason, read_frames
+from .replay import TRAPPED_KINDS
+from . import trafficgen
+from .batching import flush_all
+
+log = core.getLogger()
+
+_clock = timeit.default_timer
+
+
+def generate_mix (hosts, ports, packets, seed = 0, arp_ratio = 0.1):
+  """
+  Yields (port, frame) for unicast UDP and ARP among hosts
+
+  Host i has MAC 02:00:00:xx:xx:xx and IP 10.x.x.x built from i, and is
+  attached to port i % ports + 1.
+  """
+  rng = random.Random(seed)
+  macs = [EthAddr("02%010x" % (i + 1,)) for i in range(hosts)]
+  ips = [IPAddr(0x0a000000 + i + 1) for i in range(hosts)]
+  for _ in range(packets):
+    s = rng.randrange(hosts)
+    d = rng.randrange(hosts - 1) if hosts > 1 else 0
+    if d >= s and hosts > 1: d += 1
+    if rng.random() < arp_ratio:
+      a = pkt.arp(opcode = pkt.arp.REQUEST, hwsrc = macs[s],
+                  protosrc = ips[s], protodst = ips[d])
+      e = pkt.ethernet(src = macs[s], dst = pkt.ETHER_BROADCAST,
+                       type = pkt.ethernet.ARP_TYPE)
+    else:
+      u = pkt.udp(srcport = rng.randrange(1024, 65536), dstport = 5001)
+      u.payload = b"x" * 18
+      a = pkt.ipv4(srcip = ips[s], dstip = ips[d],
+                   protocol = pkt.ipv4.UDP_PROTOCOL)
+      a.payload = u
+      e = pkt.ethernet(src = macs[s], dst = macs[d],
+                       type = pkt.ethernet.IP_TYPE)
+    e.payload = a
+    yield s % ports + 1, e.pack()
+
+
+def _max_rss ():
+  """
+  Returns the peak resident set size so far (KiB on Linux)
+  """
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _percentile (ordered, p):
+  if not ordered: return 0
+  return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run (frames, dpid = 1, trapped = ()):
+  """
+  Replays (port, frame) pairs into the loaded components and reports
+
+  frames may be any iterable, and is only read as it's replayed, so
+  neither reading nor generating frames counts towards the time taken,
+  and the frames don't count towards the memory used.  trapped is as for
+  replay.packet_in_reason().
+  """
+  nexus = core.openflow
+  con = RecordingConnection(dpid)
+  nexus.connect(con)
+  con.reset_counts()
+
+  latencies = array('d')
+  deliver = nexus.deliver
+  elapsed = 0.0
+  base_rss = _max_rss()
+  for port, data in frames:
+    reason = packet_in_reason(data, trapped)
+    start = _clock()
+    ofp = make_packet_in(data, port, reason)
+    t = _clock()
+    deliver(con, ofp)
+    end = _clock()
+    latencies.append(end - t)
+    elapsed += end - start
+  start = _clock()
+  flush_all()
+  elapsed += _clock() - start
+  peak_rss = _max_rss()
+
+  n = len(latencies)
+  if n == 0:
+    log.warning("No frames to replay")
+    return
+  latencies = sorted(latencies)
+  log.info("%i PacketIns in %.3f s: %.0f PacketIns/s", n, elapsed,
+           n / elapsed if elapsed else 0)
+  log.info("Latency (us): p50 %.1f  p90 %.1f  p99 %.1f  p99.9 %.1f  max %.1f",
+           *[_percentile(latencies, p) * 1e6
+             for p in (0.5, 0.9, 0.99, 0.999, 1.0)])
+  for name, count in sorted(con.counts.items()):
+    log.info("Sent %s: %i (%.3f per PacketIn)", name, count,
+             float(count) / n)
+  if con.bytes_sent:
+    log.info("Sent %i bytes in batches (%.1f per PacketIn)", con.bytes_sent,
+             float(con.bytes_sent) / n)
+  log.info("Peak memory: %i KiB (%i KiB more than before the replay)",
+           peak_rss, peak_rss - base_rss)
+
+
+def launch (pcap = None, scenario = None, hosts = 100, ports = 48,
+            packets = 100000, seed = 0, dpid = "1", trapped = ""):
+  """
+  Replays a capture (or generated mix) once the components are up, then
+  exits
+  """
+  if scenario and scenario not in trafficgen.SCENARIOS:
+    raise RuntimeError("Unknown scenario: %s" % (scenario,))
+  trapped = trapped.replace(',', ' ').split()
+  unknown = set(trapped).difference(TRAPPED_KINDS)
+  if unknown:
+    raise RuntimeError("Unknown trapped frame kinds: %s"
+                       % (" ".join(sorted(unknown)),))
+  install_nexus()
+  ports = int(ports)
+  dpid = str_to_dpid(dpid)
+
+  def start ():
+    if pcap:
+      assign = PortAssigner(ports)
+      frames = ((port if port is not None else assign(data), data)
+                for port, data in read_frames(pcap))
+    elif scenario:
+      frames = trafficgen.generate(scenario, int(hosts), int(packets),
+                                   int(seed))
+    else:
+      frames = generate_mix(int(hosts), ports, int(packets), int(seed))
+    try:
+      run(frames, dpid, trapped)
+    finally:
+      core.quit()
+
+  core.addListenerByName("UpEvent", lambda event: start())
@@ -0,0 +1,368 @@
+"""
+Loading IP/MAC bindings from a file, and reloading it when it changes.
+
+DAI and IPSourceGuard take their bindings from a file given with
+--bindings (the pipeline hands its file to both), in one of three
+formats, chosen by the file's extension:
+
+  .csv   Rows of IP,MAC[,DPID,port], or, if the first row is a header
+         naming the columns (ip, mac, dpid and port), in that row's
+         order.
+  .json  A list of {"ip": ..., "mac": ..., "dpid": ..., "port": ...}
+         objects (dpid and port may be left out), or of [IP, MAC] or
+         [IP, MAC, DPID, port] lists.
+  other  Lines of "IP MAC [DPID port]"; blank lines and anything after
+         a # are ignored.
+
+Large files are converted in bulk: dotted-quad IPs and colon- (or
+hyphen-) separated MACs are turned into integers column by column, with
+NumPy when it's installed and with plain string operations otherwise.
+Only what that doesn't recognize goes through IPAddr and EthAddr, which
+accept every form POX does (and report errors with the line they're on).
+
+With watch set, the file's modification time and size are checked every
+watch seconds.  When they change, the file is read again and compared
+with what was loaded before, and each component is handed just the
+bindings which were added, changed or removed, so it only sends flow
+changes for those.  A file which fails to load is logged and otherwise
+ignored; the previous bindings stay in force.  Replace the file by
+renaming a new one over it, so it's never read half-written:
+
+  ./pox.py NetworkSystemsAssignment1.DAI --bindings=hosts.csv --watch=5 \\
+      NetworkSystemsAssignment1.portSecurity
+"""
+
+from pox.core import core
+from pox.lib.addresses import IPAddr, EthAddr
+from pox.lib.recoco import Timer
+from pox.lib.util import str_to_dpid
+import csv
+import json
+import os
+import re
+
+from .bindings import mac_to_int, ip_to_int
+from . import workers
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+log = core.getLogger()
+
+# Filename -> BindingFile
+_files = {}
+
+_mac_re = re.compile(r"[0-9a-fA-F]{12}$")
+
+# Columns of the CSV formats
+_columns = ("ip", "mac", "dpid", "port")
+
+
+def _text_rows (f):
+  for lineno, line in enumerate(f, 1):
+    line = line.split('#', 1)[0].split()
+    if line: yield lineno, line
+
+
+def _csv_rows (f):
+  order = None
+  for lineno, row in enumerate(csv.reader(f, skipinitialspace = True), 1):
+    if not row or not row[0] or row[0][0] == '#': continue
+    if order is None:
+      order = ()
+      names = [name.strip().lower() for name in row]
+      if "ip" in names:
+        if "mac" not in names:
+          raise RuntimeError("%s: CSV header has no mac column" % (f.name,))
+        order = tuple(names.index(c) for c in _columns if c in names)
+        continue
+    if order:
+      try:
+        row = [row[i] for i in order]
+      except IndexError:
+        row = row[:1] # Reported below as the wrong number of fields
+    yield lineno, row
+
+
+def _json_rows (f):
+  data = json.load(f)
+  if not isinstance(data, list):
+    raise RuntimeError("%s: Expected a JSON list of bindings" % (f.name,))
+  for i, b in enumerate(data):
+    if isinstance(b, dict):
+      b = [b.get(c) for c in _columns]
+      if b[2] is None and b[3] is None: b = b[:2]
+    yield "[%i]" % (i,), [str(field) for field in b]
+
+
+def read_rows (filename):
+  """
+  Returns a list of (where, fields) for each binding in filename
+
+  where is the line number (or, for JSON, the list index) and fields
+  are the strings [IP, MAC] or [IP, MAC, DPID, port].
+  """
+  ext = os.path.splitext(filename)[1].lower()
+  if ext == ".csv":
+    reader = _csv_rows
+  elif ext == ".json":
+    reader = _json_rows
+  else:
+    reader = _text_rows
+  with open(filename) as f:
+    return list(reader(f))
+
+
+def _parse_ip (s):
+  """
+  Converts a plain dotted-quad string to an integer, or returns None
+  """
+  parts = s.split('.')
+  if len(parts) != 4: return None
+  ip = 0
+  for p in parts:
+    if not p.isdigit() or len(p) > 3: return None
+    p = int(p)
+    if p > 255: return None
+    ip = (ip << 8) | p
+  return ip
+
+
+def _parse_mac (s):
+  """
+  Converts a colon- or hyphen-separated MAC string to an integer, or
+  returns None
+  """
+  if len(s) != 17 or s[2] not in ":-": return None
+  s = s.replace(s[2], '')
+  if not _mac_re.match(s): return None
+  return int(s, 16)
+
+
+def _parse_ips_py (ips):
+  """
+  Converts dotted-quad strings to integers; those it can't are None
+  """
+  return [_parse_ip(s) for s in ips]
+
+
+def _parse_macs_py (macs):
+  """
+  Converts MAC strings to integers; those it can't are None
+  """
+  return [_parse_mac(s) for s in macs]
+
+
+_parse_ips = _parse_ips_py
+_parse_macs = _parse_macs_py
+
+if numpy is not None:
+  # ASCII code -> hex digit value, or -1
+  _hex_values = numpy.full(256, -1, dtype = numpy.int64)
+  for _i, _c in enumerate("0123456789abcdef"):
+    _hex_values[ord(_c)] = _hex_values[ord(_c.upper())] = _i
+  _mac_digits = [i for i in range(17) if i % 3 != 2]
+  _mac_seps = [i for i in range(17) if i % 3 == 2]
+  _mac_weights = numpy.array([1 << (4 * i) for i in range(11, -1, -1)],
+                             dtype = numpy.uint64)
+
+  def _as_bytes (strings, width):
+    """
+    Returns (an array of strings' ASCII codes with a row per string,
+    mask of strings which are too long); None if they aren't all ASCII
+    """
+    try:
+      a = numpy.array(strings, dtype = "S%i" % (width,))
+    except UnicodeError:
+      return None
+    too_long = numpy.fromiter((len(s) > width for s in strings),
+                              dtype = bool, count = len(strings))
+    return a.view(numpy.uint8).reshape(len(strings), width), too_long
+
+  def _results (values, bad):
+    values = values.tolist()
+    for i in numpy.flatnonzero(bad).tolist():
+      values[i] = None
+    return values
+
+  def _parse_ips_np (ips):
+    if not ips: return []
+    r = _as_bytes(ips, 15)
+    if r is None: return _parse_ips_py(ips)
+    a, bad = r
+    n = len(ips)
+    ip = numpy.zeros(n, dtype = numpy.int64)
+    octet = numpy.zeros(n, dtype = numpy.int64)
+    digits = numpy.zeros(n, dtype = numpy.int64)
+    dots = numpy.zeros(n, dtype = numpy.int64)
+    # Along the strings a column at a time (shorter ones are NUL-padded)
+    for j in range(15):
+      c = a[:, j].astype(numpy.int64)
+      is_digit = (c >= 48) & (c <= 57)
+      is_dot = c == 46
+      bad |= ~(is_digit | is_dot | (c == 0))
+      octet = numpy.where(is_digit, octet * 10 + c - 48, octet)
+      digits += is_digit
+      bad |= is_dot & ((digits == 0) | (digits > 3) | (octet > 255))
+      ip = numpy.where(is_dot, (ip << 8) | octet, ip)
+      octet[is_dot] = 0
+      digits[is_dot] = 0
+      dots += is_dot
+    bad |= (digits == 0) | (digits > 3) | (octet > 255) | (dots != 3)
+    return _results((ip << 8) | octet, bad)
+
+  def _parse_macs_np (macs):
+    if not macs: return []
+    r = _as_bytes(macs, 17)
+    if r is None: return _parse_macs_py(macs)
+    a, bad = r
+    values = _hex_values[a[:, _mac_digits]]
+    seps = a[:, _mac_seps]
+    bad |= (values < 0).any(axis = 1)
+    same = seps == seps[:, :1] # All colons or all hyphens
+    bad |= ~(same & ((seps == 58) | (seps == 45))).all(axis = 1)
+    values[values < 0] = 0
+    macs = (values.astype(numpy.uint64) * _mac_weights).sum(axis = 1)
+    return _results(macs, bad)
+
+  _parse_ips = _parse_ips_np
+  _parse_macs = _parse_macs_np
+
+
+def load_bindings (filename):
+  """
+  Reads bindings from a file (see above for the formats)
+
+  Returns a list of (IP, MAC, DPID, port) tuples using the integer
+  representations (DPID and port are None if not given).
+  """
+  rows = read_rows(filename)
+  fields = [f for where, f in rows]
+  for where, f in rows:
+    if len(f) != 2 and len(f) != 4:
+      raise RuntimeError("%s:%s: Bad binding (wrong number of fields)"
+                         % (filename, where))
+  ips = _parse_ips([f[0] for f in fields])
+  macs = _parse_macs([f[1] for f in fields])
+
+  r = []
+  append = r.append
+  for (where, f), ip, mac in zip(rows, ips, macs):
+    if ip is not None and mac is not None and len(f) == 2:
+      append((ip, mac, None, None))
+      continue
+    try:
+      if ip is None: ip = ip_to_int(IPAddr(f[0].strip()))
+      if mac is None: mac = mac_to_int(EthAddr(f[1].strip()))
+      if len(f) == 4:
+        dpid, port = str_to_dpid(f[2].strip()), int(f[3])
+      else:
+        dpid, port = None, None
+    except Exception as e:
+      raise RuntimeError("%s:%s: Bad binding (%s)" % (filename, where, e))
+    append((ip, mac, dpid, port))
+  return r
+
+
+def diff (old, new):
+  """
+  Compares two dicts of IP -> (MAC, DPID, port)
+
+  Returns (added, removed): the entries of new which aren't in old, and
+  those of old which aren't in new.  A changed binding is in both.
+  """
+  added = dict((ip, b) for ip, b in new.items() if old.get(ip) != b)
+  removed = dict((ip, b) for ip, b in old.items() if new.get(ip) != b)
+  return added, removed
+
+
+class BindingFile (object):
+  """
+  The bindings in a file, reloaded when it changes
+
+  bindings is a dict of IP -> (MAC, DPID, port), with integer IP and MAC.
+  Handlers are called with the (added, removed) dicts from diff() after
+  each reload which changed anything.
+  """
+  def __init__ (self, filename):
+    self.filename = filename
+    self.handlers = []
+    self._timer = None
+    self._interval = 0
+    self._stat = self._stat_file()
+    self.bindings = self._load()
+    log.info("Loaded %d bindings from %s", len(self.bindings), filename)
+
+  def _stat_file (self):
+    try:
+      st = os.stat(self.filename)
+    except OSError:
+      return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+  def _load (self):
+    return dict((ip, (mac, dpid, port))
+                for ip, mac, dpid, port in load_bindings(self.filename))
+
+  def watch (self, interval):
+    """
+    Checks the file for changes every interval seconds
+
+    If it's already being watched, the shorter of the two intervals is
+    used.
+    """
+    if not interval: return
+    if self._timer is None:
+      workers.at_fork(self._restart_timer)
+    elif interval < self._interval:
+      self._timer.cancel()
+    else:
+      return
+    self._interval = interval
+    self._timer = Timer(interval, self.check, recurring = True)
+
+  def _restart_timer (self, worker):
+    self._timer = Timer(self._interval, self.check, recurring = True)
+
+  def check (self):
+    """
+    Reloads the file if it has changed
+    """
+    st = self._stat_file()
+    if st is None or st == self._stat: return
+    self._stat = st
+    try:
+      bindings = self._load()
+    except Exception as e:
+      log.error("Not reloading %s: %s", self.filename, e)
+      return
+    added, removed = diff(self.bindings, bindings)
+    self.bindings = bindings
+    if not added and not removed: return
+    log.info("Reloaded %s: %i bindings added or changed, %i removed",
+             self.filename, len(added), len(set(removed) - set(added)))
+    for handler in self.handlers:
+      try:
+        handler(added, removed)
+      except Exception:
+        log.exception("Applying changes to %s failed", self.filename)
+
+
+def open_bindings (filename, handler = None, watch = 0):
+  """
+  Returns the BindingFile for filename, loading it the first time
+
+  Components using the same file share it.  If handler is given, it's
+  called with each reload's changes, and if watch is, the file is
+  checked for them every watch seconds (or more often, if another
+  component asked for a shorter interval).
+  """
+  f = _files.get(filename)
+  if f is None:
+    f = _files[filename] = BindingFile(filename)
+  if handler is not None:
+    f.handlers.append(handler)
+  f.watch(watch)
+  return f
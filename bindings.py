@@ -0,0 +1,115 @@
+"""
+IP/MAC binding store shared by the security components.
+
+Addresses are stored as plain integers (IPv4 addresses as unsigned 32-bit
+values, MACs as 48-bit values) so that checking a packet against the
+store is a dict lookup on an int, with no string formatting.
+"""
+
+from pox.lib.addresses import IPAddr, EthAddr
+import struct
+
+_mac_struct = struct.Struct("!HI")
+
+
+def mac_to_int (mac):
+  """
+  Converts an EthAddr to a 48-bit integer
+  """
+  hi, lo = _mac_struct.unpack(mac.toRaw())
+  return (hi << 32) | lo
+
+
+def ip_to_int (ip):
+  """
+  Converts an IPAddr to an unsigned 32-bit integer
+  """
+  return ip.toUnsigned()
+
+
+def int_to_mac (mac):
+  """
+  Converts a 48-bit integer to an EthAddr
+  """
+  return EthAddr(_mac_struct.pack(mac >> 32, mac & 0xffFFffFF))
+
+
+def int_to_ip (ip):
+  """
+  Converts an unsigned 32-bit integer to an IPAddr
+  """
+  return IPAddr(ip)
+
+
+class BindingStore (object):
+  """
+  Authoritative IP -> MAC bindings
+
+  A binding may also record where the host is attached (DPID and port),
+  if that is known.  Bindings added with static=True (e.g., loaded from a
+  file) are not replaced or removed by dynamic ones (e.g., from DHCP
+  snooping) unless static=True is passed again.
+  """
+  def __init__ (self):
+    self._macs = {}      # IP -> MAC
+    self._location = {}  # IP -> (DPID, port) for bindings with a location
+    self._static = set() # IPs of static bindings
+
+  def __len__ (self):
+    return len(self._macs)
+
+  def __contains__ (self, ip):
+    return ip in self._macs
+
+  def mac_for (self, ip):
+    """
+    Returns the MAC bound to ip, or None
+    """
+    return self._macs.get(ip)
+
+  def location_of (self, ip):
+    """
+    Returns (DPID, port) for ip, or None if not known
+    """
+    return self._location.get(ip)
+
+  def items (self):
+    """
+    Returns a list of (IP, MAC, DPID, port) tuples
+    """
+    r = []
+    for ip, mac in self._macs.items():
+      dpid, port = self._location.get(ip, (None, None))
+      r.append((ip, mac, dpid, port))
+    return r
+
+  def add (self, ip, mac, dpid = None, port = None, static = False):
+    """
+    Binds ip to mac
+
+    Returns False if the binding was not changed because ip has a static
+    binding and this one isn't static.
+    """
+    if ip in self._static and not static: return False
+    self._macs[ip] = mac
+    if dpid is not None and port is not None:
+      self._location[ip] = (dpid, port)
+    else:
+      self._location.pop(ip, None)
+    if static: self._static.add(ip)
+    return True
+
+  def remove (self, ip, mac = None, static = False):
+    """
+    Removes the binding for ip
+
+    If mac is given, the binding is only removed if ip is bound to it.
+    Returns True if a binding was removed.
+    """
+    if ip in self._static and not static: return False
+    if ip not in self._macs: return False
+    if mac is not None and self._macs[ip] != mac: return False
+    del self._macs[ip]
+    self._location.pop(ip, None)
+    self._static.discard(ip)
+    return True
@@ -18,20 +18,371 @@ An L2 learning switch.
 It is derived from one written live for an SDN crash course.
 It is somwhat similar to NOX's pyswitch in that it installs
 exact-match rules for each flow.
+
+On top of plain L2 learning it does DHCP snooping: DHCP server messages
+are only accepted from trusted ports, and the leases handed out by the
+server are recorded in a per-switch binding table which other components
+can follow through the BindingAdded and BindingRemoved events.
 """
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+import pox.lib.packet as pkt
+from pox.lib.revent import EventMixin, Event
+from pox.lib.addresses import IP_ANY
+from pox.lib.recoco import Timer
 from pox.lib.util import dpid_to_str, str_to_dpid
 from pox.lib.util import str_to_bool
+import heapq
 import time
 
+from .batching import batched
+from .learning import L2Forwarder
+from .seclog import EventLog
+from . import fastpath
+from . import metrics
+from . import snapshot
+
 log = core.getLogger()
+slog = EventLog(log)
+_metrics = metrics.component("dhcp_snooping")
 
 # We don't want to flood immediately when a switch connects.
 # Can be overriden on commandline.
 _flood_delay = 0
 
+# Lease time (seconds) assumed for an ACK which carries no lease option
+_default_lease = 86400
+
+# How often (seconds) expired bindings are removed
+_expire_interval = 5
+
+# DPID -> set of trusted (DHCP server facing) ports.
+# Switches without an entry trust the first port a server reply is seen on.
+# Can be set on commandline.
+_trusted_ports = {}
+
+# If True, DHCP is trapped to the controller by flows installed when a
+# switch connects, and replies from untrusted ports are dropped by the
+# switch.  Only trapped packets are then inspected for DHCP.
+# Can be overriden on commandline.
+_trap_dhcp = False
+
+# Priority of the DHCP trap flows (above the learning flows)
+_trap_priority = of.OFP_DEFAULT_PRIORITY + 200
+
+
+class BindingAdded (Event):
+  """
+  Raised when a DHCP lease has been snooped on a switch
+  """
+  def __init__ (self, dpid, binding):
+    super(BindingAdded, self).__init__()
+    self.dpid = dpid
+    self.binding = binding
+
+
+class BindingRemoved (Event):
+  """
+  Raised when a binding is released, NAKed, replaced or expires
+  """
+  def __init__ (self, dpid, binding):
+    super(BindingRemoved, self).__init__()
+    self.dpid = dpid
+    self.binding = binding
+
+
+class DHCPBinding (object):
+  """
+  A client's lease as seen by DHCP snooping
+  """
+  __slots__ = ('mac', 'ip', 'port', 'vlan', 'expires')
+
+  def __init__ (self, mac, ip, port, vlan, expires):
+    self.mac = mac
+    self.ip = ip
+    self.port = port
+    self.vlan = vlan # None if untagged
+    self.expires = expires
+
+  def __repr__ (self):
+    return "<DHCPBinding %s %s port:%s vlan:%s expires:%s>" % (
+        self.mac, self.ip, self.port, self.vlan, self.expires)
+
+
+class BindingTable (object):
+  """
+  DHCP snooping bindings for a single switch
+
+  Bindings are keyed by client MAC and indexed by IP.  Lease expiry is
+  tracked in a heap so expire() only touches bindings which have lapsed.
+  Heap entries are not removed when a binding is replaced or released;
+  expire() skips entries which no longer match a live binding.
+  """
+  def __init__ (self):
+    self.by_mac = {}
+    self.by_ip = {}
+    self._heap = []
+    self._seq = 0
+    self._dirty = None # MACs added or removed, once track_changes()d
+
+  def __len__ (self):
+    return len(self.by_mac)
+
+  def __contains__ (self, mac):
+    return mac in self.by_mac
+
+  def __iter__ (self):
+    return iter(self.by_mac.values())
+
+  def get (self, mac):
+    return self.by_mac.get(mac)
+
+  def get_by_ip (self, ip):
+    return self.by_ip.get(ip)
+
+  def mac_for (self, ip):
+    """
+    Returns the MAC leased ip, or None (for proxy ARP)
+    """
+    binding = self.by_ip.get(ip)
+    return None if binding is None else binding.mac
+
+  def track_changes (self):
+    """
+    Starts keeping track of which MACs' bindings are added or removed
+    """
+    if self._dirty is None: self._dirty = set()
+
+  def changes (self):
+    """
+    Returns the MACs whose bindings changed since the last call
+    """
+    dirty = self._dirty
+    if dirty is None: return ()
+    self._dirty = set()
+    return dirty
+
+  def add (self, mac, ip, port, vlan, expires):
+    """
+    Adds or replaces the binding for mac
+
+    Returns (new binding, list of bindings it displaced).  A binding is
+    displaced if it had the same MAC, or had the same IP under another MAC.
+    """
+    old = []
+    b = self.remove(mac)
+    if b is not None: old.append(b)
+    b = self.by_ip.get(ip)
+    if b is not None: old.append(self.remove(b.mac))
+    b = DHCPBinding(mac, ip, port, vlan, expires)
+    self.by_mac[mac] = b
+    self.by_ip[ip] = b
+    if self._dirty is not None: self._dirty.add(mac)
+    self._seq += 1
+    heapq.heappush(self._heap, (expires, self._seq, mac))
+    return b, old
+
+  def remove (self, mac):
+    """
+    Removes and returns the binding for mac (or None)
+    """
+    b = self.by_mac.pop(mac, None)
+    if b is None: return None
+    if self.by_ip.get(b.ip) is b:
+      del self.by_ip[b.ip]
+    if self._dirty is not None: self._dirty.add(mac)
+    return b
+
+  def expire (self, now = None):
+    """
+    Removes and returns bindings whose leases ended by now
+    """
+    if now is None: now = time.time()
+    heap = self._heap
+    expired = []
+    while heap and heap[0][0] <= now:
+      expires, _, mac = heapq.heappop(heap)
+      b = self.by_mac.get(mac)
+      if b is not None and b.expires == expires:
+        expired.append(self.remove(mac))
+    return expired
+
+
+class DHCPSnooper (object):
+  """
+  DHCP snooping state for a single OpenFlow switch
+
+  Checks DHCP messages seen by the switch, dropping server replies from
+  untrusted ports and keeping the switch's binding table up to date from
+  the rest.  Client ports are looked up in the switch's address/port
+  table (macToPort), which the client's own requests will have updated.
+  """
+  def __init__ (self, connection, owner, macToPort, trusted_ports = None,
+                trap = None):
+    self.connection = batched(connection)
+    self.macToPort = macToPort
+
+    # Component we raise binding events on
+    self.owner = owner
+
+    # If no trusted ports were configured for this switch, we trust the
+    # first port a DHCP server reply arrives on.
+    if trusted_ports is None:
+      trusted_ports = _trusted_ports.get(connection.dpid, ())
+    self.trusted_ports = set(trusted_ports)
+    self.learn_server_port = not self.trusted_ports
+    self.trap = _trap_dhcp if trap is None else trap
+
+    self.bindings = BindingTable()
+    self._expire_timer = Timer(_expire_interval, self._expire_bindings,
+                               recurring = True)
+    if self.trap:
+      self.install_traps()
+    snapshot.track_dhcp(self)
+    metrics.gauge("dhcp_bindings.%s" % (dpid_to_str(connection.dpid),),
+                  self.bindings.__len__)
+
+    connection.addListeners(self)
+
+  def inspect (self, event):
+    """
+    Snoops event's packet if it's DHCP
+
+    Returns False if the packet must not be forwarded.  Only DHCP is
+    parsed here.
+    """
+    # With DHCP trapped, anything that missed the flow table isn't DHCP
+    if self.trap and event.ofp.reason != of.OFPR_ACTION: return True
+    h = fastpath.headers(event)
+    if h is not None and not fastpath.is_dhcp(h): return True
+    packet = event.parsed
+    dhcp = packet.find('dhcp')
+    if dhcp is None: return True
+    return self.snoop(event, packet, dhcp)
+
+  def is_trusted (self, port):
+    """
+    Is port allowed to send DHCP server messages?
+    """
+    if port in self.trusted_ports: return True
+    if self.learn_server_port:
+      self.learn_server_port = False
+      self.trusted_ports.add(port)
+      log.info("%s: Valid DHCP server on port %s",
+               dpid_to_str(self.connection.dpid), port)
+      if self.trap:
+        self.install_traps()
+      return True
+    return False
+
+  def install_traps (self):
+    """
+    Installs flows sending DHCP to the controller
+
+    Client messages are always trapped.  Server replies are trapped on
+    trusted ports and dropped on all others; until we know a trusted
+    port, they are trapped everywhere.
+    """
+    def trap (tp_src, tp_dst, in_port = None, priority = _trap_priority,
+              to_controller = True):
+      msg = of.ofp_flow_mod()
+      msg.match = of.ofp_match(dl_type = pkt.ethernet.IP_TYPE,
+                               nw_proto = pkt.ipv4.UDP_PROTOCOL,
+                               tp_src = tp_src, tp_dst = tp_dst,
+                               in_port = in_port)
+      msg.priority = priority
+      if to_controller:
+        msg.actions.append(of.ofp_action_output(port = of.OFPP_CONTROLLER))
+      self.connection.send(msg)
+
+    trap(pkt.dhcp.CLIENT_PORT, pkt.dhcp.SERVER_PORT)
+    if not self.trusted_ports:
+      trap(pkt.dhcp.SERVER_PORT, pkt.dhcp.CLIENT_PORT)
+      return
+    trap(pkt.dhcp.SERVER_PORT, pkt.dhcp.CLIENT_PORT, to_controller = False)
+    for port in self.trusted_ports:
+      trap(pkt.dhcp.SERVER_PORT, pkt.dhcp.CLIENT_PORT, in_port = port,
+           priority = _trap_priority + 1)
+
+  def restore (self, server_ports, bindings):
+    """
+    Takes up state saved before a restart (see snapshot)
+
+    server_ports are DHCP server ports, which we trust if we'd otherwise
+    learn one; bindings are (mac, ip, port, vlan, expires) tuples.
+    """
+    if server_ports and self.learn_server_port:
+      self.learn_server_port = False
+      self.trusted_ports.update(server_ports)
+      if self.trap:
+        self.install_traps()
+    now = time.time()
+    for mac, ip, port, vlan, expires in bindings:
+      if expires <= now: continue
+      b, old = self.bindings.add(mac, ip, port, vlan, expires)
+      for o in old: self._unbind(o)
+      if self.owner is not None:
+        self.owner.raiseEvent(BindingAdded, self.connection.dpid, b)
+
+  def snoop (self, event, packet, dhcp):
+    """
+    Updates the binding table from a DHCP message
+
+    Returns False if the message must not be forwarded.
+    """
+    msg_type = dhcp.options.get(dhcp.MSG_TYPE_OPT)
+    if msg_type is not None: msg_type = msg_type.type
+
+    if dhcp.op == dhcp.BOOTREPLY:
+      if not self.is_trusted(event.port):
+        slog.event("rogue_dhcp", "Rogue DHCP server %s on %s.%s -- dropping",
+                   packet.src, dpid_to_str(event.dpid), event.port)
+        return False
+      if msg_type == dhcp.ACK_MSG:
+        self._bind(packet, dhcp)
+      elif msg_type == dhcp.NAK_MSG:
+        self._unbind(self.bindings.remove(dhcp.chaddr))
+    elif msg_type in (dhcp.RELEASE_MSG, dhcp.DECLINE_MSG):
+      # Only the port the client is bound on may give its lease up
+      b = self.bindings.get(dhcp.chaddr)
+      if b is not None and b.port == event.port:
+        self._unbind(self.bindings.remove(dhcp.chaddr))
+    return True
+
+  def _bind (self, packet, dhcp):
+    port = self.macToPort.get(dhcp.chaddr)
+    if port is None or port in self.trusted_ports:
+      log.debug("No client port for DHCP ACK to %s", dhcp.chaddr)
+      return
+    if dhcp.yiaddr == IP_ANY: return # Reply to an INFORM; nothing leased
+    lease = dhcp.options.get(dhcp.REQUEST_LEASE_OPT)
+    lease = lease.seconds if lease is not None else _default_lease
+    vlan = packet.find('vlan')
+    if vlan is not None: vlan = vlan.id
+    b, old = self.bindings.add(dhcp.chaddr, dhcp.yiaddr, port, vlan,
+                               time.time() + lease)
+    for o in old: self._unbind(o)
+    log.debug("%s: DHCP binding %s", dpid_to_str(self.connection.dpid), b)
+    if self.owner is not None:
+      self.owner.raiseEvent(BindingAdded, self.connection.dpid, b)
+
+  def _unbind (self, binding):
+    if binding is None: return
+    if self.owner is not None:
+      self.owner.raiseEvent(BindingRemoved, self.connection.dpid, binding)
+
+  def _expire_bindings (self):
+    for b in self.bindings.expire():
+      self._unbind(b)
+
+  def _handle_ConnectionDown (self, event):
+    self._expire_timer.cancel()
+    metrics.remove_gauge("dhcp_bindings.%s" % (dpid_to_str(event.dpid),))
+    for b in list(self.bindings):
+      self._unbind(self.bindings.remove(b.mac))
+
+
 class LearningSwitch (object):
   """
   The learning switch "brain" associated with a single OpenFlow switch.
@@ -44,53 +395,38 @@ class LearningSwitch (object):
   from some source coming from some port, we know that source is out
   that port.
 
-  When we want to forward traffic, we look up the desintation in our
-  table.  If we don't know the port, we simply send the message out
-  all ports except the one it came in on.  (In the presence of loops,
-  this is bad!).
-
-  In short, our algorithm looks like this:
-
   For each packet from the switch:
-  1) Use source address and switch port to update address/port table
-  2) Is transparent = False and either Ethertype is LLDP or the packet's
-     destination address is a Bridge Filtered address?
-     Yes:
-        2a) Drop packet -- don't forward link-local traffic (LLDP, 802.1x)
-            DONE
-  3) Is destination multicast?
+  0) Is it a DHCP message which DHCP snooping rejects?
      Yes:
-        3a) Flood the packet
+        0a) Drop packet
             DONE
-  4) Port for destination address in our address/port table?
-     No:
-        4a) Flood the packet
-            DONE
-  5) Is output port the same as input port?
-     Yes:
-        5a) Drop packet and similar ones for a while
-  6) Install flow table entry in the switch so that this
-     flow goes out the appopriate port
-     6a) Send the packet out appropriate port
+  1) Use source address and switch port to update address/port table
+  2-6) Forward as described in learning.L2Forwarder
   """
-  is_dhcp_server_found = False
-  dhcp_server_port = 3
-
-  def __init__ (self, connection, transparent):
+  def __init__ (self, connection, transparent, owner = None):
     # Switch we'll be adding L2 learning switch capabilities to
     self.connection = connection
     self.transparent = transparent
 
+    self.forwarder = L2Forwarder(connection, transparent, _flood_delay)
+
     # Our table
-    self.macToPort = {}
+    self.macToPort = self.forwarder.macToPort
+
+    self.snooper = DHCPSnooper(connection, owner, self.macToPort)
+
+    # Without trap flows, we only see a server's replies to a client if
+    # flows can't match on the destination alone
+    if not self.snooper.trap:
+      self.forwarder.limit_granularity("src_dst")
+
+    # Answer ARP requests for leased addresses instead of flooding them
+    self.forwarder.arp_resolver = self.snooper.bindings.mac_for
 
     # We want to hear PacketIn messages, so we listen
     # to the connection
     connection.addListeners(self)
 
-    # We just use this to know when to log a helpful message
-    self.hold_down_expired = _flood_delay == 0
-
     #log.debug("Initializing LearningSwitch, transparent=%s",
     #          str(self.transparent))
 
@@ -99,102 +435,30 @@ class LearningSwitch (object):
     Handle packet in messages from the switch to implement above algorithm.
     """
 
-    packet = event.parsed
-    packetdhcp = packet.find('udp')
-
-    def flood (message = None):
-      """ Floods the packet """
-      msg = of.ofp_packet_out()
-      if time.time() - self.connection.connect_time >= _flood_delay:
-        # Only flood if we've been connected for a little while...
-
-        if self.hold_down_expired is False:
-          # Oh yes it is!
-          self.hold_down_expired = True
-          log.info("%s: Flood hold-down expired -- flooding",
-              dpid_to_str(event.dpid))
-
-        if message is not None: log.debug(message)
-        #log.debug("%i: flood %s -> %s", event.dpid,packet.src,packet.dst)
-        # OFPP_FLOOD is optional; on some switches you may need to change
-        # this to OFPP_ALL.
-        msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
-      else:
-        pass
-        #log.info("Holding down flood for %s", dpid_to_str(event.dpid))
-      msg.data = event.ofp
-      msg.in_port = event.port
-      self.connection.send(msg)
+    t = t0 = _metrics.start()
+    if not self.snooper.inspect(event): # 0
+      self.forwarder.drop(event) # 0a
+      _metrics.done(t0, "rogue_dhcp")
+      return
+    if t: t = _metrics.lap("check", t)
 
-    def drop (duration = None):
-      """
-      Drops this packet and optionally installs a flow to continue
-      dropping similar ones for a while
-      """
-      if duration is not None:
-        if not isinstance(duration, tuple):
-          duration = (duration,duration)
-        msg = of.ofp_flow_mod()
-        msg.match = of.ofp_match.from_packet(packet)
-        msg.idle_timeout = duration[0]
-        msg.hard_timeout = duration[1]
-        msg.buffer_id = event.ofp.buffer_id
-        self.connection.send(msg)
-      elif event.ofp.buffer_id is not None:
-        msg = of.ofp_packet_out()
-        msg.buffer_id = event.ofp.buffer_id
-        msg.in_port = event.port
-        self.connection.send(msg)
-
-    if packetdhcp is not None and self.is_dhcp_server_found == False:
-      if packetdhcp.srcport == 67:
-        self.dhcp_server_port = event.port
-        self.is_dhcp_server_found = True
-        log.info("Valid DHCP server")
-        
-    if packetdhcp is not None and self.is_dhcp_server_found == True:
-      if packetdhcp.srcport == 67:
-        if event.port != self.dhcp_server_port:
-          log.info("Rogue DHCP server in town droping packets")
-          drop()
-          return
+    packet = event.parsed
+    if t: t = _metrics.lap("parse", t)
 
     self.macToPort[packet.src] = event.port # 1
+    if t: t = _metrics.lap("learn", t)
 
-    if not self.transparent: # 2
-      if packet.type == packet.LLDP_TYPE or packet.dst.isBridgeFiltered():
-        drop() # 2a
-        return
-
-    if packet.dst.is_multicast:
-      flood() # 3a
-    else:
-      if packet.dst not in self.macToPort: # 4
-        flood("Port for %s unknown -- flooding" % (packet.dst,)) # 4a
-      else:
-        port = self.macToPort[packet.dst]
-        if port == event.port: # 5
-          # 5a
-          log.warning("Same port for packet from %s -> %s on %s.%s.  Drop."
-              % (packet.src, packet.dst, dpid_to_str(event.dpid), port))
-          drop(10)
-          return
-        # 6
-        log.debug("installing flow for %s.%i -> %s.%i" %
-                  (packet.src, event.port, packet.dst, port))
-        msg = of.ofp_flow_mod()
-        msg.match = of.ofp_match.from_packet(packet, event.port)
-        msg.idle_timeout = 10
-        msg.hard_timeout = 30
-        msg.actions.append(of.ofp_action_output(port = port))
-        msg.data = event.ofp # 6a
-        self.connection.send(msg)
-
-
-class l2_learning (object):
-  """
-  Waits for OpenFlow switches to connect and makes them learning switches.
+    self.forwarder.forward(event, packet, _metrics, t) # 2-6
+    _metrics.done(t0, "forwarded")
+
+
+class dhcp_snooping (EventMixin):
+  """
+  Waits for OpenFlow switches to connect and makes them learning switches
+  which do DHCP snooping.
   """
+  _eventMixin_events = set([BindingAdded, BindingRemoved])
+
   def __init__ (self, transparent, ignore = None):
     """
     Initialize
@@ -211,12 +475,35 @@ class l2_learning (object):
       log.debug("Ignoring connection %s" % (event.connection,))
       return
     log.debug("Connection %s" % (event.connection,))
-    LearningSwitch(event.connection, self.transparent)
+    LearningSwitch(event.connection, self.transparent, self)
 
 
-def launch (transparent=False, hold_down=_flood_delay, ignore = None):
+def parse_trusted_ports (trusted):
+  """
+  Parses a string of DPID:port pairs into a dict of DPID -> set of ports
+  """
+  r = {}
+  for entry in trusted.replace(',', ' ').split():
+    try:
+      dpid, port = entry.rsplit(':', 1)
+      dpid = str_to_dpid(dpid)
+      port = int(port)
+    except:
+      raise RuntimeError("Expected trusted ports as DPID:port, got %s"
+                         % (entry,))
+    r.setdefault(dpid, set()).add(port)
+  return r
+
+
+def launch (transparent=False, hold_down=_flood_delay, ignore = None,
+            trusted = None, trap_dhcp = _trap_dhcp):
   """
-  Starts an L2 learning switch.
+  Starts an L2 learning switch with DHCP snooping.
+
+  trusted is a list of DPID:port pairs on which DHCP servers may reply,
+  e.g. --trusted=00-00-00-00-00-01:3,00-00-00-00-00-02:1
+  trap_dhcp installs flows so only DHCP is inspected by the controller
+  and untrusted server replies are dropped by the switch.
   """
   try:
     global _flood_delay
@@ -229,4 +516,10 @@ def launch (transparent=False, hold_down=_flood_delay, ignore = None):
     ignore = ignore.replace(',', ' ').split()
     ignore = set(str_to_dpid(dpid) for dpid in ignore)
 
-  core.registerNew(l2_learning, str_to_bool(transparent), ignore)
+  if trusted:
+    _trusted_ports.update(parse_trusted_ports(trusted))
+
+  global _trap_dhcp
+  _trap_dhcp = str_to_bool(trap_dhcp)
+
+  core.registerNew(dhcp_snooping, str_to_bool(transparent), ignore)
@@ -0,0 +1,123 @@
+"""
+Classifying PacketIns from their raw bytes.
+
+POX parses a PacketIn's data into a tree of packet objects the first
+time event.parsed is used, which costs far more than the security checks
+themselves need: those only look at a few fields (the MACs, ARP's sender
+addresses, IPv4's source, the UDP ports).  headers(event) reads just
+those at fixed offsets with struct, into a Headers record, so a check
+which stops a packet never has it parsed; event.parsed is only needed
+for what gets forwarded, or to look deeper (e.g., at DHCP options).
+
+Headers hold MACs and IP addresses as integers, as BindingStore and
+MacTable do (see bindings for converting them).
+"""
+
+import struct
+
+ETH_VLAN = 0x8100
+ETH_ARP = 0x0806
+ETH_IPV4 = 0x0800
+IP_TCP = 6
+IP_UDP = 17
+
+_DHCP_PORTS = (67, 68)
+
+_eth = struct.Struct("!HIHIH")        # dst, src (each 16 + 32 bits), type
+_tag = struct.Struct("!HH")           # 802.1Q TCI, type
+_arp = struct.Struct("!HHBBHHIIHII")  # htype..op, sha, spa, tha, tpa
+_ipv4 = struct.Struct("!BBHHHBBHII")
+_ports = struct.Struct("!HH")
+
+
+class Headers (object):
+  """
+  The fields of a frame the security checks look at
+
+  Fields of headers the frame doesn't have (or which are truncated) are
+  None; e.g., arp_op is only set for an Ethernet/IPv4 ARP, and sport and
+  dport for the first fragment of TCP or UDP.
+  """
+  __slots__ = ('dst', 'src', 'vlan', 'type', 'arp_op', 'arp_sha', 'arp_spa',
+               'arp_tpa', 'ip_src', 'ip_dst', 'ip_proto', 'sport', 'dport')
+
+  def __init__ (self, dst, src, vlan, type):
+    self.dst = dst
+    self.src = src
+    self.vlan = vlan
+    self.type = type
+    self.arp_op = self.arp_sha = self.arp_spa = self.arp_tpa = None
+    self.ip_src = self.ip_dst = self.ip_proto = None
+    self.sport = self.dport = None
+
+  def __repr__ (self):
+    return "<Headers %012x -> %012x type:%04x vlan:%s>" % (
+        self.src, self.dst, self.type, self.vlan)
+
+
+def classify (data):
+  """
+  Returns the Headers of a frame, or None if it's truncated
+  """
+  n = len(data)
+  if n < 14: return None
+  dh, dl, sh, sl, t = _eth.unpack_from(data)
+  off = 14
+  vlan = None
+  if t == ETH_VLAN:
+    if n < 18: return None
+    tci, t = _tag.unpack_from(data, 14)
+    vlan = tci & 0xfff
+    off = 18
+  h = Headers((dh << 32) | dl, (sh << 32) | sl, vlan, t)
+
+  if t == ETH_ARP:
+    if n >= off + 28:
+      (htype, ptype, hlen, plen, op, shh, shl, spa,
+       _, _, tpa) = _arp.unpack_from(data, off)
+      if htype == 1 and ptype == ETH_IPV4 and hlen == 6 and plen == 4:
+        h.arp_op = op
+        h.arp_sha = (shh << 32) | shl
+        h.arp_spa = spa
+        h.arp_tpa = tpa
+  elif t == ETH_IPV4:
+    if n >= off + 20:
+      vihl, _, _, _, frag, _, proto, _, src, dst = _ipv4.unpack_from(data, off)
+      if vihl >> 4 == 4:
+        h.ip_src = src
+        h.ip_dst = dst
+        h.ip_proto = proto
+        off += (vihl & 0xf) * 4
+        if ((proto == IP_UDP or proto == IP_TCP) and not frag & 0x1fff
+            and n >= off + 4):
+          h.sport, h.dport = _ports.unpack_from(data, off)
+  return h
+
+
+def headers (event):
+  """
+  Returns the Headers of a PacketIn's frame (or None if it's truncated)
+
+  They're worked out once per event, however many components ask.
+  """
+  try:
+    return event._fast_headers
+  except AttributeError:
+    pass
+  h = event._fast_headers = classify(event.data)
+  return h
+
+
+def is_dhcp (h):
+  """
+  Could the frame with Headers h be DHCP (UDP to a DHCP port)?
+  """
+  return h.ip_proto == IP_UDP and h.dport in _DHCP_PORTS
+
+
+def is_dhcp_client (h):
+  """
+  Is the frame with Headers h UDP from a DHCP client to a server?
+  """
+  return (h.ip_proto == IP_UDP and h.sport == _DHCP_PORTS[1]
+          and h.dport == _DHCP_PORTS[0])
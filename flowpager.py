@@ -0,0 +1,102 @@
+"""
+Paced installation of large numbers of flows.
+
+When a switch connects, the proactive modes of DAI and IP Source Guard
+push a flow (or two) for every known binding.  Sending thousands of
+flow_mods at once can overrun the switch's receive queue, so a FlowPager
+sends them a page at a time: each page ends with a barrier request, and
+the next page goes out when the switch has answered it (or after a
+timeout, for switches which are slow to answer barriers).
+
+Run this as a component to change the defaults, e.g.:
+  flowpager --page_size=100 --timeout=2
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.util import dpid_to_str
+import itertools
+
+from .batching import batched
+
+log = core.getLogger()
+
+# flow_mods per page
+_page_size = 200
+
+# Seconds to wait for a page's barrier reply before sending the next page
+_timeout = 5
+
+
+def table_miss_flow ():
+  """
+  Returns a lowest-priority flow sending anything unmatched to us
+  """
+  msg = of.ofp_flow_mod()
+  msg.match = of.ofp_match()
+  msg.priority = 0
+  msg.actions.append(of.ofp_action_output(port = of.OFPP_CONTROLLER))
+  return msg
+
+
+class FlowPager (object):
+  """
+  Sends the messages from an iterable to a switch, a page at a time
+
+  The messages are only taken from the iterable as they're sent, so it
+  can be a generator.
+  """
+  def __init__ (self, connection, messages, page_size = None):
+    self.connection = connection
+    self.page_size = page_size or _page_size
+    self.sent = 0
+    self._messages = iter(messages)
+    self._xid = None
+    self._listeners = connection.addListeners(self)
+    self._send_page()
+
+  def _send_page (self):
+    page = list(itertools.islice(self._messages, self.page_size))
+    if not page:
+      self._finish()
+      return
+    out = batched(self.connection)
+    for msg in page:
+      out.send(msg)
+    self.sent += len(page)
+    barrier = of.ofp_barrier_request()
+    self._xid = xid = barrier.xid
+    out.send(barrier)
+    core.callDelayed(_timeout, self._timed_out, xid)
+
+  def _timed_out (self, xid):
+    if xid != self._xid: return
+    log.debug("%s: No barrier reply for flow page; sending next page",
+              dpid_to_str(self.connection.dpid))
+    self._send_page()
+
+  def _stop_listening (self):
+    # Not done directly since we may be in the middle of an event
+    if self._listeners:
+      core.callLater(self.connection.removeListeners, self._listeners)
+      self._listeners = None
+
+  def _finish (self):
+    self._xid = None
+    self._stop_listening()
+    log.debug("%s: Installed %i proactive flows",
+              dpid_to_str(self.connection.dpid), self.sent)
+
+  def _handle_BarrierIn (self, event):
+    if event.xid != self._xid: return
+    self._send_page()
+
+  def _handle_ConnectionDown (self, event):
+    self._xid = None
+    self._stop_listening()
+
+
+def launch (page_size = _page_size, timeout = _timeout):
+  global _page_size, _timeout
+  _page_size = int(page_size)
+  _timeout = float(timeout)
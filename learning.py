@@ -0,0 +1,371 @@
+# Copyright 2011-2012 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The forwarding half of an L2 learning switch.
+
+This is the forwarding logic of POX's l2_learning, shared by the
+learning switches in this package (dhcp_snooping, portSecurity,
+IPSourceGuard and the security pipeline).  Learning the source address
+is left to the caller, since the security components have their own
+rules about what may be learned.
+
+The address table is a mactable.MacTable, so entries age out and the
+table can't grow without bound.  When an entry is evicted, the flows
+forwarding to that MAC are deleted from the switch too.
+
+How specific the installed flows are is configurable.  The default,
+"exact", matches every header of the packet, as l2_learning does, so
+each new connection between two hosts comes to the controller.  "src_dst"
+matches only the ingress port and the source and destination MACs, and
+"dst" only the destination MAC, so one flow carries all traffic to a
+host.  Components which must see more traffic than that (e.g. port
+security must see every new source on a port) make their switches'
+flows finer with limit_granularity().
+
+Flooding can be bounded: with flood budgets set, each switch, and each
+port of it, has a token bucket of floods, and packets which would flood
+beyond either are dropped instead.  The budgets are off by default,
+since legitimate broadcast (ARP, DHCP) can exceed any fixed rate.  If the owner gives the forwarder an arp_resolver (a
+function from IPAddr to EthAddr or None, backed by its binding table),
+ARP requests for known addresses are answered by proxy ARP instead of
+being flooded.  flood_counts counts floods, proxy ARP replies and
+floods suppressed by each budget.
+
+Run this as a component to set the defaults, e.g.:
+  learning --granularity=src_dst --idle_timeout=60 --hard_timeout=300
+  learning --flood_rate=500 --port_flood_rate=20
+A flood rate of 0 turns that budget off.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.util import dpid_to_str
+import time
+
+from .batching import batched
+from .mactable import MacTable
+from .ratelimit import TokenBucket
+from .seclog import EventLog
+from . import proxyarp
+from . import metrics
+from . import reconcile
+from . import snapshot
+
+log = core.getLogger()
+slog = EventLog(log)
+
+# Flow granularities, finest first
+GRANULARITIES = ("exact", "src_dst", "dst")
+
+# How specific forwarding flows are, and their timeouts.
+# Can be overriden on commandline.
+_granularity = "exact"
+_idle_timeout = 10
+_hard_timeout = 30
+
+# Floods per second (and burst) allowed per switch and per port; a rate
+# of 0 means no limit.
+# Can be overriden on commandline.
+_flood_rate = 0
+_flood_burst = 2000
+_port_flood_rate = 0
+_port_flood_burst = 200
+
+
+class L2Forwarder (object):
+  """
+  Forwards packets for a single OpenFlow switch using an address table
+
+  When we want to forward traffic, we look up the desintation in our
+  table.  If we don't know the port, we simply send the message out
+  all ports except the one it came in on.  (In the presence of loops,
+  this is bad!).
+
+  For each packet handed to forward():
+  2) Is transparent = False and either Ethertype is LLDP or the packet's
+     destination address is a Bridge Filtered address?
+     Yes:
+        2a) Drop packet -- don't forward link-local traffic (LLDP, 802.1x)
+            DONE
+  3) Is destination multicast?
+     Yes:
+        3a) Flood the packet (see below)
+            DONE
+  4) Port for destination address in our address/port table?
+     No:
+        4a) Flood the packet (see below)
+            DONE
+  5) Is output port the same as input port?
+     Yes:
+        5a) Drop packet and similar ones for a while
+  6) Install flow table entry in the switch so that this
+     flow goes out the appopriate port
+     6a) Send the packet out appropriate port
+
+  (Step 1, learning the source address, is up to the caller.)
+
+  Flooding a packet means:
+  F1) Is it an ARP request for an address arp_resolver knows?
+      Yes:
+         F1a) Answer it ourselves out of its ingress port
+              DONE
+  F2) Is the port or the switch over its flood budget?
+      Yes:
+         F2a) Drop packet
+              DONE
+  F3) Send the packet out of all ports but its ingress port
+  """
+  def __init__ (self, connection, transparent, flood_delay = 0,
+                granularity = None, idle_timeout = None, hard_timeout = None):
+    self.connection = batched(connection)
+    self.transparent = transparent
+
+    # How specific forwarding flows are, and their timeouts
+    self.granularity = granularity or _granularity
+    self.idle_timeout = (_idle_timeout if idle_timeout is None
+                         else idle_timeout)
+    self.hard_timeout = (_hard_timeout if hard_timeout is None
+                         else hard_timeout)
+
+    # We don't want to flood immediately when a switch connects.
+    self.flood_delay = flood_delay
+
+    # Our table
+    self.macToPort = MacTable()
+    self.macToPort.evict_handlers.append(self._evicted)
+    snapshot.track_macs(connection.dpid, self.macToPort)
+
+    # We just use this to know when to log a helpful message
+    self.hold_down_expired = flood_delay == 0
+
+    # Flood budgets: one for the switch, and one per port (made as needed)
+    self._flood_bucket = None
+    if _flood_rate:
+      self._flood_bucket = TokenBucket(_flood_rate, _flood_burst)
+    self._port_buckets = {}
+
+    # IPAddr -> EthAddr (or None) for proxy ARP; set by our owner
+    self.arp_resolver = None
+
+    self.flood_counts = {"flooded" : 0, "proxy_arp" : 0,
+                         "port_limited" : 0, "switch_limited" : 0}
+
+    connection.addListeners(self)
+
+    # Picks up the switch's existing flows, if reconcile is loaded
+    self.reconciler = reconcile.reconcile(self)
+
+    name = dpid_to_str(connection.dpid)
+    metrics.gauge("mac_table." + name, self.macToPort.__len__)
+    metrics.gauge("floods." + name, lambda: dict(self.flood_counts))
+
+  def _evicted (self, mac, port):
+    """
+    Deletes the flows forwarding to a MAC which has left the table
+    """
+    msg = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+    msg.match = of.ofp_match(dl_dst = mac)
+    msg.out_port = port
+    self.connection.send(msg)
+
+  def _handle_ConnectionDown (self, event):
+    self.macToPort.stop()
+    name = dpid_to_str(event.dpid)
+    metrics.remove_gauge("mac_table." + name)
+    metrics.remove_gauge("floods." + name)
+
+  def limit_granularity (self, granularity):
+    """
+    Makes forwarding flows at least as fine as granularity
+    """
+    if (GRANULARITIES.index(granularity)
+        < GRANULARITIES.index(self.granularity)):
+      log.debug("%s: Using %s flows instead of %s",
+                dpid_to_str(self.connection.dpid), granularity,
+                self.granularity)
+      self.granularity = granularity
+
+  def match_for (self, event, packet):
+    """
+    Returns the match for a forwarding flow for packet
+    """
+    if self.granularity == "dst":
+      return of.ofp_match(dl_dst = packet.dst)
+    if self.granularity == "src_dst":
+      return of.ofp_match(in_port = event.port, dl_src = packet.src,
+                          dl_dst = packet.dst)
+    return of.ofp_match.from_packet(packet, event.port)
+
+  def _proxy_arp (self, event):
+    """
+    Answers the packet if it's an ARP request arp_resolver can answer
+
+    Returns True if it did.
+    """
+    packet = event.parsed
+    arp = packet.find('arp')
+    if arp is None or not proxyarp.should_answer(arp): return False
+    mac = self.arp_resolver(arp.protodst)
+    if mac is None or mac == arp.hwsrc: return False
+    proxyarp.answer(self.connection, event, packet, arp, mac)
+    self.flood_counts["proxy_arp"] += 1
+    return True
+
+  def _flood_allowed (self, event):
+    """
+    Takes a flood from the port's and the switch's budgets
+
+    Returns False if either is used up.
+    """
+    now = time.time()
+    bucket = self._port_buckets.get(event.port)
+    if bucket is None and _port_flood_rate:
+      bucket = TokenBucket(_port_flood_rate, _port_flood_burst)
+      self._port_buckets[event.port] = bucket
+    if bucket is not None and not bucket.consume(1, now):
+      self.flood_counts["port_limited"] += 1
+      slog.event("flood_limited", "%s.%s: Port over its flood budget",
+                 dpid_to_str(event.dpid), event.port)
+      return False
+    bucket = self._flood_bucket
+    if bucket is not None and not bucket.consume(1, now):
+      self.flood_counts["switch_limited"] += 1
+      slog.event("flood_limited", "%s: Switch over its flood budget",
+                 dpid_to_str(event.dpid))
+      return False
+    self.flood_counts["flooded"] += 1
+    return True
+
+  def flood (self, event, message = None, *args):
+    """ Floods the packet, as described above """
+    if self.arp_resolver is not None and self._proxy_arp(event): # F1
+      return
+    msg = of.ofp_packet_out()
+    if time.time() - self.connection.connect_time >= self.flood_delay:
+      # Only flood if we've been connected for a little while...
+
+      if self.hold_down_expired is False:
+        # Oh yes it is!
+        self.hold_down_expired = True
+        log.info("%s: Flood hold-down expired -- flooding",
+            dpid_to_str(event.dpid))
+
+      if not self._flood_allowed(event): # F2
+        self.drop(event) # F2a
+        return
+
+      if message is not None: log.debug(message, *args)
+      # OFPP_FLOOD is optional; on some switches you may need to change
+      # this to OFPP_ALL.
+      msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
+    msg.data = event.ofp
+    msg.in_port = event.port
+    self.connection.send(msg)
+
+  def drop (self, event, packet = None, duration = None):
+    """
+    Drops this packet and optionally installs a flow to continue
+    dropping similar ones for a while
+    """
+    if duration is not None:
+      if not isinstance(duration, tuple):
+        duration = (duration,duration)
+      msg = of.ofp_flow_mod()
+      msg.match = of.ofp_match.from_packet(packet)
+      msg.idle_timeout = duration[0]
+      msg.hard_timeout = duration[1]
+      msg.buffer_id = event.ofp.buffer_id
+      self.connection.send(msg)
+    elif event.ofp.buffer_id is not None:
+      msg = of.ofp_packet_out()
+      msg.buffer_id = event.ofp.buffer_id
+      msg.in_port = event.port
+      self.connection.send(msg)
+
+  def forward (self, event, packet, m = None, t = 0):
+    """
+    Forwards packet according to the algorithm above
+
+    m and t are the caller's ComponentMetrics and time (see metrics).  If
+    the packet is being timed (t isn't 0), what was done with it is
+    recorded as its "flood", "install" or "drop" stage.
+    """
+    stage = "flood"
+    if not self.transparent and (packet.type == packet.LLDP_TYPE
+                                 or packet.dst.isBridgeFiltered()): # 2
+      self.drop(event) # 2a
+      stage = "drop"
+    elif packet.dst.is_multicast:
+      self.flood(event) # 3a
+    else:
+      port = self.macToPort.get(packet.dst)
+      if port is None: # 4
+        self.flood(event, "Port for %s unknown -- flooding", packet.dst) # 4a
+      elif port == event.port: # 5
+        # 5a
+        slog.event("same_port",
+            "Same port for packet from %s -> %s on %s.%s.  Drop.",
+            packet.src, packet.dst, dpid_to_str(event.dpid), port)
+        self.drop(event, packet, 10)
+        stage = "drop"
+      else:
+        # 6
+        log.debug("installing flow for %s.%i -> %s.%i",
+                  packet.src, event.port, packet.dst, port)
+        msg = of.ofp_flow_mod()
+        msg.match = self.match_for(event, packet)
+        msg.idle_timeout = self.idle_timeout
+        msg.hard_timeout = self.hard_timeout
+        msg.actions.append(of.ofp_action_output(port = port))
+        msg.data = event.ofp # 6a
+        self.connection.send(msg)
+        stage = "install"
+    if t: m.lap(stage, t)
+
+
+def launch (granularity = _granularity, idle_timeout = _idle_timeout,
+            hard_timeout = _hard_timeout, flood_rate = _flood_rate,
+            flood_burst = _flood_burst, port_flood_rate = _port_flood_rate,
+            port_flood_burst = _port_flood_burst):
+  """
+  Sets how the learning switches' flows and floods work
+
+  granularity is exact, src_dst or dst.  A hard timeout also bounds how
+  long a src_dst or dst flow keeps sending to a host which has moved.
+  flood_rate and port_flood_rate are floods per second allowed for each
+  switch and each port (0, the default, for no limit), in bursts of up
+  to flood_burst and port_flood_burst.
+  """
+  global _granularity, _idle_timeout, _hard_timeout
+  global _flood_rate, _flood_burst, _port_flood_rate, _port_flood_burst
+  if granularity not in GRANULARITIES:
+    raise RuntimeError("Expected granularity to be one of: %s"
+                       % (", ".join(GRANULARITIES),))
+  _granularity = granularity
+  try:
+    _idle_timeout = int(str(idle_timeout), 10)
+    _hard_timeout = int(str(hard_timeout), 10)
+    assert _idle_timeout >= 0 and _hard_timeout >= 0
+  except:
+    raise RuntimeError("Expected flow timeouts to be numbers")
+  try:
+    _flood_rate = float(flood_rate)
+    _flood_burst = float(flood_burst)
+    _port_flood_rate = float(port_flood_rate)
+    _port_flood_burst = float(port_flood_burst)
+    assert min(_flood_rate, _flood_burst, _port_flood_rate,
+               _port_flood_burst) >= 0
+  except:
+    raise RuntimeError("Expected flood rates and bursts to be numbers")
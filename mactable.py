@@ -0,0 +1,390 @@
+"""
+An aging, size-bounded MAC address table.
+
+The learning switches map MACs to ports with a MacTable instead of a
+dict.  Entries which haven't been learned again for max_age seconds are
+removed, and once the table holds max_size entries, learning a new MAC
+evicts the least recently learned one.  Handlers in evict_handlers are
+called with (mac, port) for every entry removed this way, so owners can
+remove flows and other state for the MAC.
+
+Aging is lazy: learning a known MAC only updates its last-seen time.
+Entries are kept in the order they were queued, and a timer pops entries
+off the front which were queued more than max_age ago; ones which have
+been seen since are queued again, the rest are expired.  Eviction works
+the same way, so no per-packet work is ever more than constant time.
+The price is that an entry may outlive max_age by up to max_age again.
+
+Run this as a component to change the defaults, e.g.:
+  mactable --max_size=4096 --max_age=120
+A max_size or max_age of 0 turns the limit off.
+"""
+
+from pox.lib.recoco import Timer
+from pox.lib.addresses import EthAddr
+from array import array
+import struct
+import time
+
+from .bindings import mac_to_int, int_to_mac
+
+# Maximum number of entries in each table
+_max_size = 16384
+
+# Seconds since a MAC was last learned before its entry expires
+_max_age = 300
+
+# How often (seconds) tables are checked for expired entries
+_expire_interval = 10
+
+_unpack_mac = struct.Struct("!HI").unpack
+
+# Typecode for 64-bit signed integers ('q' isn't in Python 2's array)
+try:
+  array('q')
+  _int64 = 'q'
+except ValueError:
+  _int64 = 'l'
+
+
+# Hash table positions with no entry hold this
+_EMPTY = -1
+
+# The hash table is grown when more than this fraction full
+_max_load = 0.7
+
+# A MAC's probe sequence starts at (mac ^ (mac >> 24)) & mask: the vendor
+# half is folded into the NIC-specific half, so that MACs which differ
+# only in their vendor (or only in high bits) still spread out.
+
+
+class MacTable (object):
+  """
+  A MAC -> port table with aging and LRU eviction
+
+  Supports the dict operations the learning switches use (get, [],
+  in, pop, del, len, iteration over MACs and items()).  Setting an entry
+  learns it, refreshing its last-seen time.  MACs may be given as
+  EthAddrs or as 48-bit integers; iteration and evict_handlers give
+  EthAddrs.
+
+  Internally there are no per-entry objects at all.  MACs are 48-bit
+  integers, and each entry is a slot in a set of typed arrays (MAC, port,
+  last seen, time queued, and the queue's links).  Slots are found by an
+  open-addressing (linear probing) hash table of MACs and slot numbers,
+  also in typed arrays.  Freed slots are reused, and hash table entries
+  are deleted by shifting later entries back, so there are no tombstones.
+  """
+  __slots__ = ('max_size', 'max_age', 'evict_handlers', '_keys', '_index',
+               '_mask', '_count', '_mac', '_port', '_seen', '_queued',
+               '_prev', '_next', '_head', '_tail', '_free', '_timer',
+               '_dirty')
+
+  def __init__ (self, max_size = None, max_age = None):
+    self.max_size = _max_size if max_size is None else max_size
+    self.max_age = _max_age if max_age is None else max_age
+
+    # Called with (mac, port) for each entry which is evicted or expires
+    self.evict_handlers = []
+
+    # Hash table: position -> MAC (or _EMPTY), position -> slot
+    self._keys = array(_int64, [_EMPTY]) * 64
+    self._index = array('i', [0]) * 64
+    self._mask = 63
+    self._count = 0
+
+    self._mac = array(_int64)      # slot -> MAC
+    self._port = array('H')        # slot -> port
+    self._seen = array('d')        # slot -> last seen
+    self._queued = array('d')      # slot -> time queued
+    self._prev = array('i')        # slot -> previous slot in queue or -1
+    self._next = array('i')        # slot -> next slot in queue or -1
+    self._head = self._tail = -1   # Oldest and newest queued slots
+    self._free = []                # Unused slots
+
+    # MACs learned or removed since changes() was last called, once
+    # track_changes() has been
+    self._dirty = None
+
+    self._timer = None
+    if self.max_age:
+      self._timer = Timer(_expire_interval, self.expire, recurring = True)
+
+  def _find (self, mac):
+    """
+    Returns the hash table position holding mac, or the empty one
+    where it would go
+    """
+    keys = self._keys
+    mask = self._mask
+    i = (mac ^ (mac >> 24)) & mask
+    while True:
+      k = keys[i]
+      if k == mac or k == _EMPTY: return i
+      i = (i + 1) & mask
+
+  def _slot (self, mac):
+    """
+    Returns the slot for mac, or -1
+    """
+    if type(mac) is EthAddr: mac = mac_to_int(mac)
+    i = self._find(mac)
+    if self._keys[i] == _EMPTY: return -1
+    return self._index[i]
+
+  def _grow (self):
+    keys = self._keys
+    index = self._index
+    size = 2 * len(keys)
+    self._keys = array(_int64, [_EMPTY]) * size
+    self._index = array('i', [0]) * size
+    self._mask = size - 1
+    for i, k in enumerate(keys):
+      if k != _EMPTY:
+        j = self._find(k)
+        self._keys[j] = k
+        self._index[j] = index[i]
+
+  def _unhash (self, mac):
+    """
+    Removes mac from the hash table, returning its slot or -1
+    """
+    keys = self._keys
+    index = self._index
+    mask = self._mask
+    i = self._find(mac)
+    if keys[i] == _EMPTY: return -1
+    s = index[i]
+    self._count -= 1
+    if self._dirty is not None: self._dirty.add(mac)
+    # Shift back later entries of the probe run which may now be in the
+    # wrong place
+    j = i
+    while True:
+      j = (j + 1) & mask
+      k = keys[j]
+      if k == _EMPTY: break
+      home = (k ^ (k >> 24)) & mask
+      if (j > i and (home <= i or home > j)) or (j < i and i >= home > j):
+        keys[i] = k
+        index[i] = index[j]
+        i = j
+    keys[i] = _EMPTY
+    return s
+
+  def __len__ (self):
+    return self._count
+
+  def __contains__ (self, mac):
+    return self._slot(mac) != -1
+
+  def __iter__ (self):
+    mac = self._mac
+    nxt = self._next
+    s = self._head
+    while s != -1:
+      n = nxt[s] # Find the next one first, in case s is removed
+      yield int_to_mac(mac[s])
+      s = n
+
+  def __getitem__ (self, mac):
+    s = self._slot(mac)
+    if s == -1: raise KeyError(mac)
+    return self._port[s]
+
+  def __delitem__ (self, mac):
+    if type(mac) is EthAddr: mac = mac_to_int(mac)
+    s = self._unhash(mac)
+    if s == -1: raise KeyError(mac)
+    self._remove(s)
+
+  def get (self, mac, default = None):
+    # This is the lookup on the PacketIn path, so _find() is inlined
+    if type(mac) is EthAddr:
+      hi, lo = _unpack_mac(mac.toRaw())
+      mac = (hi << 32) | lo
+    keys = self._keys
+    mask = self._mask
+    i = (mac ^ (mac >> 24)) & mask
+    k = keys[i]
+    while k != mac:
+      if k == _EMPTY: return default
+      i = (i + 1) & mask
+      k = keys[i]
+    return self._port[self._index[i]]
+
+  def pop (self, mac, default = None):
+    if type(mac) is EthAddr: mac = mac_to_int(mac)
+    s = self._unhash(mac)
+    if s == -1: return default
+    self._remove(s)
+    return self._port[s] # Still there until the slot is reused
+
+  def items (self):
+    mac = self._mac
+    port = self._port
+    nxt = self._next
+    r = []
+    s = self._head
+    while s != -1:
+      r.append((int_to_mac(mac[s]), port[s]))
+      s = nxt[s]
+    return r
+
+  def track_changes (self):
+    """
+    Starts keeping track of which MACs are learned or removed
+    """
+    if self._dirty is None: self._dirty = set()
+
+  def changes (self):
+    """
+    Returns the MACs (as integers) learned or removed since the last call
+
+    Learning a MAC again counts, as it changes when it was last seen.
+    """
+    dirty = self._dirty
+    if dirty is None: return ()
+    self._dirty = set()
+    return dirty
+
+  def last_seen (self, mac):
+    """
+    Returns when mac was last learned (or None)
+    """
+    s = self._slot(mac)
+    return None if s == -1 else self._seen[s]
+
+  def learn (self, mac, port, now = None):
+    """
+    Records that mac was seen on port, evicting an entry if full
+    """
+    if now is None: now = time.time()
+    if type(mac) is EthAddr:
+      hi, lo = _unpack_mac(mac.toRaw())
+      mac = (hi << 32) | lo
+    if self._dirty is not None: self._dirty.add(mac)
+    i = self._find(mac)
+    if self._keys[i] != _EMPTY:
+      s = self._index[i]
+      self._port[s] = port
+      self._seen[s] = now
+      return
+    if self.max_size and self._count >= self.max_size:
+      self._evict_one(now)
+      i = self._find(mac) # Eviction may have moved things
+    elif self._count + 1 > len(self._keys) * _max_load:
+      self._grow()
+      i = self._find(mac)
+    if self._free:
+      s = self._free.pop()
+      self._mac[s] = mac
+      self._port[s] = port
+      self._seen[s] = now
+      self._queued[s] = now
+    else:
+      s = len(self._mac)
+      self._mac.append(mac)
+      self._port.append(port)
+      self._seen.append(now)
+      self._queued.append(now)
+      self._prev.append(-1)
+      self._next.append(-1)
+    self._keys[i] = mac
+    self._index[i] = s
+    self._count += 1
+    self._enqueue(s)
+
+  __setitem__ = learn
+
+  def _enqueue (self, s):
+    self._prev[s] = self._tail
+    self._next[s] = -1
+    if self._tail == -1:
+      self._head = s
+    else:
+      self._next[self._tail] = s
+    self._tail = s
+
+  def _dequeue (self, s):
+    p = self._prev[s]
+    n = self._next[s]
+    if p == -1:
+      self._head = n
+    else:
+      self._next[p] = n
+    if n == -1:
+      self._tail = p
+    else:
+      self._prev[n] = p
+
+  def _remove (self, s):
+    # s must already be gone from the hash table
+    self._dequeue(s)
+    self._free.append(s)
+
+  def _requeue (self, s, now):
+    self._queued[s] = now
+    if s != self._tail:
+      self._dequeue(s)
+      self._enqueue(s)
+
+  def _evict_one (self, now):
+    while self._head != -1:
+      s = self._head
+      if self._seen[s] > self._queued[s]:
+        # Seen since it was queued; give it another go round
+        self._requeue(s, now)
+        continue
+      mac = self._mac[s]
+      port = self._port[s]
+      self._unhash(mac)
+      self._remove(s)
+      self._evicted(mac, port)
+      return
+
+  def expire (self, now = None):
+    """
+    Removes entries not seen for max_age seconds
+
+    Returns the number of entries removed.
+    """
+    if not self.max_age: return 0
+    if now is None: now = time.time()
+    cutoff = now - self.max_age
+    expired = []
+    while self._head != -1:
+      s = self._head
+      if self._queued[s] > cutoff: break
+      if self._seen[s] > cutoff:
+        self._requeue(s, now)
+        continue
+      mac = self._mac[s]
+      expired.append((mac, self._port[s]))
+      self._unhash(mac)
+      self._remove(s)
+    for mac, port in expired:
+      self._evicted(mac, port)
+    return len(expired)
+
+  def _evicted (self, mac, port):
+    if not self.evict_handlers: return
+    mac = int_to_mac(mac)
+    for handler in self.evict_handlers:
+      handler(mac, port)
+
+  def stop (self):
+    """
+    Stops aging (e.g., when the switch disconnects)
+    """
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+
+
+def launch (max_size = _max_size, max_age = _max_age,
+            interval = _expire_interval):
+  global _max_size, _max_age, _expire_interval
+  _max_size = int(max_size)
+  _max_age = float(max_age)
+  _expire_interval = float(interval)
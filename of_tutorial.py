@@ -24,6 +24,8 @@ It's roughly similar to the one Brandon Heller did for NOX.
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 
+from .mactable import MacTable
+
 log = core.getLogger()
 
 
@@ -42,8 +44,20 @@ class Tutorial (object):
     connection.addListeners(self)
 
     # Use this table to keep track of which ethernet address is on
-    # which switch port (keys are MACs, values are ports).
-    self.mac_to_port = {}
+    # which switch port (keys are MACs, values are ports).  Entries age
+    # out, and the flows to a MAC are deleted when its entry goes.
+    self.mac_to_port = MacTable()
+    self.mac_to_port.evict_handlers.append(self.forget_flows)
+
+
+  def forget_flows (self, mac, port):
+    """
+    Deletes the flows sending traffic for mac out of port.
+    """
+    msg = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+    msg.match = of.ofp_match(dl_dst = mac)
+    msg.out_port = port
+    self.connection.send(msg)
 
 
   def resend_packet (self, packet_in, out_port):
@@ -121,6 +135,10 @@ class Tutorial (object):
       self.resend_packet(packet_in, of.OFPP_ALL)
 
 
+  def _handle_ConnectionDown (self, event):
+    self.mac_to_port.stop()
+
+
   def _handle_PacketIn (self, event):
     """
     Handles packet in messages from the switch.
@@ -0,0 +1,403 @@
+"""
+A single security pipeline in front of one L2 learning switch.
+
+Rather than running dhcp_snooping, portSecurity, DAI and IPSourceGuard
+as separate components (each listening for PacketIns, parsing them and,
+for two of them, forwarding them), this runs the features as stages of
+one PacketIn handler:
+
+  ./pox.py NetworkSystemsAssignment1.pipeline --features=dhcp,portsec,dai,ipsg
+
+Each PacketIn is classified from its raw bytes (see fastpath) into a
+PacketContext and handed to the enabled stages in a fixed order (DHCP
+snooping, port security, DAI, IP Source Guard).  A stage can stop the
+packet by returning DROP (the pipeline drops it) or HANDLED (the stage
+has dealt with it itself).  The checks work on the raw headers, so a
+packet is only parsed (once, by PacketContext.parse()) if a stage needs
+to look deeper, as for DHCP or proxy ARP, or if it gets through every
+stage, when it's learned and forwarded.  All stages of a switch share
+one SwitchState.
+
+Forwarding flows are as coarse as learning's granularity setting allows,
+but no coarser than every enabled stage can live with: port security
+and DHCP snooping (without trap flows) need src_dst, and DAI (without
+its ARP flows) and IP Source Guard need exact.
+
+IP Source Guard lets through DHCP clients asking for an address (from
+0.0.0.0) and server replies DHCP snooping has accepted, and it takes
+the leases DHCP snooping sees as valid sources, along with the bindings.
+
+ARP requests which would be flooded are answered by proxy ARP if a
+stage knows the target's MAC: from DHCP snooping's leases, DAI's
+bindings or IP Source Guard's table, in that order.  With proxy_arp,
+switches send us every ARP request, and DAI answers those for bound
+addresses as soon as it has checked them.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+import pox.lib.packet as pkt
+from pox.lib.revent import EventMixin
+from pox.lib.util import str_to_bool, str_to_dpid
+
+from .bindings import mac_to_int
+from .learning import L2Forwarder
+from .dhcp_snooping import DHCPSnooper, BindingAdded, BindingRemoved
+from .dhcp_snooping import parse_trusted_ports
+from .portSecurity import PortSecurity
+from .DAI import DynamicARPInspection
+from .IPSourceGuard import IPSourceGuard
+from .flowpager import FlowPager
+from . import fastpath
+from . import metrics
+
+log = core.getLogger()
+_metrics = metrics.component("pipeline")
+
+# Stage verdicts
+CONTINUE = 0
+DROP = 1
+HANDLED = 2
+
+
+class PacketContext (object):
+  """
+  A PacketIn along with the headers the stages look at
+
+  headers are the fastpath Headers, and src the source MAC (an integer,
+  as fastpath and MacTable have it).  The parsed packet and its headers
+  (packet, vlan, ipv4, arp, udp and dhcp) are only there once parse()
+  has been called; headers which aren't present are None.  If the frame
+  is too short to classify, headers is None and the packet is parsed
+  straight away.
+  """
+  __slots__ = ('event', 'port', 'headers', 'src', 'packet', 'vlan', 'ipv4',
+               'arp', 'udp', 'dhcp')
+
+  _kinds = {pkt.vlan : 'vlan', pkt.ipv4 : 'ipv4', pkt.arp : 'arp',
+            pkt.udp : 'udp', pkt.dhcp : 'dhcp'}
+
+  def __init__ (self, event):
+    self.event = event
+    self.port = event.port
+    self.packet = None
+    self.vlan = self.ipv4 = self.arp = self.udp = self.dhcp = None
+    self.headers = h = fastpath.headers(event)
+    if h is None:
+      self.src = mac_to_int(self.parse().src)
+    else:
+      self.src = h.src
+
+  def parse (self):
+    """
+    Returns the parsed packet, finding its headers in a single walk
+    """
+    if self.packet is not None: return self.packet
+    self.packet = packet = self.event.parsed
+    kinds = PacketContext._kinds
+    p = packet.next
+    while p is not None:
+      kind = kinds.get(type(p))
+      if kind is None: break
+      setattr(self, kind, p)
+      p = p.next
+    return packet
+
+
+class SwitchState (object):
+  """
+  Per-switch state shared by all the stages
+
+  Stages fill in the attributes for the features they implement; the
+  rest stay None.
+  """
+  def __init__ (self, pipeline, connection):
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.forwarder = L2Forwarder(connection, pipeline.transparent,
+                                 pipeline.flood_delay)
+    self.macToPort = self.forwarder.macToPort
+    self.snooper = None # DHCPSnooper
+    self.portsec = None # PortSecurity
+    self.forwarder.arp_resolver = self.resolve
+    self._stages = pipeline.stages
+
+  def resolve (self, ip):
+    """
+    Returns the MAC the first stage that knows ip has for it, or None
+    """
+    for stage in self._stages:
+      mac = stage.resolve(ip, self)
+      if mac is not None: return mac
+    return None
+
+
+class Stage (object):
+  """
+  A feature of the pipeline
+
+  process() returns CONTINUE, DROP or HANDLED.
+  """
+  name = None
+
+  def __init__ (self, pipeline):
+    self.pipeline = pipeline
+
+  def connection_up (self, state):
+    pass
+
+  def process (self, ctx, state):
+    return CONTINUE
+
+  def resolve (self, ip, state):
+    """
+    Returns the EthAddr this feature knows IPAddr ip has, or None
+    """
+    return None
+
+
+class DHCPSnoopingStage (Stage):
+  name = "dhcp"
+
+  def connection_up (self, state):
+    p = self.pipeline
+    state.snooper = DHCPSnooper(state.connection, p, state.macToPort,
+                                p.trusted.get(state.dpid), p.trap_dhcp)
+    if not state.snooper.trap:
+      state.forwarder.limit_granularity("src_dst")
+
+  def process (self, ctx, state):
+    h = ctx.headers
+    if h is not None and not fastpath.is_dhcp(h): return CONTINUE
+    ctx.parse()
+    if ctx.dhcp is None: return CONTINUE
+    if state.snooper.snoop(ctx.event, ctx.packet, ctx.dhcp): return CONTINUE
+    return DROP
+
+  def resolve (self, ip, state):
+    return state.snooper.bindings.mac_for(ip)
+
+
+class PortSecurityStage (Stage):
+  name = "portsec"
+
+  def connection_up (self, state):
+    state.portsec = PortSecurity(state.connection, state.macToPort,
+                                 self.pipeline.max_macs)
+    if state.forwarder.reconciler is not None:
+      state.forwarder.reconciler.learn = state.portsec.learn
+    state.forwarder.limit_granularity("src_dst")
+
+  def process (self, ctx, state):
+    if state.portsec.learn(ctx.src, ctx.port): return CONTINUE
+    state.portsec.block(ctx.event, ctx.src)
+    return HANDLED
+
+
+class DAIStage (Stage):
+  name = "dai"
+
+  def __init__ (self, pipeline):
+    Stage.__init__(self, pipeline)
+    self.dai = DynamicARPInspection(pipeline.bindings,
+                                    flows = pipeline.dai_flows,
+                                    standalone = False,
+                                    proactive = pipeline.proactive,
+                                    proxy_arp = pipeline.proxy_arp,
+                                    watch = pipeline.watch,
+                                    ignore = pipeline.ignore)
+    core.register("DynamicARPInspection", self.dai)
+    pipeline.addListenerByName("BindingAdded",
+        self.dai._handle_dhcp_snooping_BindingAdded)
+    pipeline.addListenerByName("BindingRemoved",
+        self.dai._handle_dhcp_snooping_BindingRemoved)
+
+  def connection_up (self, state):
+    self.dai.install_flows(state.connection)
+    # Without DAI's ARP punt flow, ARP only comes to us if forwarding
+    # flows match on ARP's addresses too
+    if not self.dai.flows:
+      state.forwarder.limit_granularity("exact")
+
+  def process (self, ctx, state):
+    h = ctx.headers
+    if h is None:
+      if ctx.arp is None: return CONTINUE
+      if not self.dai.check(ctx.event, ctx.packet, ctx.arp): return DROP
+    else:
+      if h.arp_op is None: return CONTINUE
+      if not self.dai.check_headers(ctx.event, h): return DROP
+      if not self.dai.proxy_arp or h.arp_op != pkt.arp.REQUEST:
+        return CONTINUE
+      ctx.parse()
+      if ctx.arp is None: return CONTINUE
+    if self.dai.proxy_arp and self.dai.answer(ctx.event, ctx.packet, ctx.arp):
+      return HANDLED
+    return CONTINUE
+
+  def resolve (self, ip, state):
+    return self.dai.resolve(ip)
+
+
+class IPSourceGuardStage (Stage):
+  name = "ipsg"
+
+  def __init__ (self, pipeline):
+    Stage.__init__(self, pipeline)
+    self.ipsg = IPSourceGuard(standalone = False,
+                              proactive = pipeline.proactive,
+                              bindings = pipeline.bindings,
+                              watch = pipeline.watch,
+                              ignore = pipeline.ignore)
+    core.register("IPSourceGuard", self.ipsg)
+    pipeline.addListenerByName("BindingAdded",
+        self.ipsg._handle_dhcp_snooping_BindingAdded)
+    pipeline.addListenerByName("BindingRemoved",
+        self.ipsg._handle_dhcp_snooping_BindingRemoved)
+
+  def connection_up (self, state):
+    state.forwarder.limit_granularity("exact")
+    if self.ipsg.proactive:
+      FlowPager(state.connection, self.ipsg.switch_flows())
+
+  def process (self, ctx, state):
+    # Server replies have got past DHCP snooping's trusted port check
+    if (ctx.dhcp is not None and state.snooper is not None
+        and ctx.dhcp.op == pkt.dhcp.BOOTREPLY):
+      return CONTINUE
+    h = ctx.headers
+    if h is None:
+      if ctx.ipv4 is None: return CONTINUE
+      if self.ipsg.check(ctx.event, ctx.packet, ctx.ipv4): return CONTINUE
+    else:
+      if h.ip_src is None: return CONTINUE
+      if self.ipsg.check_headers(ctx.event, h): return CONTINUE
+    return DROP
+
+  def resolve (self, ip, state):
+    return self.ipsg.resolve(ip)
+
+
+# All stages, in the order they run
+_stage_classes = [DHCPSnoopingStage, PortSecurityStage, DAIStage,
+                  IPSourceGuardStage]
+
+
+class security_pipeline (EventMixin):
+  """
+  Runs the enabled security stages and L2 learning for every switch
+  """
+  _eventMixin_events = set([BindingAdded, BindingRemoved])
+
+  def __init__ (self, features, transparent = False, flood_delay = 0,
+                ignore = None, trusted = None, trap_dhcp = False,
+                max_macs = None, bindings = None, dai_flows = False,
+                proactive = False, proxy_arp = False, watch = 0):
+    self.transparent = transparent
+    self.flood_delay = flood_delay
+    self.ignore = set(ignore) if ignore else ()
+    self.trusted = trusted or {}
+    self.trap_dhcp = trap_dhcp
+    self.max_macs = max_macs
+    self.bindings = bindings
+    self.watch = watch
+    self.dai_flows = dai_flows
+    self.proactive = proactive
+    self.proxy_arp = proxy_arp
+
+    self.switches = {} # DPID -> SwitchState
+    self.stages = [cls(self) for cls in _stage_classes if cls.name in features]
+    log.info("Security pipeline stages: %s",
+             " ".join(s.name for s in self.stages) or "(none)")
+
+    core.openflow.addListeners(self)
+
+  def _handle_ConnectionUp (self, event):
+    if event.dpid in self.ignore:
+      log.debug("Ignoring connection %s", event.connection)
+      return
+    state = SwitchState(self, event.connection)
+    for stage in self.stages:
+      stage.connection_up(state)
+    self.switches[event.dpid] = state
+
+  def _handle_ConnectionDown (self, event):
+    self.switches.pop(event.dpid, None)
+
+  def _handle_PacketIn (self, event):
+    state = self.switches.get(event.dpid)
+    if state is None: return
+    t = t0 = _metrics.start()
+    ctx = PacketContext(event)
+    if ctx.headers is None and not ctx.packet.parsed:
+      log.warning("Ignoring incomplete packet")
+      _metrics.done(t0, "incomplete")
+      return
+    if t: t = _metrics.lap("classify", t)
+    for stage in self.stages:
+      verdict = stage.process(ctx, state)
+      if t: t = _metrics.lap(stage.name, t)
+      if verdict == CONTINUE: continue
+      if verdict == DROP:
+        state.forwarder.drop(event)
+        _metrics.done(t0, stage.name + "_drop")
+      else:
+        _metrics.done(t0, stage.name + "_handled")
+      return
+
+    packet = ctx.parse()
+    if not packet.parsed:
+      log.warning("Ignoring incomplete packet")
+      _metrics.done(t0, "incomplete")
+      return
+    if t: t = _metrics.lap("parse", t)
+    if state.portsec is None:
+      state.macToPort[packet.src] = event.port
+    state.forwarder.forward(event, packet, _metrics, t)
+    _metrics.done(t0, "forwarded")
+
+
+def launch (features = "dhcp,portsec,dai,ipsg", transparent = False,
+            hold_down = 0, ignore = None, trusted = None, trap_dhcp = False,
+            max_macs = None, bindings = None, dai_flows = False,
+            proactive = False, proxy_arp = False, watch = 0):
+  """
+  Starts the security pipeline
+
+  features is a comma-separated list of the stages to run: dhcp, portsec,
+  dai and/or ipsg.  trusted and trap_dhcp are as for dhcp_snooping,
+  max_macs as for portSecurity, and dai_flows (flows) and proxy_arp as
+  for DAI.  bindings, watch and proactive are as for DAI and
+  IPSourceGuard; both stages take their bindings from the one file.
+  """
+  features = set(features.replace(',', ' ').split())
+  unknown = features.difference(cls.name for cls in _stage_classes)
+  if unknown:
+    raise RuntimeError("Unknown pipeline features: %s"
+                       % (" ".join(sorted(unknown)),))
+
+  try:
+    flood_delay = int(str(hold_down), 10)
+    assert flood_delay >= 0
+  except:
+    raise RuntimeError("Expected hold-down to be a number")
+
+  if ignore:
+    ignore = ignore.replace(',', ' ').split()
+    ignore = set(str_to_dpid(dpid) for dpid in ignore)
+
+  if trusted:
+    trusted = parse_trusted_ports(trusted)
+
+  if max_macs is not None:
+    try:
+      max_macs = int(str(max_macs), 10)
+      assert max_macs >= 1
+    except:
+      raise RuntimeError("Expected max-macs to be a positive number")
+
+  core.registerNew(security_pipeline, features, str_to_bool(transparent),
+                   flood_delay, ignore, trusted, str_to_bool(trap_dhcp),
+                   max_macs, bindings, str_to_bool(dai_flows),
+                   str_to_bool(proactive), str_to_bool(proxy_arp),
+                   float(watch))
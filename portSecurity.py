@@ -18,20 +18,199 @@ An L2 learning switch.
 It is derived from one written live for an SDN crash course.
 It is somwhat similar to NOX's pyswitch in that it installs
 exact-match rules for each flow.
+
+On top of plain L2 learning it enforces port security: each switch port
+may have at most max_macs source MAC addresses learned on it, and frames
+from additional MACs on a full port are dropped.
 """
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 from pox.lib.util import dpid_to_str, str_to_dpid
 from pox.lib.util import str_to_bool
-import time
+from pox.lib.addresses import EthAddr
+
+from .batching import batched
+from .bindings import mac_to_int, int_to_mac
+from .learning import L2Forwarder
+from . import fastpath
+from . import metrics
+from .seclog import EventLog
 
 log = core.getLogger()
+slog = EventLog(log)
+_metrics = metrics.component("portSecurity")
 
 # We don't want to flood immediately when a switch connects.
 # Can be overriden on commandline.
 _flood_delay = 0
 
+# Maximum number of MACs which may be learned on a single port.
+# Can be overriden on commandline.
+_max_macs = 3
+
+# Timeouts and priority of the flows which drop traffic from MACs that
+# violated port security.  The priority must be above that of the
+# learning flows so a violator can't ride on an existing flow.
+# Can be overriden on commandline.
+_violation_idle = 10
+_violation_hard = 60
+_violation_priority = of.OFP_DEFAULT_PRIORITY + 100
+
+# DPID -> PortSecurity of each connected switch
+_switches = {}
+
+class PortSecurity (object):
+  """
+  Port security state for a single OpenFlow switch
+
+  Wraps the switch's address/port table (macToPort) with a reverse index
+  of the MACs learned on each port, so that checking a port's MAC limit,
+  learning and host moves are all constant time.  Sources which would
+  exceed the limit are blocked with a drop flow.
+
+  MACs may be given as EthAddrs or as 48-bit integers (as from fastpath,
+  which the PacketIn path uses, so it never makes an EthAddr); they're
+  kept as integers.
+  """
+  def __init__ (self, connection, macToPort, max_macs = None):
+    self.connection = batched(connection)
+    self.macToPort = macToPort
+    self.max_macs = max_macs if max_macs is not None else _max_macs
+
+    # Reverse index of macToPort: port -> set of MACs learned on it.
+    # Kept in sync by learn()/forget() so the port security check never
+    # has to walk macToPort.
+    self.portToMacs = {}
+    for mac, port in macToPort.items(): # E.g., restored by snapshot
+      self.portToMacs.setdefault(port, set()).add(mac_to_int(mac))
+
+    # (port, MAC) pairs for which a violation drop flow is installed
+    self.blocked = set()
+
+    # Keep the index in step with MACs aging out of the table
+    macToPort.evict_handlers.append(self._handle_evicted)
+
+    _switches[connection.dpid] = self
+    connection.addListeners(self)
+
+  def learn (self, mac, port):
+    """
+    Learns that mac is on port, enforcing the per-port MAC limit
+
+    Returns False (and learns nothing) if mac is new on port and the port
+    is already full.  A MAC moving between ports is removed from the old
+    port's set.
+    """
+    if type(mac) is EthAddr: mac = mac_to_int(mac)
+    old_port = self.macToPort.get(mac)
+    if old_port == port:
+      self.macToPort[mac] = port # Refresh its age
+      return True
+    macs = self.portToMacs.get(port)
+    if macs is None:
+      macs = self.portToMacs[port] = set()
+    elif len(macs) >= self.max_macs:
+      return False
+    if old_port is not None:
+      self._unindex(mac, old_port)
+    macs.add(mac)
+    self.macToPort[mac] = port
+    return True
+
+  def forget (self, mac):
+    """
+    Removes mac from the address/port table
+    """
+    if type(mac) is EthAddr: mac = mac_to_int(mac)
+    port = self.macToPort.pop(mac, None)
+    if port is not None:
+      self._unindex(mac, port)
+
+  def forget_port (self, port):
+    """
+    Removes every MAC learned on port
+    """
+    macs = self.portToMacs.pop(port, ())
+    for mac in macs:
+      del self.macToPort[mac]
+
+  def _handle_evicted (self, mac, port):
+    self._unindex(mac_to_int(mac), port)
+
+  def _unindex (self, mac, port):
+    macs = self.portToMacs.get(port)
+    if macs is None: return
+    macs.discard(mac)
+    if not macs:
+      del self.portToMacs[port]
+
+  def block (self, event, mac):
+    """
+    Installs a flow dropping packets from mac on event's port
+
+    Also drops the packet which caused the violation, if it's buffered.
+    The flow is only sent once per (port, MAC); we forget about it when
+    the switch tells us it has been removed.
+    """
+    if type(mac) is EthAddr: mac = mac_to_int(mac)
+    key = (event.port, mac)
+    if key in self.blocked:
+      if event.ofp.buffer_id is not None:
+        msg = of.ofp_packet_out()
+        msg.buffer_id = event.ofp.buffer_id
+        msg.in_port = event.port
+        self.connection.send(msg)
+      return
+    self.blocked.add(key)
+    mac = int_to_mac(mac)
+    slog.event("port_security", "Violation from %s on %s.%i -- blocking",
+               mac, dpid_to_str(event.dpid), event.port)
+    msg = of.ofp_flow_mod()
+    msg.match = of.ofp_match(in_port = event.port, dl_src = mac)
+    msg.priority = _violation_priority
+    msg.idle_timeout = _violation_idle
+    msg.hard_timeout = _violation_hard
+    msg.flags = of.OFPFF_SEND_FLOW_REM
+    msg.buffer_id = event.ofp.buffer_id
+    self.connection.send(msg)
+
+  def _handle_FlowRemoved (self, event):
+    """
+    Forget violation flows which have expired on the switch
+    """
+    if event.ofp.priority != _violation_priority: return
+    match = event.ofp.match
+    self.blocked.discard((match.in_port, mac_to_int(match.dl_src)))
+
+  def _handle_ConnectionDown (self, event):
+    if _switches.get(event.dpid) is self:
+      del _switches[event.dpid]
+
+  def _handle_PortStatus (self, event):
+    """
+    Forget MACs on ports which have gone away or lost link
+    """
+    if event.deleted or (event.ofp.desc.state & of.OFPPS_LINK_DOWN):
+      self.forget_port(event.port)
+
+
+def learn (dpid, mac, port):
+  """
+  Has port security learn mac on a switch's port, as for a packet from it
+
+  Returns False if port security doesn't allow mac there.  For
+  components which may deal with a packet before port security sees it,
+  so that the packet still counts towards the port's MAC limit.
+  Everything is allowed on switches without port security.
+  """
+  portsec = _switches.get(dpid)
+  if portsec is None: return True
+  if type(mac) is EthAddr: mac = mac_to_int(mac)
+  if (port, mac) in portsec.blocked: return False
+  return portsec.learn(mac, port)
+
+
 class LearningSwitch (object):
   """
   The learning switch "brain" associated with a single OpenFlow switch.
@@ -42,52 +221,39 @@ class LearningSwitch (object):
 
   We populate the table by observing traffic.  When we see a packet
   from some source coming from some port, we know that source is out
-  that port.
-
-  When we want to forward traffic, we look up the desintation in our
-  table.  If we don't know the port, we simply send the message out
-  all ports except the one it came in on.  (In the presence of loops,
-  this is bad!).
-
-  In short, our algorithm looks like this:
+  that port -- unless that port already has max_macs sources.
 
   For each packet from the switch:
-  1) Use source address and switch port to update address/port table
-  2) Is transparent = False and either Ethertype is LLDP or the packet's
-     destination address is a Bridge Filtered address?
-     Yes:
-        2a) Drop packet -- don't forward link-local traffic (LLDP, 802.1x)
-            DONE
-  3) Is destination multicast?
+  0) Is the source address new on this port and the port already has
+     max_macs addresses learned on it?
      Yes:
-        3a) Flood the packet
+        0a) Install a flow dropping this source on this port for a while
             DONE
-  4) Port for destination address in our address/port table?
-     No:
-        4a) Flood the packet
-            DONE
-  5) Is output port the same as input port?
-     Yes:
-        5a) Drop packet and similar ones for a while
-  6) Install flow table entry in the switch so that this
-     flow goes out the appopriate port
-     6a) Send the packet out appropriate port
+  1) Use source address and switch port to update address/port table
+  2-6) Forward as described in learning.L2Forwarder
   """
   def __init__ (self, connection, transparent):
     # Switch we'll be adding L2 learning switch capabilities to
     self.connection = connection
     self.transparent = transparent
 
+    self.forwarder = L2Forwarder(connection, transparent, _flood_delay)
+
     # Our table
-    self.macToPort = {}
+    self.macToPort = self.forwarder.macToPort
+
+    self.portsec = PortSecurity(connection, self.macToPort)
+    if self.forwarder.reconciler is not None:
+      self.forwarder.reconciler.learn = self.portsec.learn
+
+    # Every new source on a port must come to us to be counted, so flows
+    # can't match on the destination alone
+    self.forwarder.limit_granularity("src_dst")
 
     # We want to hear PacketIn messages, so we listen
     # to the connection
     connection.addListeners(self)
 
-    # We just use this to know when to log a helpful message
-    self.hold_down_expired = _flood_delay == 0
-
     #log.debug("Initializing LearningSwitch, transparent=%s",
     #          str(self.transparent))
 
@@ -96,87 +262,23 @@ class LearningSwitch (object):
     Handle packet in messages from the switch to implement above algorithm.
     """
 
+    t = t0 = _metrics.start()
+    # Violations are blocked without parsing the packet
+    h = fastpath.headers(event)
+    src = h.src if h is not None else event.parsed.src
+
+    if not self.portsec.learn(src, event.port): # 0, 1
+      self.portsec.block(event, src) # 0a
+      _metrics.done(t0, "blocked")
+      return
+    if t: t = _metrics.lap("check", t)
+
     packet = event.parsed
+    if t: t = _metrics.lap("parse", t)
 
-    def flood (message = None):
-      """ Floods the packet """
-      msg = of.ofp_packet_out()
-      if time.time() - self.connection.connect_time >= _flood_delay:
-        # Only flood if we've been connected for a little while...
-
-        if self.hold_down_expired is False:
-          # Oh yes it is!
-          self.hold_down_expired = True
-          log.info("%s: Flood hold-down expired -- flooding",
-              dpid_to_str(event.dpid))
-
-        if message is not None: log.debug(message)
-        #log.debug("%i: flood %s -> %s", event.dpid,packet.src,packet.dst)
-        # OFPP_FLOOD is optional; on some switches you may need to change
-        # this to OFPP_ALL.
-        msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
-      else:
-        pass
-        #log.info("Holding down flood for %s", dpid_to_str(event.dpid))
-      msg.data = event.ofp
-      msg.in_port = event.port
-      self.connection.send(msg)
-
-    def drop (duration = None):
-      """
-      Drops this packet and optionally installs a flow to continue
-      dropping similar ones for a while
-      """
-      if duration is not None:
-        if not isinstance(duration, tuple):
-          duration = (duration,duration)
-        msg = of.ofp_flow_mod()
-        msg.match = of.ofp_match.from_packet(packet)
-        msg.idle_timeout = duration[0]
-        msg.hard_timeout = duration[1]
-        msg.buffer_id = event.ofp.buffer_id
-        self.connection.send(msg)
-      elif event.ofp.buffer_id is not None:
-        msg = of.ofp_packet_out()
-        msg.buffer_id = event.ofp.buffer_id
-        msg.in_port = event.port
-        self.connection.send(msg)
+    self.forwarder.forward(event, packet, _metrics, t) # 2-6
+    _metrics.done(t0, "forwarded")
 
-    if self.macToPort.values().count(event.port) >= 3:
-	log.info("Dropping packet at port %d", event.port)
-	drop()
-	return
-
-    self.macToPort[packet.src] = event.port # 1
-
-    if not self.transparent: # 2
-      if packet.type == packet.LLDP_TYPE or packet.dst.isBridgeFiltered():
-        drop() # 2a
-        return
-
-    if packet.dst.is_multicast:
-      flood() # 3a
-    else:
-      if packet.dst not in self.macToPort: # 4
-        flood("Port for %s unknown -- flooding" % (packet.dst,)) # 4a
-      else:
-        port = self.macToPort[packet.dst]
-        if port == event.port: # 5
-          # 5a
-          log.warning("Same port for packet from %s -> %s on %s.%s.  Drop."
-              % (packet.src, packet.dst, dpid_to_str(event.dpid), port))
-          drop(10)
-          return
-        # 6
-        log.debug("installing flow for %s.%i -> %s.%i" %
-                  (packet.src, event.port, packet.dst, port))
-        msg = of.ofp_flow_mod()
-        msg.match = of.ofp_match.from_packet(packet, event.port)
-        msg.idle_timeout = 10
-        msg.hard_timeout = 30
-        msg.actions.append(of.ofp_action_output(port = port))
-        msg.data = event.ofp # 6a
-        self.connection.send(msg)
 
 class l2_learning (object):
   """
@@ -201,9 +303,16 @@ class l2_learning (object):
     LearningSwitch(event.connection, self.transparent)
 
 
-def launch (transparent=False, hold_down=_flood_delay, ignore = None):
+def launch (transparent=False, hold_down=_flood_delay, ignore = None,
+            max_macs=_max_macs, violation_idle=_violation_idle,
+            violation_hard=_violation_hard,
+            violation_priority=_violation_priority):
   """
-  Starts an L2 learning switch.
+  Starts an L2 learning switch with port security.
+
+  max_macs is the number of source MACs allowed per port.  Sources beyond
+  that are dropped on the switch by a flow with the given violation
+  timeouts and priority.
   """
   try:
     global _flood_delay
@@ -212,6 +321,23 @@ def launch (transparent=False, hold_down=_flood_delay, ignore = None):
   except:
     raise RuntimeError("Expected hold-down to be a number")
 
+  try:
+    global _max_macs
+    _max_macs = int(str(max_macs), 10)
+    assert _max_macs >= 1
+  except:
+    raise RuntimeError("Expected max-macs to be a positive number")
+
+  try:
+    global _violation_idle, _violation_hard, _violation_priority
+    _violation_idle = int(str(violation_idle), 10)
+    _violation_hard = int(str(violation_hard), 10)
+    _violation_priority = int(str(violation_priority), 10)
+    assert _violation_idle >= 0 and _violation_hard >= 0
+    assert 0 <= _violation_priority <= 0xffff
+  except:
+    raise RuntimeError("Expected violation timeouts and priority to be numbers")
+
   if ignore:
     ignore = ignore.replace(',', ' ').split()
     ignore = set(str_to_dpid(dpid) for dpid in ignore)
@@ -0,0 +1,60 @@
+"""
+Answering ARP requests from the controller.
+
+When a component knows which MAC an IP address belongs to (from DHCP
+snooping, DAI's bindings or IP Source Guard's table), an ARP request
+for that address needn't be flooded: the controller can send the
+requester the reply itself, out of the port the request came in on.
+"""
+
+import pox.openflow.libopenflow_01 as of
+import pox.lib.packet as pkt
+from pox.lib.addresses import IP_ANY
+
+
+def should_answer (arp):
+  """
+  Is arp a request we may answer on the target's behalf?
+
+  Probes (sender IP 0.0.0.0) and gratuitous ARPs (sender IP is the
+  target IP) are left alone; they're for the hosts themselves to see.
+  """
+  return (arp.opcode == pkt.arp.REQUEST
+          and arp.protosrc != IP_ANY
+          and arp.protosrc != arp.protodst)
+
+
+def make_reply (packet, arp, mac):
+  """
+  Returns the ethernet packet answering request arp with mac
+
+  The reply is VLAN tagged if the request was.
+  """
+  r = pkt.arp(opcode = pkt.arp.REPLY, hwsrc = mac, hwdst = arp.hwsrc,
+              protosrc = arp.protodst, protodst = arp.protosrc)
+  e = pkt.ethernet(src = mac, dst = packet.src)
+  vlan = packet.find('vlan')
+  if vlan is None:
+    e.type = pkt.ethernet.ARP_TYPE
+    e.payload = r
+  else:
+    e.type = pkt.ethernet.VLAN_TYPE
+    v = pkt.vlan(id = vlan.id, pcp = vlan.pcp, eth_type = pkt.ethernet.ARP_TYPE)
+    v.payload = r
+    e.payload = v
+  return e
+
+
+def answer (connection, event, packet, arp, mac):
+  """
+  Sends the reply to request arp out of the port it came in on
+
+  If the request was buffered on the switch, the buffer is freed.
+  """
+  msg = of.ofp_packet_out(data = make_reply(packet, arp, mac).pack())
+  msg.actions.append(of.ofp_action_output(port = event.port))
+  connection.send(msg)
+  if event.ofp.buffer_id is not None:
+    msg = of.ofp_packet_out(buffer_id = event.ofp.buffer_id,
+                            in_port = event.port)
+    connection.send(msg)
@@ -0,0 +1,35 @@
+"""
+Token bucket rate limiting.
+"""
+
+import time
+
+
+class TokenBucket (object):
+  """
+  Allows up to rate events per second on average, in bursts of up to burst
+
+  consume() is cheap enough to call for every packet: it refills lazily
+  from the time elapsed since the last call.
+  """
+  __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+  def __init__ (self, rate, burst = None):
+    self.rate = float(rate)
+    self.burst = float(burst if burst is not None else max(rate, 1))
+    self.tokens = self.burst
+    self.stamp = time.time()
+
+  def consume (self, n = 1, now = None):
+    """
+    Takes n tokens if available; returns False if the event is over rate
+    """
+    if now is None: now = time.time()
+    tokens = self.tokens + (now - self.stamp) * self.rate
+    if tokens > self.burst: tokens = self.burst
+    self.stamp = now
+    if tokens < n:
+      self.tokens = tokens
+      return False
+    self.tokens = tokens - n
+    return True
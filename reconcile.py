@@ -0,0 +1,146 @@
+"""
+Picking up a switch's forwarding flows when it (re)connects.
+
+A switch which reconnects (after a controller failover, or just a new
+TCP connection) still has the forwarding flows it was given, but a new
+learning switch starts with an empty MAC table, so all traffic for
+which the flows have expired comes to us again.  With this component
+loaded, each learning switch first asks its switch for its flows:
+
+  ./pox.py NetworkSystemsAssignment1.reconcile NetworkSystemsAssignment1.portSecurity
+
+Every forwarding flow (learning's priority and a single output action)
+says that its destination is out of its output port, and, if it matches
+them, that its source is on its ingress port; those are learned.  Flows
+which disagree with another flow about where a MAC is, which send out of
+their ingress port or to a multicast address, or which are coarser than
+the learning switch's granularity now allows, are deleted.  Everything
+else is left alone.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.util import dpid_to_str
+import time
+
+log = core.getLogger()
+
+# Whether learning switches reconcile at all
+_enabled = False
+
+
+def _granularity (match):
+  """
+  Returns how specific a forwarding flow's match is (see learning)
+  """
+  if match.dl_src is None: return "dst"
+  if match.dl_type is None: return "src_dst"
+  return "exact"
+
+
+class FlowReconciler (object):
+  """
+  Rebuilds an L2Forwarder's MAC table from its switch's flows
+  """
+  def __init__ (self, forwarder):
+    self.forwarder = forwarder
+    self.connection = forwarder.connection
+    self.learned = 0
+    self.kept = 0
+    self.deleted = 0
+
+    # Called with (mac, port) to learn a MAC.  Owners which index the
+    # MAC table (e.g., port security) replace it with their own.
+    self.learn = forwarder.macToPort.learn
+
+    msg = of.ofp_stats_request(body = of.ofp_flow_stats_request())
+    self._xid = msg.xid
+    self._asked = time.time()
+    self._listeners = self.connection.addListeners(self)
+    self.connection.send(msg)
+
+  def _stop_listening (self):
+    # Not done directly since we may be in the middle of an event
+    if self._listeners:
+      core.callLater(self.connection.removeListeners, self._listeners)
+      self._listeners = None
+
+  def _handle_FlowStatsReceived (self, event):
+    if event.ofp[0].xid != self._xid: return
+    self._stop_listening()
+    self.reconcile(event.stats)
+
+  def _handle_ConnectionDown (self, event):
+    self._stop_listening()
+
+  def reconcile (self, stats):
+    """
+    Learns from the forwarding flows in stats, deleting conflicting ones
+    """
+    from .learning import GRANULARITIES # learning imports us
+    finest = GRANULARITIES.index(self.forwarder.granularity)
+
+    flows = []    # Forwarding flows we may keep
+    where = {}    # MAC -> set of ports the flows put it on
+    for stat in stats:
+      if stat.priority != of.OFP_DEFAULT_PRIORITY: continue
+      if len(stat.actions) != 1: continue
+      action = stat.actions[0]
+      if not isinstance(action, of.ofp_action_output): continue
+      match = stat.match
+      if match.dl_dst is None or action.port >= of.OFPP_MAX: continue
+      if (match.dl_dst.is_multicast or action.port == match.in_port
+          or GRANULARITIES.index(_granularity(match)) > finest):
+        self._delete(stat)
+        continue
+      flows.append(stat)
+      where.setdefault(match.dl_dst, set()).add(action.port)
+      if match.dl_src is not None and match.in_port is not None:
+        where.setdefault(match.dl_src, set()).add(match.in_port)
+
+    table = self.forwarder.macToPort
+    bad = set()   # MACs whose flows must go
+    for mac, ports in where.items():
+      if len(ports) != 1:
+        bad.add(mac)
+        continue
+      port = next(iter(ports))
+      seen = table.last_seen(mac)
+      if seen is not None and seen >= self._asked:
+        # Learned from a PacketIn since we asked; that's newer
+        if table.get(mac) != port: bad.add(mac)
+      elif self.learn(mac, port) is False:
+        bad.add(mac) # E.g., over port security's limit
+      else:
+        self.learned += 1
+
+    for stat in flows:
+      match = stat.match
+      if match.dl_dst in bad or match.dl_src in bad:
+        self._delete(stat)
+      else:
+        self.kept += 1
+
+    log.info("%s: Reconciled flows: kept %i, deleted %i, learned %i MACs",
+             dpid_to_str(self.connection.dpid), self.kept, self.deleted,
+             self.learned)
+
+  def _delete (self, stat):
+    msg = of.ofp_flow_mod(command = of.OFPFC_DELETE_STRICT)
+    msg.match = stat.match
+    msg.priority = stat.priority
+    self.connection.send(msg)
+    self.deleted += 1
+
+
+def reconcile (forwarder):
+  """
+  Starts reconciling forwarder with its switch's flows, if we're loaded
+  """
+  if not _enabled: return None
+  return FlowReconciler(forwarder)
+
+
+def launch ():
+  global _enabled
+  _enabled = True
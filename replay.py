@@ -0,0 +1,218 @@
+"""
+Replaying frames into components without switches.
+
+Provides stand-ins for the OpenFlow nexus and for switch connections, so
+that components can be driven with synthetic PacketIn events, and a
+reader for capture files.  Used by the benchmark component.
+
+Captures may be classic pcap or pcapng.  In pcapng, the interface each
+packet was captured on gives its ingress port (interface 0 is port 1,
+and so on); classic pcap has no such field, so the ingress port is
+picked from the source MAC by PortAssigner.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.openflow import ConnectionUp, ConnectionDown, PortStatus
+from pox.openflow import FlowRemoved, PacketIn, BarrierIn
+from pox.openflow import FlowStatsReceived
+from pox.lib.revent import EventMixin
+import struct
+import time
+
+from . import fastpath
+
+log = core.getLogger()
+
+_connection_events = set([ConnectionDown, PortStatus, FlowRemoved,
+                          PacketIn, BarrierIn, FlowStatsReceived])
+
+
+class FakeNexus (EventMixin):
+  """
+  Stands in for core.openflow
+  """
+  _eventMixin_events = _connection_events | set([ConnectionUp])
+
+  def __init__ (self):
+    self.connections = {} # DPID -> RecordingConnection
+
+  def getConnection (self, dpid):
+    return self.connections.get(dpid)
+
+  def connect (self, connection):
+    """
+    Adds a connection and raises ConnectionUp for it
+    """
+    self.connections[connection.dpid] = connection
+    features = of.ofp_features_reply(datapath_id = connection.dpid)
+    self._raise(connection, ConnectionUp(connection, features))
+
+  def deliver (self, connection, ofp):
+    """
+    Raises a PacketIn for ofp as a real connection would
+
+    Returns the event.
+    """
+    return self._raise(connection, PacketIn(connection, ofp))
+
+  def _raise (self, connection, event):
+    # Like a real connection: on us first, then on the connection, unless
+    # a listener here halts the event
+    self.raiseEventNoErrors(event)
+    if not event.halt:
+      connection.raiseEventNoErrors(event)
+    return event
+
+
+def install_nexus ():
+  """
+  Registers a FakeNexus as core.openflow and returns it
+  """
+  nexus = FakeNexus()
+  core.register("openflow", nexus)
+  return nexus
+
+
+class RecordingConnection (EventMixin):
+  """
+  Stands in for a switch connection, counting what is sent to it
+
+  counts maps OpenFlow message type names to the number sent.  If keep
+  is True, the messages themselves are kept in sent.
+  """
+  _eventMixin_events = _connection_events
+
+  def __init__ (self, dpid, keep = False):
+    self.dpid = dpid
+    self.connect_time = time.time()
+    self.keep = keep
+    self.sent = []
+    self.counts = {}
+    self.bytes_sent = 0
+
+  def send (self, data):
+    if self.keep: self.sent.append(data)
+    if isinstance(data, bytes):
+      name = "raw"
+      self.bytes_sent += len(data)
+    else:
+      name = type(data).__name__
+    self.counts[name] = self.counts.get(name, 0) + 1
+
+  def reset_counts (self):
+    self.sent = []
+    self.counts = {}
+    self.bytes_sent = 0
+
+
+def make_packet_in (data, in_port, reason = of.OFPR_NO_MATCH):
+  """
+  Makes an unbuffered ofp_packet_in carrying the frame data
+
+  reason is OFPR_ACTION for a frame a flow sent to the controller (e.g.,
+  dhcp_snooping's trap flows), and OFPR_NO_MATCH for a table miss.
+  """
+  return of.ofp_packet_in(in_port = in_port, data = data, reason = reason,
+                          total_len = len(data))
+
+
+# Kinds of frame which may be sent to the controller by a flow, rather
+# than on a table miss: name -> test of the frame's fastpath Headers
+TRAPPED_KINDS = {
+  "dhcp" : fastpath.is_dhcp,
+  "arp" : lambda h: h.arp_op is not None,
+}
+
+
+def packet_in_reason (data, trapped = ()):
+  """
+  Returns the reason a switch would give for sending us the frame data
+
+  trapped is a list of names from TRAPPED_KINDS; frames of those kinds
+  are taken to have been sent by a flow (OFPR_ACTION).
+  """
+  if trapped:
+    h = fastpath.classify(data)
+    if h is not None:
+      for kind in trapped:
+        if TRAPPED_KINDS[kind](h): return of.OFPR_ACTION
+  return of.OFPR_NO_MATCH
+
+
+class PortAssigner (object):
+  """
+  Picks ingress ports for frames with no port of their own
+
+  Each new source MAC gets the next port, wrapping after ports.
+  """
+  def __init__ (self, ports = 48):
+    self.ports = ports
+    self._ports = {}
+
+  def __call__ (self, data):
+    src = data[6:12]
+    port = self._ports.get(src)
+    if port is None:
+      port = self._ports[src] = len(self._ports) % self.ports + 1
+    return port
+
+
+_PCAP_MAGIC = (0xa1b2c3d4, 0xa1b23c4d) # usec, nsec
+_PCAPNG_SHB = 0x0a0d0d0a
+_PCAPNG_EPB = 6
+_PCAPNG_SPB = 3
+
+
+def read_frames (filename):
+  """
+  Yields (ingress port, frame) from a pcap or pcapng file
+
+  The port is None for classic pcap files.
+  """
+  with open(filename, 'rb') as f:
+    head = f.read(4)
+    if len(head) < 4: return
+    if struct.unpack("<I", head)[0] == _PCAPNG_SHB:
+      for r in _read_pcapng(f, head):
+        yield r
+    else:
+      for r in _read_pcap(f, head):
+        yield r
+
+
+def _read_pcap (f, head):
+  for endian in "<>":
+    if struct.unpack(endian + "I", head)[0] in _PCAP_MAGIC: break
+  else:
+    raise RuntimeError("Not a pcap file")
+  f.read(20) # Rest of global header
+  rec = struct.Struct(endian + "IIII")
+  while True:
+    h = f.read(rec.size)
+    if len(h) < rec.size: return
+    _, _, caplen, _ = rec.unpack(h)
+    yield None, f.read(caplen)
+
+
+def _read_pcapng (f, head):
+  endian = "<"
+  while True:
+    h = head + f.read(4) if head else f.read(8)
+    head = None
+    if len(h) < 8: return
+    btype = struct.unpack(endian + "I", h[:4])[0]
+    if btype == _PCAPNG_SHB:
+      bom = f.read(4)
+      endian = "<" if struct.unpack("<I", bom)[0] == 0x1a2b3c4d else ">"
+      blen = struct.unpack(endian + "I", h[4:])[0]
+      body = f.read(blen - 12)
+      continue
+    blen = struct.unpack(endian + "I", h[4:])[0]
+    body = f.read(blen - 8)
+    if btype == _PCAPNG_EPB:
+      iface, _, _, caplen, _ = struct.unpack(endian + "IIIII", body[:20])
+      yield iface + 1, body[20:20+caplen]
+    elif btype == _PCAPNG_SPB:
+      origlen = struct.unpack(endian + "I", body[:4])[0]
+      yield None, body[4:4+min(origlen, len(body) - 8)]
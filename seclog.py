@@ -0,0 +1,85 @@
+"""
+Rate-limited, buffered logging of security events.
+
+The security components record violations (spoofed packets, rogue DHCP
+servers, port security violations, ...) through an EventLog instead of
+logging them directly.  Recording an event only appends its arguments
+to a buffer; formatting and writing happen later, in one batch, from the
+cooperative thread.  Each kind of event has its own token bucket, so a
+flood of one kind of violation can't swamp the log; events over the rate
+are counted and the count is logged with the next batch.
+
+Run this as a component to change the defaults, e.g.:
+  seclog --rate=5 --burst=20 --interval=2
+"""
+
+from pox.core import core
+from .ratelimit import TokenBucket
+from collections import deque
+import logging
+
+# Events per second and burst size allowed for each kind of event
+_rate = 10
+_burst = 50
+
+# Seconds between flushes of buffered events
+_interval = 1
+
+# Events buffered beyond this are dropped (and counted as suppressed)
+_max_pending = 10000
+
+
+class EventLog (object):
+  """
+  Buffers and rate-limits security events for a logger
+  """
+  def __init__ (self, logger, level = logging.INFO):
+    self.logger = logger
+    self.level = level
+    self._buckets = {}     # kind -> TokenBucket
+    self._suppressed = {}  # kind -> count since last flush
+    self._pending = deque()
+    self._flush_scheduled = False
+
+  def event (self, kind, msg, *args):
+    """
+    Records an event of the given kind
+
+    msg and args are as for logging; they're only formatted if the
+    event is actually written.
+    """
+    bucket = self._buckets.get(kind)
+    if bucket is None:
+      bucket = self._buckets[kind] = TokenBucket(_rate, _burst)
+    if not bucket.consume() or len(self._pending) >= _max_pending:
+      self._suppressed[kind] = self._suppressed.get(kind, 0) + 1
+    else:
+      self._pending.append((kind, msg, args))
+    if not self._flush_scheduled:
+      self._flush_scheduled = True
+      core.callDelayed(_interval, self.flush)
+
+  def flush (self):
+    """
+    Writes out buffered events and suppression counts
+    """
+    self._flush_scheduled = False
+    pending = self._pending
+    self._pending = deque()
+    suppressed = self._suppressed
+    self._suppressed = {}
+    if not self.logger.isEnabledFor(self.level): return
+    for kind, msg, args in pending:
+      self.logger.log(self.level, "[%s] " + msg, kind, *args)
+    for kind, count in suppressed.items():
+      self.logger.log(self.level, "[%s] %i more events suppressed",
+                      kind, count)
+
+
+def launch (rate = _rate, burst = _burst, interval = _interval,
+            max_pending = _max_pending):
+  global _rate, _burst, _interval, _max_pending
+  _rate = float(rate)
+  _burst = float(burst)
+  _interval = float(interval)
+  _max_pending = int(max_pending)
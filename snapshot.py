@@ -0,0 +1,374 @@
+"""
+Warm-restart snapshots of the switches' state.
+
+Without this, a restarted controller starts with empty MAC tables, no
+known DHCP server ports or bindings and no blocked spoofers, so it sees
+a storm of PacketIns while everything is learned again.  With it loaded,
+that state is saved as it changes and handed back to the components when
+each switch connects again (load this before them):
+
+  ./pox.py NetworkSystemsAssignment1.snapshot --path=/var/tmp/pox.snap \
+      NetworkSystemsAssignment1.portSecurity
+
+The file is a log of fixed-size records (MAC learned or evicted, DHCP
+server port, binding added or removed, spoofer blocked).  The MAC
+tables, binding tables and spoofer trackers note which of their entries
+change, and every interval seconds, records for just those are
+appended, so the cost of a dump doesn't grow with the size of the
+tables.  When the log has grown to more than twice the live state, it
+is compacted: the live state is written to a new file, which replaces
+the old one.  At startup, the file is mapped (mmap) and its records are
+unpacked straight from the mapping; a partly written last record is
+ignored.
+
+Components hand their state to us with track_macs(), track_dhcp() and
+track_spoofers(), which first restore what was saved; these do nothing
+unless this component is loaded.  Each worker process (see workers)
+keeps its own file, the path with ".<worker index>" appended, for the
+switches it handles.  It's started from the controller's file the first
+time; a worker's switches are only the same after a restart with the
+same number of workers.
+"""
+
+from pox.core import core
+from pox.lib.recoco import Timer
+import mmap
+import os
+import struct
+import time
+
+from .bindings import mac_to_int, int_to_mac, ip_to_int, int_to_ip
+from . import workers
+
+log = core.getLogger()
+
+# Snapshot file
+_path = "pox-state.snap"
+
+# Seconds between appending changes
+_interval = 5
+
+# The log isn't compacted until it has at least this many records
+_min_compact = 4096
+
+# The SnapshotStore, if we're loaded
+_store = None
+
+_magic = b"POXSNAP1"
+
+# kind, name, DPID, MAC, IP, port, VLAN, time
+_record = struct.Struct("!c16sQQIHHd")
+
+_NO_VLAN = 0xffff
+
+# Record kinds
+_MAC = b"M"          # MAC learned on port, last seen at time
+_MAC_GONE = b"m"     # MAC evicted or forgotten
+_SERVER_PORT = b"S"  # DHCP server port
+_BINDING = b"B"      # DHCP binding of MAC to IP on port/VLAN, expiring at time
+_BINDING_GONE = b"b" # DHCP binding of MAC removed
+_SPOOFER = b"X"      # Spoofer MAC on port blocked by tracker name until time
+
+_replace = getattr(os, "replace", os.rename)
+
+
+def _rec (kind, dpid = 0, mac = 0, ip = 0, port = 0, vlan = None, t = 0,
+          name = b""):
+  if vlan is None: vlan = _NO_VLAN
+  return (kind, name, dpid, mac, ip, port, vlan, t)
+
+
+class SnapshotStore (object):
+  """
+  The saved state, and the live state it's kept in step with
+
+  The dicts hold what the file says, with MACs and IPs as integers.
+  """
+  def __init__ (self, path):
+    self.path = path
+    self.macs = {}      # DPID -> {MAC : (port, last seen)}
+    self.servers = {}   # DPID -> set of DHCP server ports
+    self.bindings = {}  # DPID -> {MAC : (IP, port, VLAN, expires)}
+    self.spoofers = {}  # Tracker name -> {(DPID, port, MAC) : blocked until}
+
+    self._tables = {}   # DPID -> MacTable
+    self._snoopers = {} # DPID -> DHCPSnooper
+    self._trackers = [] # SpooferTrackers
+    self._records = 0   # Records in the file
+    self._log = None
+
+    self.load()
+    self._timer = Timer(_interval, self.dump, recurring = True)
+    workers.at_fork(self._handle_fork)
+    core.openflow.addListeners(self)
+    core.addListenerByName("GoingDownEvent", self._handle_GoingDownEvent)
+
+  def load (self):
+    """
+    Reads the file into our dicts
+    """
+    try:
+      f = open(self.path, "rb")
+    except IOError:
+      return
+    with f:
+      size = os.fstat(f.fileno()).st_size
+      if size < len(_magic): return
+      mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+      try:
+        if mm[:len(_magic)] != _magic:
+          log.warning("%s is not a snapshot; ignoring it", self.path)
+          return
+        end = size - _record.size
+        offset = len(_magic)
+        unpack = _record.unpack_from
+        while offset <= end:
+          self._apply(unpack(mm, offset))
+          offset += _record.size
+          self._records += 1
+      finally:
+        mm.close()
+    log.info("Loaded %i records from %s", self._records, self.path)
+
+  def _apply (self, r):
+    kind, name, dpid, mac, ip, port, vlan, t = r
+    if kind == _MAC:
+      self.macs.setdefault(dpid, {})[mac] = (port, t)
+    elif kind == _MAC_GONE:
+      self.macs.get(dpid, {}).pop(mac, None)
+    elif kind == _SERVER_PORT:
+      self.servers.setdefault(dpid, set()).add(port)
+    elif kind == _BINDING:
+      if vlan == _NO_VLAN: vlan = None
+      self.bindings.setdefault(dpid, {})[mac] = (ip, port, vlan, t)
+    elif kind == _BINDING_GONE:
+      self.bindings.get(dpid, {}).pop(mac, None)
+    elif kind == _SPOOFER:
+      name = name.rstrip(b"\0").decode()
+      self.spoofers.setdefault(name, {})[(dpid, port, mac)] = t
+
+  def track_macs (self, dpid, table):
+    entries = self.macs.get(dpid)
+    if entries:
+      cutoff = time.time() - table.max_age if table.max_age else 0
+      entries = sorted(entries.items(), key = lambda e: e[1][1])
+      for mac, (port, seen) in entries:
+        if seen > cutoff: table.learn(mac, port, seen)
+      log.debug("Restored %i MACs for switch %s", len(table), dpid)
+    self._tables[dpid] = table
+    table.track_changes()
+
+  def track_dhcp (self, snooper):
+    dpid = snooper.connection.dpid
+    bindings = [(int_to_mac(mac), int_to_ip(ip), port, vlan, expires)
+                for mac, (ip, port, vlan, expires)
+                in self.bindings.get(dpid, {}).items()]
+    snooper.restore(self.servers.get(dpid, ()), bindings)
+    self._snoopers[dpid] = snooper
+    snooper.bindings.track_changes()
+
+  def track_spoofers (self, tracker):
+    self._restore_spoofers(tracker)
+    self._trackers.append(tracker)
+    tracker.track_changes()
+
+  def _restore_spoofers (self, tracker):
+    blocked = self.spoofers.get(tracker.name, {})
+    tracker.restore([((dpid, port, int_to_mac(mac)), until)
+                     for (dpid, port, mac), until in blocked.items()])
+
+  def _handle_fork (self, worker):
+    """
+    Moves to the worker's own file, keeping just its switches' state
+    """
+    if self._log is not None:
+      self._log.close()
+      self._log = None
+    self.path = "%s.%i" % (self.path, worker)
+    if os.path.exists(self.path):
+      self.macs, self.servers, self.bindings = {}, {}, {}
+      self.spoofers = {}
+      self._records = 0
+      self.load()
+    else:
+      # Start the worker's file with its switches' state from ours
+      mine = lambda dpid: workers.shard(dpid) == worker
+      for d in (self.macs, self.servers, self.bindings):
+        for dpid in [dpid for dpid in d if not mine(dpid)]:
+          del d[dpid]
+      for spoofers in self.spoofers.values():
+        for key in [key for key in spoofers if not mine(key[0])]:
+          del spoofers[key]
+      self.compact()
+    # Nothing has been spoofed since they were restored, before the fork
+    for tracker in self._trackers:
+      tracker.offenders.clear()
+      tracker.changes()
+      self._restore_spoofers(tracker)
+    self._timer = Timer(_interval, self.dump, recurring = True)
+
+  def _changes (self):
+    """
+    Returns records for what changed since the last call
+
+    The tables and trackers keep track of which of their keys changed,
+    so only those are looked at.
+    """
+    records = []
+
+    for dpid, table in self._tables.items():
+      for mac in table.changes():
+        port = table.get(mac)
+        if port is None:
+          records.append(_rec(_MAC_GONE, dpid, mac))
+        else:
+          records.append(_rec(_MAC, dpid, mac, port = port,
+                              t = table.last_seen(mac)))
+
+    for dpid, snooper in self._snoopers.items():
+      saved = self.servers.get(dpid, ())
+      for port in snooper.trusted_ports: # Only ever a few
+        if port not in saved:
+          records.append(_rec(_SERVER_PORT, dpid, port = port))
+      bindings = snooper.bindings
+      for mac in bindings.changes():
+        b = bindings.get(mac)
+        if b is None:
+          records.append(_rec(_BINDING_GONE, dpid, mac_to_int(mac)))
+        else:
+          records.append(_rec(_BINDING, dpid, mac_to_int(mac),
+                              ip_to_int(b.ip), b.port, b.vlan, b.expires))
+
+    for tracker in self._trackers:
+      name = tracker.name.encode()
+      for key in tracker.changes():
+        o = tracker.offenders.get(key)
+        if o is None or not o.blocked_until: continue
+        dpid, port, mac = key
+        records.append(_rec(_SPOOFER, dpid, mac_to_int(mac), port = port,
+                            t = o.blocked_until, name = name))
+    return records
+
+  def dump (self):
+    """
+    Appends what changed since the last dump, compacting if needed
+    """
+    records = self._changes()
+    if not records: return
+    for r in records:
+      self._apply(r)
+    if self._log is None:
+      self._log = open(self.path, "ab")
+      if self._log.tell() == 0:
+        self._log.write(_magic)
+    pack = _record.pack
+    self._log.write(b"".join(pack(*r) for r in records))
+    self._log.flush()
+    self._records += len(records)
+    if self._records > max(_min_compact, 2 * self._live()):
+      self.compact()
+
+  def _live (self):
+    return (sum(len(m) for m in self.macs.values())
+            + sum(len(p) for p in self.servers.values())
+            + sum(len(b) for b in self.bindings.values())
+            + sum(len(s) for s in self.spoofers.values()))
+
+  def _live_records (self):
+    for dpid, macs in self.macs.items():
+      for mac, (port, seen) in macs.items():
+        yield _rec(_MAC, dpid, mac, port = port, t = seen)
+    for dpid, ports in self.servers.items():
+      for port in ports:
+        yield _rec(_SERVER_PORT, dpid, port = port)
+    for dpid, bindings in self.bindings.items():
+      for mac, (ip, port, vlan, expires) in bindings.items():
+        yield _rec(_BINDING, dpid, mac, ip, port, vlan, expires)
+    for name, spoofers in self.spoofers.items():
+      for (dpid, port, mac), until in spoofers.items():
+        yield _rec(_SPOOFER, dpid, mac, port = port, t = until,
+                   name = name.encode())
+
+  def _prune (self):
+    """
+    Forgets saved state which has aged out
+    """
+    now = time.time()
+    for dpid, table in self._tables.items():
+      if not table.max_age: continue
+      macs = self.macs.get(dpid, {})
+      cutoff = now - table.max_age
+      for mac in [m for m, (_, seen) in macs.items() if seen <= cutoff]:
+        del macs[mac]
+    for bindings in self.bindings.values():
+      for mac in [m for m, b in bindings.items() if b[3] <= now]:
+        del bindings[mac]
+    for spoofers in self.spoofers.values():
+      for key in [k for k, until in spoofers.items() if until <= now]:
+        del spoofers[key]
+
+  def compact (self):
+    """
+    Replaces the log with just the live state
+    """
+    self._prune()
+    tmp = self.path + ".tmp"
+    pack = _record.pack
+    n = 0
+    with open(tmp, "wb") as f:
+      f.write(_magic)
+      for r in self._live_records():
+        f.write(pack(*r))
+        n += 1
+      f.flush()
+      os.fsync(f.fileno())
+    if self._log is not None:
+      self._log.close()
+      self._log = None
+    _replace(tmp, self.path)
+    log.debug("Compacted %s from %i to %i records", self.path,
+              self._records, n)
+    self._records = n
+
+  def _handle_ConnectionUp (self, event):
+    for tracker in self._trackers:
+      tracker.reblock(event.connection)
+
+  def _handle_ConnectionDown (self, event):
+    self.dump()
+    self._tables.pop(event.dpid, None)
+    self._snoopers.pop(event.dpid, None)
+
+  def _handle_GoingDownEvent (self, event):
+    self._timer.cancel()
+    self.dump()
+    self.compact()
+
+
+def track_macs (dpid, table):
+  """
+  Restores a switch's saved MAC table into table, and saves its changes
+  """
+  if _store is not None: _store.track_macs(dpid, table)
+
+
+def track_dhcp (snooper):
+  """
+  Restores a DHCPSnooper's server ports and bindings, and saves changes
+  """
+  if _store is not None: _store.track_dhcp(snooper)
+
+
+def track_spoofers (tracker):
+  """
+  Restores a SpooferTracker's blocked spoofers, and saves new blocks
+  """
+  if _store is not None: _store.track_spoofers(tracker)
+
+
+def launch (path = _path, interval = _interval, min_compact = _min_compact):
+  global _path, _interval, _min_compact, _store
+  _path = path
+  _interval = float(interval)
+  _min_compact = int(min_compact)
+  _store = SnapshotStore(_path)
@@ -0,0 +1,163 @@
+"""
+Rate-based tracking and blocking of spoofing hosts.
+
+DAI and IPSourceGuard report each spoofed packet to a SpooferTracker.
+A host is blocked once it has sent threshold spoofed packets within
+window seconds; the block is a drop flow on (in_port, dl_src) which the
+switch removes by itself after block_time seconds.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+from pox.lib.util import dpid_to_str
+from collections import deque
+import math
+import time
+
+from .batching import batched
+from .seclog import EventLog
+from . import metrics
+from . import snapshot
+from . import workers
+
+log = core.getLogger()
+slog = EventLog(log)
+
+
+class Offender (object):
+  """
+  Recent spoofing by one (switch, port, MAC)
+
+  hits is a ring holding the times of the last threshold spoofed packets.
+  """
+  __slots__ = ('hits', 'last', 'blocked_until')
+
+  def __init__ (self, threshold):
+    self.hits = deque(maxlen = threshold)
+    self.last = 0
+    self.blocked_until = 0
+
+
+class SpooferTracker (object):
+  """
+  Counts spoofed packets per offender and blocks offenders over the rate
+  """
+  def __init__ (self, name, threshold = 1, window = 10, block_time = 300,
+                priority = of.OFP_DEFAULT_PRIORITY + 400):
+    if threshold < 1:
+      raise RuntimeError("Expected threshold to be a positive number")
+    self.name = name
+    self.threshold = threshold
+    self.window = window
+    self.block_time = block_time
+    self.priority = priority
+
+    # (DPID, port, MAC) -> Offender
+    self.offenders = {}
+
+    # Keys of offenders blocked since changes() was last called, once
+    # track_changes() has been
+    self._dirty = None
+
+    self._start_timer()
+    workers.at_fork(self._start_timer)
+    snapshot.track_spoofers(self)
+    metrics.gauge("spoofers.%s" % (name,), self.__len__)
+
+  def _start_timer (self, worker = None):
+    self._expire_timer = Timer(max(self.window, 1), self.expire,
+                               recurring = True)
+
+  def __len__ (self):
+    return len(self.offenders)
+
+  def report (self, event, mac):
+    """
+    Records a spoofed packet from mac on event's switch and port
+
+    Returns True if this packet put the offender over the threshold and
+    it was blocked.
+    """
+    now = time.time()
+    key = (event.dpid, event.port, mac)
+    o = self.offenders.get(key)
+    if o is None:
+      o = self.offenders[key] = Offender(self.threshold)
+    o.last = now
+    if o.blocked_until > now:
+      # Already blocked; this one was probably in flight
+      return False
+    hits = o.hits
+    hits.append(now)
+    if len(hits) < self.threshold or now - hits[0] > self.window:
+      return False
+    hits.clear()
+    o.blocked_until = now + self.block_time
+    if self._dirty is not None: self._dirty.add(key)
+    self.block(event.connection, event.port, mac)
+    return True
+
+  def track_changes (self):
+    """
+    Starts keeping track of which offenders are blocked
+    """
+    if self._dirty is None: self._dirty = set()
+
+  def changes (self):
+    """
+    Returns the keys of offenders blocked since the last call
+    """
+    dirty = self._dirty
+    if dirty is None: return ()
+    self._dirty = set()
+    return dirty
+
+  def block (self, connection, port, mac, block_time = None):
+    if block_time is None: block_time = self.block_time
+    slog.event("spoofer_blocked", "%s: blocking %s on %s.%i for %s seconds",
+               self.name, mac, dpid_to_str(connection.dpid), port,
+               block_time)
+    msg = of.ofp_flow_mod()
+    msg.match = of.ofp_match(in_port = port, dl_src = mac)
+    msg.priority = self.priority
+    msg.hard_timeout = block_time
+    batched(connection).send(msg)
+
+  def restore (self, blocked):
+    """
+    Takes up blocks saved before a restart (see snapshot)
+
+    blocked is a list of ((DPID, port, MAC), blocked until).
+    """
+    now = time.time()
+    for key, until in blocked:
+      if until <= now: continue
+      o = self.offenders.get(key)
+      if o is None:
+        o = self.offenders[key] = Offender(self.threshold)
+      o.last = now
+      o.blocked_until = until
+
+  def reblock (self, connection):
+    """
+    Blocks again the offenders still blocked on connection's switch
+
+    For when the switch connects, in case it lost the drop flows.
+    """
+    now = time.time()
+    for (dpid, port, mac), o in list(self.offenders.items()):
+      if dpid == connection.dpid and o.blocked_until > now:
+        self.block(connection, port, mac,
+                   int(math.ceil(o.blocked_until - now)))
+
+  def expire (self, now = None):
+    """
+    Forgets offenders which are neither blocked nor recently active
+    """
+    if now is None: now = time.time()
+    stale = now - self.window
+    dead = [k for k, o in self.offenders.items()
+            if o.last < stale and o.blocked_until <= now]
+    for k in dead:
+      del self.offenders[k]
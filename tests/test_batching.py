@@ -0,0 +1,112 @@
+"""
+Tests of dropping repeated flow_mods within a batch.
+
+Run from the pox directory, with this repository in ext/:
+
+  python -m unittest discover ext/NetworkSystemsAssignment1/tests
+"""
+
+import importlib
+import os
+import sys
+import unittest
+
+try:
+  import pox.openflow.libopenflow_01 as of
+except ImportError:
+  raise unittest.SkipTest("POX is not on the path")
+
+_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_repo))
+_package = os.path.basename(_repo)
+batching = importlib.import_module(_package + ".batching")
+
+
+class Connection (object):
+  """
+  Records what's written to it
+  """
+  def __init__ (self):
+    self.written = []
+
+  def addListenerByName (self, name, handler):
+    pass
+
+  def send (self, data):
+    self.written.append(data)
+
+
+def _add (**kw):
+  msg = of.ofp_flow_mod(**kw)
+  msg.match.dl_type = 0x0806
+  msg.match.in_port = 3
+  msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
+  return msg
+
+
+class DedupTest (unittest.TestCase):
+  def setUp (self):
+    self.connection = Connection()
+    self.batcher = batching.MessageBatcher(self.connection)
+    # Tests flush by hand, rather than at the end of the current task
+    self.batcher._flush_scheduled = True
+
+  def assertWritten (self, msgs):
+    self.batcher.flush()
+    self.assertEqual(b"".join(self.connection.written),
+                     b"".join(m.pack() for m in msgs))
+
+  def test_identical_adds (self):
+    a = _add()
+    self.batcher.send(a)
+    self.batcher.send(_add())
+    self.assertWritten([a])
+
+  def test_different_adds (self):
+    msgs = [_add(), _add(priority = 1), _add(idle_timeout = 10),
+            _add(cookie = 5)]
+    for msg in msgs:
+      self.batcher.send(msg)
+    self.assertWritten(msgs)
+
+  def test_cleared_by_other_flow_mods (self):
+    for command in (of.OFPFC_DELETE, of.OFPFC_DELETE_STRICT,
+                    of.OFPFC_MODIFY, of.OFPFC_MODIFY_STRICT):
+      self.setUp()
+      msgs = [_add(), of.ofp_flow_mod(command = command), _add()]
+      for msg in msgs:
+        self.batcher.send(msg)
+      self.assertWritten(msgs)
+
+  def test_not_cleared_by_other_messages (self):
+    a = _add()
+    po = of.ofp_packet_out(data = b"x" * 60)
+    self.batcher.send(a)
+    self.batcher.send(po)
+    self.batcher.send(_add())
+    self.assertWritten([a, po])
+
+  def test_cleared_by_flush (self):
+    a = _add()
+    self.batcher.send(a)
+    self.batcher.flush()
+    self.batcher.send(_add())
+    self.assertWritten([a, a])
+
+  def test_buffered_packet (self):
+    a = _add()
+    self.batcher.send(a)
+    self.batcher.send(_add(buffer_id = 7))
+    po = of.ofp_packet_out(actions = a.actions, buffer_id = 7, in_port = 3)
+    self.assertWritten([a, po])
+
+  def test_packet_data (self):
+    a = _add()
+    self.batcher.send(a)
+    self.batcher.send(_add(data = b"x" * 60))
+    po = of.ofp_packet_out(actions = a.actions, data = b"x" * 60)
+    self.assertWritten([a, po])
+
+
+if __name__ == "__main__":
+  unittest.main()
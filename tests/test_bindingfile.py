@@ -0,0 +1,200 @@
+"""
+Tests of reading binding files and diffing reloads.
+
+Run from the pox directory, with this repository in ext/:
+
+  python -m unittest discover ext/NetworkSystemsAssignment1/tests
+"""
+
+import importlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+  from pox.core import core
+except ImportError:
+  raise unittest.SkipTest("POX is not on the path")
+
+_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_repo))
+_package = os.path.basename(_repo)
+bindingfile = importlib.import_module(_package + ".bindingfile")
+
+_ip1 = 0x0a000001
+_ip2 = 0x0a000002
+_mac1 = 0x000000000001
+_mac2 = 0x0000000000aa
+
+
+class LoadTest (unittest.TestCase):
+  def setUp (self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown (self):
+    shutil.rmtree(self.dir)
+
+  def _load (self, name, text):
+    path = os.path.join(self.dir, name)
+    with open(path, "w") as out:
+      out.write(text)
+    return bindingfile.load_bindings(path)
+
+  def test_text (self):
+    r = self._load("hosts.txt",
+                   "# Hosts\n"
+                   "10.0.0.1 00:00:00:00:00:01\n"
+                   "\n"
+                   "10.0.0.2 00-00-00-00-00-AA 00-00-00-00-00-05 3 # sw5\n")
+    self.assertEqual(r, [(_ip1, _mac1, None, None), (_ip2, _mac2, 5, 3)])
+
+  def test_csv (self):
+    r = self._load("hosts.csv",
+                   "10.0.0.1,00:00:00:00:00:01\n"
+                   "10.0.0.2, 00:00:00:00:00:aa, 5, 3\n")
+    self.assertEqual(r, [(_ip1, _mac1, None, None), (_ip2, _mac2, 5, 3)])
+
+  def test_csv_header (self):
+    r = self._load("hosts.csv",
+                   "Port,MAC,DPID,IP\n"
+                   "3,00:00:00:00:00:aa,5,10.0.0.2\n"
+                   "# Not a binding\n"
+                   "4,00:00:00:00:00:01,5,10.0.0.1\n")
+    self.assertEqual(r, [(_ip2, _mac2, 5, 3), (_ip1, _mac1, 5, 4)])
+
+  def test_csv_header_without_mac (self):
+    self.assertRaises(RuntimeError, self._load, "hosts.csv",
+                      "ip,port\n10.0.0.1,1\n")
+
+  def test_json (self):
+    r = self._load("hosts.json",
+                   '[{"ip": "10.0.0.1", "mac": "00:00:00:00:00:01"},'
+                   ' {"mac": "00:00:00:00:00:aa", "ip": "10.0.0.2",'
+                   '  "dpid": 5, "port": 3},'
+                   ' ["10.0.0.1", "00:00:00:00:00:aa"],'
+                   ' ["10.0.0.2", "00:00:00:00:00:01", "5", 3]]')
+    self.assertEqual(r, [(_ip1, _mac1, None, None), (_ip2, _mac2, 5, 3),
+                         (_ip1, _mac2, None, None), (_ip2, _mac1, 5, 3)])
+
+  def test_json_not_a_list (self):
+    self.assertRaises(RuntimeError, self._load, "hosts.json",
+                      '{"ip": "10.0.0.1", "mac": "00:00:00:00:00:01"}')
+
+  def test_unusual_forms (self):
+    # Not recognized by the bulk parsers, so they go through IPAddr and
+    # EthAddr instead
+    r = self._load("hosts.txt", "10.0.0.1 000000000001\n")
+    self.assertEqual(r, [(_ip1, _mac1, None, None)])
+
+  def test_bad_rows (self):
+    for text in ("10.0.0.1\n",
+                 "10.0.0.1 00:00:00:00:00:01 5\n",
+                 "10.0.0.300 00:00:00:00:00:01\n",
+                 "10.0.0.1 00:00:00:00:00:0g\n",
+                 "10.0.0.1 00:00:00:00:00:01 5 port\n"):
+      self.assertRaises(RuntimeError, self._load, "hosts.txt", text)
+
+  def test_bad_row_is_located (self):
+    try:
+      self._load("hosts.txt", "10.0.0.1 00:00:00:00:00:01\n\nbad 1\n")
+    except RuntimeError as e:
+      self.assertTrue(":3:" in str(e), str(e))
+    else:
+      self.fail("Loaded a bad binding")
+
+  def test_shortest_watch_interval (self):
+    path = os.path.join(self.dir, "hosts.txt")
+    with open(path, "w") as out:
+      out.write("10.0.0.1 00:00:00:00:00:01\n")
+    f = bindingfile.BindingFile(path)
+    try:
+      f.watch(10)
+      f.watch(1)
+      f.watch(5)
+      self.assertEqual(f._interval, 1)
+    finally:
+      f._timer.cancel()
+
+  def test_reload (self):
+    path = os.path.join(self.dir, "hosts.txt")
+    with open(path, "w") as out:
+      out.write("10.0.0.1 00:00:00:00:00:01\n"
+                "10.0.0.2 00:00:00:00:00:aa\n")
+    f = bindingfile.BindingFile(path)
+    changes = []
+    f.handlers.append(lambda a, r: changes.append((a, r)))
+    f.check() # Unchanged
+    with open(path, "w") as out:
+      out.write("10.0.0.1 00:00:00:00:00:aa 5 3\n"
+                "10.0.0.3 00:00:00:00:00:01\n"
+                "10.0.0.2 00:00:00:00:00:aa\n")
+    f.check()
+    self.assertEqual(changes, [({_ip1 : (_mac2, 5, 3),
+                                 0x0a000003 : (_mac1, None, None)},
+                                {_ip1 : (_mac1, None, None)})])
+    with open(path, "w") as out:
+      out.write("10.0.0.1 not-a-mac\n")
+    f.check() # Logged, and the old bindings kept
+    self.assertEqual(len(changes), 1)
+    self.assertEqual(f.bindings[_ip2], (_mac2, None, None))
+
+
+# Strings the bulk parsers should accept, and ones they should leave to
+# IPAddr and EthAddr
+_ips = ["10.0.0.1", "0.0.0.0", "255.255.255.255", "1.22.133.4",
+        "10.0.0", "10.0.0.1.2", "10.0.0.256", "10..0.1", ".10.0.1",
+        "10.0.0.", "10.0.0.1000", "0010.0.0.1", "a.b.c.d", "", " 10.0.0.1",
+        "10.0.0.1 ", "100.200.300.400", "1.2.3.4x", "1234567890123456"]
+_macs = ["00:00:00:00:00:01", "ff-FF-ff-FF-ff-FF", "0a:1B:2c:3D:4e:5F",
+         "00:00:00:00:00:0g", "00:00-00:00:00:01", "00.00.00.00.00.01",
+         "000000000001", "00:00:00:00:00:1", "00:00:00:00:00:001", "",
+         "00:00:00:00:00:01 ", "\xe9" * 17]
+
+
+class ParseTest (unittest.TestCase):
+  def test_ips (self):
+    r = bindingfile._parse_ips_py(_ips)
+    self.assertEqual(r[:4], [0x0a000001, 0, 0xffffffff, 0x01168504])
+    self.assertEqual(r[4:-5], [None] * (len(_ips) - 9))
+
+  def test_macs (self):
+    r = bindingfile._parse_macs_py(_macs)
+    self.assertEqual(r[:3], [1, 0xffffffffffff, 0x0a1b2c3d4e5f])
+    self.assertEqual(r[3:], [None] * (len(_macs) - 3))
+
+  @unittest.skipIf(bindingfile.numpy is None, "NumPy is not installed")
+  def test_ips_np (self):
+    rng = random.Random(1)
+    ips = _ips + [".".join(str(rng.randrange(300)) for _ in range(4))
+                  for _ in range(1000)]
+    self.assertEqual(bindingfile._parse_ips_np(ips),
+                     bindingfile._parse_ips_py(ips))
+
+  @unittest.skipIf(bindingfile.numpy is None, "NumPy is not installed")
+  def test_macs_np (self):
+    rng = random.Random(1)
+    macs = _macs + [rng.choice(":-").join("%02x" % (rng.randrange(256),)
+                                           for _ in range(6))
+                    for _ in range(1000)]
+    self.assertEqual(bindingfile._parse_macs_np(macs),
+                     bindingfile._parse_macs_py(macs))
+
+
+class DiffTest (unittest.TestCase):
+  def test_diff (self):
+    old = {1 : (1, None, None), 2 : (2, None, None), 3 : (3, 5, 1)}
+    new = {1 : (1, None, None), 2 : (9, None, None), 4 : (4, None, None)}
+    added, removed = bindingfile.diff(old, new)
+    self.assertEqual(added, {2 : (9, None, None), 4 : (4, None, None)})
+    self.assertEqual(removed, {2 : (2, None, None), 3 : (3, 5, 1)})
+
+  def test_no_changes (self):
+    b = {1 : (1, None, None)}
+    self.assertEqual(bindingfile.diff(b, dict(b)), ({}, {}))
+
+
+if __name__ == "__main__":
+  unittest.main()
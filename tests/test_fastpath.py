@@ -0,0 +1,142 @@
+"""
+Tests of reading headers from raw frames.
+
+Run from the pox directory, with this repository in ext/:
+
+  python -m unittest discover ext/NetworkSystemsAssignment1/tests
+"""
+
+import importlib
+import os
+import struct
+import sys
+import unittest
+
+_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_repo))
+_package = os.path.basename(_repo)
+fastpath = importlib.import_module(_package + ".fastpath")
+
+_dst = 0xffffffffffff
+_src = 0x0200000000aa
+
+
+def _eth (type, payload, vlan = None):
+  r = struct.pack("!HIHI", _dst >> 32, _dst & 0xffffffff,
+                  _src >> 32, _src & 0xffffffff)
+  if vlan is not None:
+    r += struct.pack("!HH", fastpath.ETH_VLAN, 0x2000 | vlan)
+  return r + struct.pack("!H", type) + payload
+
+
+def _arp (op = 1, spa = 0x0a000001, tpa = 0x0a000002):
+  return struct.pack("!HHBBHHIIHII", 1, fastpath.ETH_IPV4, 6, 4, op,
+                     _src >> 32, _src & 0xffffffff, spa, 0, 0, tpa)
+
+
+def _ipv4 (proto, payload, src = 0x0a000001, dst = 0x0a000002, frag = 0,
+           options = b""):
+  ihl = 5 + len(options) // 4
+  return struct.pack("!BBHHHBBHII", 0x40 | ihl, 0, ihl * 4 + len(payload),
+                     1, frag, 64, proto, 0, src, dst) + options + payload
+
+
+def _udp (sport, dport, payload = b"\0" * 8):
+  return struct.pack("!HHHH", sport, dport, 8 + len(payload), 0) + payload
+
+
+class ClassifyTest (unittest.TestCase):
+  def test_arp (self):
+    h = fastpath.classify(_eth(fastpath.ETH_ARP, _arp(op = 2)))
+    self.assertEqual((h.dst, h.src, h.vlan, h.type),
+                     (_dst, _src, None, fastpath.ETH_ARP))
+    self.assertEqual((h.arp_op, h.arp_sha, h.arp_spa, h.arp_tpa),
+                     (2, _src, 0x0a000001, 0x0a000002))
+    self.assertEqual(h.ip_src, None)
+
+  def test_tagged_arp (self):
+    h = fastpath.classify(_eth(fastpath.ETH_ARP, _arp(), vlan = 10))
+    self.assertEqual((h.vlan, h.type), (10, fastpath.ETH_ARP))
+    self.assertEqual((h.arp_op, h.arp_sha, h.arp_spa, h.arp_tpa),
+                     (1, _src, 0x0a000001, 0x0a000002))
+
+  def test_non_ipv4_arp (self):
+    arp = bytearray(_arp())
+    arp[1] = 6 # htype
+    h = fastpath.classify(_eth(fastpath.ETH_ARP, bytes(arp)))
+    self.assertEqual(h.type, fastpath.ETH_ARP)
+    self.assertEqual(h.arp_op, None)
+
+  def test_dhcp (self):
+    h = fastpath.classify(_eth(fastpath.ETH_IPV4,
+                               _ipv4(fastpath.IP_UDP, _udp(68, 67),
+                                     src = 0, dst = 0xffffffff)))
+    self.assertEqual((h.ip_src, h.ip_dst, h.ip_proto),
+                     (0, 0xffffffff, fastpath.IP_UDP))
+    self.assertEqual((h.sport, h.dport), (68, 67))
+    self.assertTrue(fastpath.is_dhcp(h))
+    self.assertTrue(fastpath.is_dhcp_client(h))
+
+  def test_dhcp_reply (self):
+    h = fastpath.classify(_eth(fastpath.ETH_IPV4,
+                               _ipv4(fastpath.IP_UDP, _udp(67, 68)),
+                               vlan = 10))
+    self.assertEqual((h.vlan, h.sport, h.dport), (10, 67, 68))
+    self.assertTrue(fastpath.is_dhcp(h))
+    self.assertFalse(fastpath.is_dhcp_client(h))
+
+  def test_not_dhcp (self):
+    for proto, sport, dport in ((fastpath.IP_UDP, 68, 53),
+                                (fastpath.IP_TCP, 68, 67)):
+      h = fastpath.classify(_eth(fastpath.ETH_IPV4,
+                                 _ipv4(proto, _udp(sport, dport))))
+      self.assertFalse(fastpath.is_dhcp(h))
+      self.assertFalse(fastpath.is_dhcp_client(h))
+
+  def test_ip_options (self):
+    h = fastpath.classify(_eth(fastpath.ETH_IPV4,
+                               _ipv4(fastpath.IP_UDP, _udp(68, 67),
+                                     options = b"\x01" * 8)))
+    self.assertEqual((h.sport, h.dport), (68, 67))
+
+  def test_fragments (self):
+    # The first fragment has the ports; later ones' payload is not UDP
+    h = fastpath.classify(_eth(fastpath.ETH_IPV4,
+                               _ipv4(fastpath.IP_UDP, _udp(68, 67),
+                                     frag = 0x2000))) # More fragments
+    self.assertEqual((h.sport, h.dport), (68, 67))
+    h = fastpath.classify(_eth(fastpath.ETH_IPV4,
+                               _ipv4(fastpath.IP_UDP, _udp(68, 67),
+                                     frag = 185)))
+    self.assertEqual(h.ip_proto, fastpath.IP_UDP)
+    self.assertEqual((h.sport, h.dport), (None, None))
+    self.assertFalse(fastpath.is_dhcp(h))
+
+  def test_truncated (self):
+    arp = _eth(fastpath.ETH_ARP, _arp(), vlan = 10)
+    self.assertEqual(fastpath.classify(arp[:13]), None)
+    self.assertEqual(fastpath.classify(arp[:17]), None)
+    h = fastpath.classify(arp[:-1])
+    self.assertEqual((h.vlan, h.type), (10, fastpath.ETH_ARP))
+    self.assertEqual(h.arp_op, None)
+
+    udp = _eth(fastpath.ETH_IPV4, _ipv4(fastpath.IP_UDP, _udp(68, 67)))
+    h = fastpath.classify(udp[:14 + 19])
+    self.assertEqual((h.type, h.ip_src), (fastpath.ETH_IPV4, None))
+    h = fastpath.classify(udp[:14 + 23])
+    self.assertEqual(h.ip_src, 0x0a000001)
+    self.assertEqual((h.sport, h.dport), (None, None))
+    h = fastpath.classify(udp[:14 + 24])
+    self.assertEqual((h.sport, h.dport), (68, 67))
+
+  def test_headers_once (self):
+    class Event (object):
+      data = _eth(fastpath.ETH_ARP, _arp())
+    event = Event()
+    h = fastpath.headers(event)
+    self.assertEqual(h.arp_op, 1)
+    self.assertTrue(fastpath.headers(event) is h)
+
+
+if __name__ == "__main__":
+  unittest.main()
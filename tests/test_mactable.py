@@ -0,0 +1,135 @@
+"""
+Tests of the MAC table against a dict.
+
+Run from the pox directory, with this repository in ext/:
+
+  python -m unittest discover ext/NetworkSystemsAssignment1/tests
+"""
+
+import importlib
+import os
+import random
+import sys
+import unittest
+
+try:
+  from pox.lib.addresses import EthAddr
+except ImportError:
+  raise unittest.SkipTest("POX is not on the path")
+
+_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_repo))
+_package = os.path.basename(_repo)
+mactable = importlib.import_module(_package + ".mactable")
+bindings = importlib.import_module(_package + ".bindings")
+
+
+def _table (max_size = 0, max_age = 0):
+  """
+  Returns (a MacTable, the list of (MAC, port) it evicts)
+  """
+  t = mactable.MacTable(max_size, max_age)
+  t.stop() # Tests age it by hand
+  evicted = []
+  t.evict_handlers.append(lambda mac, port: evicted.append((mac, port)))
+  return t, evicted
+
+
+def _mac (i):
+  return bindings.int_to_mac(i)
+
+
+class MacTableTest (unittest.TestCase):
+  def assertSame (self, t, d):
+    self.assertEqual(len(t), len(d))
+    self.assertEqual(sorted((bindings.mac_to_int(m), p) for m, p in t.items()),
+                     sorted(d.items()))
+    for m, p in d.items():
+      self.assertTrue(m in t)
+      self.assertEqual(t.get(m), p)
+      self.assertEqual(t[_mac(m)], p)
+
+  def test_against_dict (self):
+    rng = random.Random(1)
+    t, evicted = _table()
+    d = {}
+    # Few enough MACs that they're often learned again and removed, and
+    # MACs differing only in the vendor half, so probe runs collide
+    macs = [rng.randrange(1 << 48) for _ in range(300)]
+    macs += [(v << 24) | 5 for v in range(1, 50)]
+    for _ in range(20000):
+      mac = rng.choice(macs)
+      op = rng.random()
+      if op < 0.5:
+        port = rng.randrange(1, 49)
+        if rng.random() < 0.5:
+          t[_mac(mac)] = port
+        else:
+          t.learn(mac, port)
+        d[mac] = port
+      elif op < 0.7:
+        self.assertEqual(t.pop(mac), d.pop(mac, None))
+      elif op < 0.8:
+        if mac in d:
+          del t[_mac(mac)]
+          del d[mac]
+        else:
+          self.assertRaises(KeyError, t.__delitem__, mac)
+      else:
+        self.assertEqual(t.get(mac, -1), d.get(mac, -1))
+    self.assertSame(t, d)
+    self.assertEqual(evicted, [])
+
+  def test_shift_back_on_delete (self):
+    t, evicted = _table()
+    # All start their probe at the same position
+    macs = [i << 6 for i in range(1, 20)]
+    for i, mac in enumerate(macs):
+      t.learn(mac, i + 1)
+    for mac in macs[::3]:
+      del t[mac]
+    d = dict((mac, i + 1) for i, mac in enumerate(macs)
+             if mac not in macs[::3])
+    self.assertSame(t, d)
+    for mac in macs[::3]:
+      self.assertFalse(mac in t)
+
+  def test_eviction_at_capacity (self):
+    t, evicted = _table(max_size = 4)
+    for i in range(1, 5):
+      t.learn(i, i, now = i)
+    t.learn(1, 1, now = 5) # Seen again, so it gets another go round
+    t.learn(5, 5, now = 6)
+    self.assertEqual(evicted, [(_mac(2), 2)])
+    t.learn(6, 6, now = 7)
+    self.assertEqual(evicted, [(_mac(2), 2), (_mac(3), 3)])
+    self.assertSame(t, {1 : 1, 4 : 4, 5 : 5, 6 : 6})
+
+  def test_aging (self):
+    t, evicted = _table(max_age = 10)
+    t.learn(1, 1, now = 0)
+    t.learn(2, 2, now = 0)
+    t.learn(3, 3, now = 5)
+    t.learn(1, 1, now = 8) # Refreshed
+    self.assertEqual(t.expire(now = 11), 1)
+    self.assertEqual(evicted, [(_mac(2), 2)])
+    self.assertSame(t, {1 : 1, 3 : 3})
+    self.assertEqual(t.last_seen(1), 8)
+    self.assertEqual(t.expire(now = 16), 1)
+    self.assertSame(t, {1 : 1})
+    self.assertEqual(t.expire(now = 30), 1)
+    self.assertSame(t, {})
+
+  def test_changes (self):
+    t, evicted = _table(max_size = 2)
+    t.learn(1, 1)
+    t.track_changes()
+    t.learn(2, 2)
+    t.learn(3, 3) # Evicts 1
+    t.pop(2)
+    self.assertEqual(t.changes(), set([1, 2, 3]))
+    self.assertEqual(t.changes(), set())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,90 @@
+"""
+Tests that components' timers run in worker processes.
+
+Run from the pox directory, with this repository in ext/:
+
+  python -m unittest discover ext/NetworkSystemsAssignment1/tests
+"""
+
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+  from pox.core import core
+except ImportError:
+  raise unittest.SkipTest("POX is not on the path")
+
+_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_repo))
+_package = os.path.basename(_repo)
+workers = importlib.import_module(_package + ".workers")
+spoofing = importlib.import_module(_package + ".spoofing")
+bindingfile = importlib.import_module(_package + ".bindingfile")
+
+
+def _in_worker (fn, *args):
+  """
+  Runs fn(*args) in a forked worker process; returns what it returns
+  """
+  results = workers._mp.Queue()
+  def main ():
+    workers._start_worker(0)
+    results.put(fn(*args))
+  p = workers._mp.Process(target = main)
+  p.start()
+  try:
+    return results.get(timeout = 10)
+  finally:
+    p.join(5)
+
+
+def _expire_in_worker (tracker):
+  before = len(tracker)
+  time.sleep(1.5) # The expiry timer runs every second
+  return before, len(tracker)
+
+
+def _reload_in_worker (f, path, changes):
+  time.sleep(0.1) # So the file's mtime changes too
+  with open(path, "w") as out:
+    out.write("10.0.0.1 00:00:00:00:00:09\n10.0.0.2 00:00:00:00:00:02\n")
+  time.sleep(1)
+  return sorted(f.bindings.items()), changes
+
+
+class WorkerTimerTest (unittest.TestCase):
+  def setUp (self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown (self):
+    shutil.rmtree(self.dir)
+
+  def test_spoofer_expiry (self):
+    tracker = spoofing.SpooferTracker("test", window = 1)
+    o = tracker.offenders[(1, 1, None)] = spoofing.Offender(1)
+    o.last = time.time() - 60
+    self.assertEqual(_in_worker(_expire_in_worker, tracker), (1, 0))
+
+  def test_bindings_reload (self):
+    path = os.path.join(self.dir, "bindings.txt")
+    with open(path, "w") as out:
+      out.write("10.0.0.1 00:00:00:00:00:01\n")
+    changes = []
+    f = bindingfile.open_bindings(path,
+                                  lambda a, r: changes.append((a, r)),
+                                  watch = 0.2)
+    bindings, changes = _in_worker(_reload_in_worker, f, path, changes)
+    self.assertEqual(bindings, [(0x0a000001, (9, None, None)),
+                                (0x0a000002, (2, None, None))])
+    self.assertEqual(changes, [({0x0a000001 : (9, None, None),
+                                 0x0a000002 : (2, None, None)},
+                                {0x0a000001 : (1, None, None)})])
+
+
+if __name__ == "__main__":
+  unittest.main()
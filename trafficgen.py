@@ -0,0 +1,289 @@
+#!/usr/bin/python
+
+"""
+Frame generators for the attack scenarios, for offline load testing.
+
+These produce the same kinds of frame streams as the Mininet scripts,
+without Mininet, at any scale:
+
+  arpspoof    mininet-arpspoof.py: a spoofer poisons the hosts' ARP
+              caches with replies claiming the other hosts' IPs, mixed
+              with normal ARP between the hosts
+  ipspoof     mininet-ipspoof.py: a spoofer sends TCP SYNs to the hosts
+              from 9 IPs which aren't its own
+  macflood    mininet-portsecurity.py: every host sends TCP SYNs (as
+              nping does) from 5x2 fake source MACs
+  rogue_dhcp  cs144-dhcp/dhcp.py: clients do DHCP while a rogue server
+              on a fast link answers before the real, slow server
+
+Host i (from 1) has MAC i (00:00:00:00:00:01, ...), IP 10.0.0.0 + i and
+is on switch port i, as in the Mininet topologies.  Frames are written
+as pcapng with one interface per switch port, so the capture records
+each frame's ingress port (see replay.read_frames).  For example:
+
+  python trafficgen.py macflood --hosts=5000 --frames=2000000 -o flood.pcapng
+
+The frames are built directly with struct so millions can be generated
+quickly, and this file has no POX dependencies.
+"""
+
+from argparse import ArgumentParser
+import itertools
+import random
+import struct
+
+ETHER_BROADCAST = 0xffffffffffff
+ARP_TYPE = 0x0806
+IP_TYPE = 0x0800
+TCP_PROTOCOL = 6
+UDP_PROTOCOL = 17
+
+SPOOFER_MAC = 0x0000deadbeef
+
+_mac = struct.Struct("!HI")
+_eth = struct.Struct("!6s6sH")
+_arp = struct.Struct("!HHBBH6sI6sI")
+_ip = struct.Struct("!BBHHHBBHII")
+_tcp = struct.Struct("!HHIIBBHHH")
+_udp = struct.Struct("!HHHH")
+_bootp = struct.Struct("!BBBBIHHIIII16s64s128sI")
+
+
+def host_mac (i):
+  return i
+
+def host_ip (i):
+  return 0x0a000000 + i
+
+
+def _mac_bytes (mac):
+  return _mac.pack(mac >> 32, mac & 0xffFFffFF)
+
+
+def _checksum (data):
+  if len(data) % 2: data += b"\0"
+  s = sum(struct.unpack("!%iH" % (len(data) // 2,), data))
+  s = (s >> 16) + (s & 0xffff)
+  s += s >> 16
+  return ~s & 0xffff
+
+
+def ethernet (dst, src, ethertype, payload):
+  return _eth.pack(_mac_bytes(dst), _mac_bytes(src), ethertype) + payload
+
+
+def arp (opcode, sha, spa, tha, tpa):
+  return _arp.pack(1, IP_TYPE, 6, 4, opcode, _mac_bytes(sha), spa,
+                   _mac_bytes(tha), tpa)
+
+
+def ipv4 (src, dst, protocol, payload, ident = 0):
+  h = _ip.pack(0x45, 0, 20 + len(payload), ident, 0, 64, protocol, 0,
+               src, dst)
+  csum = _checksum(h)
+  return h[:10] + struct.pack("!H", csum) + h[12:] + payload
+
+
+def tcp_syn (src, dst, sport, dport, seq):
+  h = _tcp.pack(sport, dport, seq, 0, 5 << 4, 0x02, 1024, 0, 0)
+  pseudo = struct.pack("!IIBBH", src, dst, 0, TCP_PROTOCOL, len(h))
+  csum = _checksum(pseudo + h)
+  return h[:16] + struct.pack("!H", csum) + h[18:]
+
+
+def udp (sport, dport, payload):
+  # A zero checksum means "no checksum" for UDP over IPv4
+  return _udp.pack(sport, dport, 8 + len(payload), 0) + payload
+
+
+# DHCP message types
+DISCOVER = 1
+OFFER = 2
+REQUEST = 3
+ACK = 5
+
+def dhcp (op, msg_type, xid, chaddr, yiaddr = 0, server = None,
+          requested = None, lease = None):
+  opts = [struct.pack("!BBB", 53, 1, msg_type)]
+  if server is not None: opts.append(struct.pack("!BBI", 54, 4, server))
+  if requested is not None: opts.append(struct.pack("!BBI", 50, 4, requested))
+  if lease is not None:
+    opts.append(struct.pack("!BBI", 51, 4, lease))
+    opts.append(struct.pack("!BBI", 1, 4, 0xffffff00))
+  opts.append(b"\xff")
+  chaddr = _mac_bytes(chaddr) + b"\0" * 10
+  return _bootp.pack(op, 1, 6, 0, xid, 0, 0, 0, yiaddr, 0, 0, chaddr,
+                     b"", b"", 0x63825363) + b"".join(opts)
+
+
+def arp_poisoning (hosts, rng, legit_ratio = 0.5):
+  """
+  Yields (port, frame) for the arpspoof scenario forever
+
+  The spoofer is on port hosts+1 with MAC 00:00:de:ad:be:ef.  Each
+  poisoning reply tells a target host that another host's IP is at the
+  spoofer's MAC.
+  """
+  spoofer_port = hosts + 1
+  while True:
+    t = rng.randint(1, hosts)
+    v = rng.randint(1, hosts - 1) if hosts > 1 else t
+    if v >= t and hosts > 1: v += 1
+    if rng.random() < legit_ratio:
+      # t asks for v, and v answers
+      yield t, ethernet(ETHER_BROADCAST, host_mac(t), ARP_TYPE,
+                        arp(1, host_mac(t), host_ip(t), 0, host_ip(v)))
+      yield v, ethernet(host_mac(t), host_mac(v), ARP_TYPE,
+                        arp(2, host_mac(v), host_ip(v), host_mac(t),
+                            host_ip(t)))
+    else:
+      yield spoofer_port, ethernet(host_mac(t), SPOOFER_MAC, ARP_TYPE,
+                                   arp(2, SPOOFER_MAC, host_ip(v),
+                                       host_mac(t), host_ip(t)))
+
+
+def ip_spoofing (hosts, rng, count = 5):
+  """
+  Yields (port, frame) for the ipspoof scenario forever
+
+  The spoofer is on port hosts+1 with MAC 00:00:de:ad:be:ef, and sends
+  count TCP SYNs to each of up to 3 hosts from each of 9 IPs following
+  its own (10.0.0.6 - 10.0.0.14 for 3 hosts).
+  """
+  spoofer_port = hosts + 1
+  seq = itertools.count()
+  while True:
+    for i in range(1, 10):
+      src = host_ip(hosts + 2 + i)
+      for j in range(1, min(hosts, 3) + 1):
+        for _ in range(count):
+          n = next(seq)
+          payload = tcp_syn(src, host_ip(j), rng.randrange(1024, 65536), 80,
+                            n)
+          yield spoofer_port, ethernet(host_mac(j), SPOOFER_MAC, IP_TYPE,
+                                       ipv4(src, host_ip(j), TCP_PROTOCOL,
+                                            payload, n & 0xffff))
+
+
+def mac_flood (hosts, rng, count = 5):
+  """
+  Yields (port, frame) for the macflood scenario forever
+
+  Host x sends count TCP SYNs to 10.0.0.j from each fake MAC
+  02:00:xx:xx:0i:0j (i in 1-5, j in 1-2), host by host.
+  """
+  seq = itertools.count()
+  while True:
+    for x in range(1, hosts + 1):
+      for i in range(1, 6):
+        for j in range(1, 3):
+          src = 0x020000000000 | (x << 16) | (i << 8) | j
+          dst = j if j <= hosts else 1
+          for _ in range(count):
+            n = next(seq)
+            payload = tcp_syn(host_ip(x), host_ip(dst),
+                              rng.randrange(1024, 65536), 80, n)
+            yield x, ethernet(host_mac(dst), src, IP_TYPE,
+                              ipv4(host_ip(x), host_ip(dst), TCP_PROTOCOL,
+                                   payload, n & 0xffff))
+
+
+def rogue_dhcp (hosts, rng, lease = 7):
+  """
+  Yields (port, frame) for the rogue_dhcp scenario forever
+
+  As in cs144-dhcp, the first client is on port 1, the rogue server on
+  port 2 and the real server on port 3; further clients are on ports 4
+  and up.  Each client's exchange is emitted in order: DISCOVER, the
+  rogue's OFFER, REQUEST and ACK, then the real server's late OFFER.
+  """
+  rogue_port, server_port = 2, 3
+  rogue_mac, server_mac = 0x020000000002, 0x020000000003
+  rogue_ip, server_ip = 0x0a000042, 0x0a000032 # 10.0.0.66, 10.0.0.50
+  clients = [(1, host_mac(1))] + [(k + 3, host_mac(k + 3))
+                                  for k in range(1, hosts)]
+  def client_msg (mac, msg_type, xid, requested = None, server = None):
+    return ethernet(ETHER_BROADCAST, mac, IP_TYPE,
+                    ipv4(0, 0xffffffff, UDP_PROTOCOL,
+                         udp(68, 67, dhcp(1, msg_type, xid, mac,
+                                          requested = requested,
+                                          server = server))))
+  def server_msg (mac, ip, msg_type, xid, client, yiaddr):
+    return ethernet(client, mac, IP_TYPE,
+                    ipv4(ip, yiaddr, UDP_PROTOCOL,
+                         udp(67, 68, dhcp(2, msg_type, xid, client, yiaddr,
+                                          server = ip, lease = lease))))
+  while True:
+    for n, (port, mac) in enumerate(clients):
+      xid = rng.getrandbits(32)
+      offer = 0x0a000000 + 10 + n % 80 # 10.0.0.10 - 10.0.0.89
+      yield port, client_msg(mac, DISCOVER, xid)
+      yield rogue_port, server_msg(rogue_mac, rogue_ip, OFFER, xid, mac,
+                                   offer)
+      yield port, client_msg(mac, REQUEST, xid, offer, rogue_ip)
+      yield rogue_port, server_msg(rogue_mac, rogue_ip, ACK, xid, mac, offer)
+      yield server_port, server_msg(server_mac, server_ip, OFFER, xid, mac,
+                                    offer)
+
+
+SCENARIOS = {
+  'arpspoof' : arp_poisoning,
+  'ipspoof' : ip_spoofing,
+  'macflood' : mac_flood,
+  'rogue_dhcp' : rogue_dhcp,
+}
+
+
+def generate (scenario, hosts, frames, seed = 0):
+  """
+  Returns an iterator over the first frames (port, frame) of a scenario
+  """
+  rng = random.Random(seed)
+  return itertools.islice(SCENARIOS[scenario](hosts, rng), frames)
+
+
+def write_pcapng (filename, frames, ports, interval = 0.0001):
+  """
+  Writes (port, frame) pairs as pcapng, one interface per port
+
+  Frames are timestamped interval seconds apart.  Returns the number of
+  frames written.
+  """
+  def block (btype, body):
+    body += b"\0" * (-len(body) % 4)
+    n = len(body) + 12
+    return struct.pack("<II", btype, n) + body + struct.pack("<I", n)
+
+  count = 0
+  with open(filename, 'wb') as f:
+    f.write(block(0x0a0d0d0a, struct.pack("<IHHq", 0x1a2b3c4d, 1, 0, -1)))
+    idb = block(1, struct.pack("<HHI", 1, 0, 0)) # Ethernet, no snaplen
+    for _ in range(ports):
+      f.write(idb)
+    for port, frame in frames:
+      ts = int(count * interval * 1e6)
+      f.write(block(6, struct.pack("<IIIII", port - 1, ts >> 32,
+                                   ts & 0xffFFffFF, len(frame), len(frame))
+                       + frame))
+      count += 1
+  return count
+
+
+def main ():
+  parser = ArgumentParser(description = "Generate attack scenario captures")
+  parser.add_argument("scenario", choices = sorted(SCENARIOS))
+  parser.add_argument("--hosts", type = int, default = 3)
+  parser.add_argument("--frames", type = int, default = 100000)
+  parser.add_argument("--seed", type = int, default = 0)
+  parser.add_argument("-o", "--output", required = True)
+  args = parser.parse_args()
+  if args.hosts < 1: parser.error("Need at least one host")
+
+  # Every scenario puts something on the port after the last host
+  ports = args.hosts + 3
+  n = write_pcapng(args.output, generate(args.scenario, args.hosts,
+                                         args.frames, args.seed), ports)
+  print("Wrote %i frames to %s" % (n, args.output))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,346 @@
+"""
+Running the switch components in worker processes, sharded by DPID.
+
+Normally every component handles every switch's PacketIns in POX's one
+cooperative thread, so one busy switch holds up all the others.  With
+this component loaded, the controller process only does OpenFlow I/O:
+
+  ./pox.py NetworkSystemsAssignment1.workers --processes=4 \
+      NetworkSystemsAssignment1.portSecurity
+
+Once POX is up, it forks the worker processes, each with its own copy of
+the loaded components.  Each switch belongs to one worker, picked by the
+hash of its DPID.  The controller passes the switch's events (its
+ConnectionUp and ConnectionDown, and the PacketIn, PortStatus,
+FlowRemoved, BarrierIn and flow stats messages) to that worker as packed
+OpenFlow messages, and stops them there.  The worker raises the events
+on a stand-in connection for the switch; what the components send to it
+comes back packed (in batches, with batching on) on a queue the
+controller reads, and is written to the switch.
+
+Everything a component knows is per worker: state shared by all
+switches (e.g., DAI's bindings, or blocked spoofers) is only shared by
+the switches of one worker.  Components which need one view of the whole
+network should be run without workers.
+
+The workers are forked from the cooperative thread, with the logging
+locks held, so they don't start with a lock some other thread held.
+Each runs its own recoco scheduler.  Timers made before the fork belong
+to the controller's, so components which have recurring timers (or
+other per-process work) register with at_fork() to start them again in
+each worker.
+"""
+
+from pox.core import core, GoingDownEvent
+import pox.openflow.libopenflow_01 as of
+from pox.openflow import ConnectionUp, ConnectionDown, PortStatus
+from pox.openflow import FlowRemoved, PacketIn, BarrierIn
+from pox.openflow import FlowStatsReceived
+from pox.lib.recoco import Scheduler
+from pox.lib.revent import EventMixin, EventHalt
+import logging
+import multiprocessing
+import os
+import threading
+import signal
+import time
+
+log = core.getLogger()
+
+# Number of worker processes (None for one per CPU)
+_processes = None
+
+# Functions called with its index in each worker process, once it's
+# running its own scheduler
+_fork_handlers = []
+
+# Workers must be forked, to start with the loaded components (some
+# Pythons default to starting processes another way)
+if hasattr(multiprocessing, "get_context"):
+  _mp = multiprocessing.get_context("fork")
+else:
+  _mp = multiprocessing
+
+# Python 3's os.fork() looks after the logging locks itself
+_fork_logging_locks = not hasattr(os, "register_at_fork")
+
+# Priority of our listeners on core.openflow; we must see switch events
+# before any component does
+_listen_priority = 1000
+
+# Seconds a worker is given to shut down
+_stop_timeout = 5
+
+# Event name -> class of the OpenFlow message it carries
+_message_classes = {
+  "ConnectionUp" : of.ofp_features_reply,
+  "PacketIn" : of.ofp_packet_in,
+  "PortStatus" : of.ofp_port_status,
+  "FlowRemoved" : of.ofp_flow_removed,
+  "BarrierIn" : of.ofp_barrier_reply,
+}
+
+_event_classes = {
+  "ConnectionUp" : ConnectionUp,
+  "ConnectionDown" : ConnectionDown,
+  "PacketIn" : PacketIn,
+  "PortStatus" : PortStatus,
+  "FlowRemoved" : FlowRemoved,
+  "BarrierIn" : BarrierIn,
+  "FlowStatsReceived" : FlowStatsReceived,
+}
+
+
+class WorkerConnection (EventMixin):
+  """
+  Stands in for a switch connection in a worker process
+
+  Messages sent to it are packed and queued for the controller process
+  to write to the switch.
+  """
+  _eventMixin_events = set([ConnectionUp, ConnectionDown, PortStatus,
+                            FlowRemoved, PacketIn, BarrierIn,
+                            FlowStatsReceived])
+
+  def __init__ (self, dpid, features, results):
+    self.dpid = dpid
+    self.features = features
+    self.connect_time = time.time()
+    self._results = results
+
+  def send (self, data):
+    if not isinstance(data, bytes):
+      data = data.pack()
+    self._results.put((self.dpid, data))
+
+
+class Worker (object):
+  """
+  Raises the switch events passed to a worker process
+  """
+  def __init__ (self, index, results):
+    self.index = index
+    self.results = results
+    self.connections = {} # DPID -> WorkerConnection
+
+  def dispatch (self, name, dpid, raw):
+    nexus = core.openflow
+    if name == "ConnectionUp":
+      ofp = _unpack(name, raw)
+      con = WorkerConnection(dpid, ofp, self.results)
+      self.connections[dpid] = con
+      nexus._connect(con)
+      _raise(nexus, con, ConnectionUp(con, ofp))
+      return
+
+    con = self.connections.get(dpid)
+    if con is None: return
+    if name == "ConnectionDown":
+      del self.connections[dpid]
+      nexus._disconnect(dpid)
+      _raise(nexus, con, ConnectionDown(con))
+    elif name == "FlowStatsReceived":
+      parts = []
+      stats = []
+      for r in raw:
+        part = of.ofp_stats_reply()
+        part.unpack(r)
+        parts.append(part)
+        stats.extend(part.body)
+      _raise(nexus, con, FlowStatsReceived(con, parts, stats))
+    else:
+      _raise(nexus, con, _event_classes[name](con, _unpack(name, raw)))
+
+
+def _unpack (name, raw):
+  ofp = _message_classes[name]()
+  ofp.unpack(raw)
+  return ofp
+
+
+def _raise (nexus, connection, event):
+  # Like a real connection: core.openflow first, then the connection,
+  # unless a listener on core.openflow halts the event
+  nexus.raiseEventNoErrors(event)
+  if not event.halt:
+    connection.raiseEventNoErrors(event)
+
+
+def at_fork (fn):
+  """
+  Registers fn to be called with its index in each worker process
+
+  It's called from the worker's cooperative thread, before any switch
+  events, e.g. to start timers again (those made before the fork don't
+  run in workers).
+  """
+  _fork_handlers.append(fn)
+
+
+def shard (dpid, processes = None):
+  """
+  Returns the index of the worker handling the switch with DPID dpid
+  """
+  return hash(dpid) % (processes or _processes)
+
+
+def _logging_locks ():
+  locks = [logging._lock]
+  for ref in logging._handlerList:
+    handler = ref()
+    if handler is not None and handler.lock is not None:
+      locks.append(handler.lock)
+  return locks
+
+
+def _start_worker (index):
+  """
+  Makes this (newly forked) process a worker
+  """
+  # The scheduler's thread didn't survive the fork; run the components
+  # (and their timers) in a new one, as they would be in the controller
+  core.scheduler = Scheduler(isDefaultScheduler = True, daemon = True)
+  started = threading.Event()
+  def run_handlers ():
+    for fn in _fork_handlers:
+      try:
+        fn(index)
+      except Exception:
+        log.exception("Starting worker %i", index)
+    started.set()
+  core.callLater(run_handlers)
+  started.wait()
+
+
+def _stop_worker ():
+  """
+  Raises GoingDownEvent in the worker, and waits for its handlers
+  """
+  done = threading.Event()
+  def going_down ():
+    core.raiseEventNoErrors(GoingDownEvent())
+    done.set()
+  core.callLater(going_down)
+  done.wait(_stop_timeout)
+
+
+def _worker_main (index, inbox, results):
+  """
+  Body of a worker process
+  """
+  if _fork_logging_locks:
+    for lock in reversed(_logging_locks()):
+      lock.release()
+
+  # The controller deals with ^C
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  _start_worker(index)
+  worker = Worker(index, results)
+  while True:
+    item = inbox.get()
+    if item is None: break
+    core.callLater(worker.dispatch, *item)
+  _stop_worker()
+
+
+class WorkerPool (object):
+  """
+  Forks the workers and shuttles switch events and messages to and from
+  them
+  """
+  def __init__ (self, processes):
+    self.results = _mp.Queue()
+    self.inboxes = []
+    self.processes = []
+    # So the workers don't inherit them half-acquired (see _worker_main)
+    locks = _logging_locks() if _fork_logging_locks else []
+    for lock in locks:
+      lock.acquire()
+    try:
+      for i in range(processes):
+        inbox = _mp.Queue()
+        p = _mp.Process(target = _worker_main,
+                        args = (i, inbox, self.results),
+                        name = "pox-worker-%i" % (i,))
+        p.daemon = True
+        p.start()
+        self.inboxes.append(inbox)
+        self.processes.append(p)
+    finally:
+      for lock in reversed(locks):
+        lock.release()
+
+    # Only now, so the workers don't have these listeners
+    core.openflow.addListeners(self, priority = _listen_priority)
+    core.addListenerByName("GoingDownEvent", self._handle_GoingDownEvent)
+
+    self._reader = threading.Thread(target = self._read_results,
+                                    name = "pox-worker-results")
+    self._reader.daemon = True
+    self._reader.start()
+    log.info("Started %i worker processes", processes)
+
+  def _inbox (self, dpid):
+    return self.inboxes[shard(dpid, len(self.inboxes))]
+
+  def _pass (self, event):
+    name = type(event).__name__
+    self._inbox(event.dpid).put((name, event.dpid, event.ofp.pack()))
+    return EventHalt
+
+  _handle_ConnectionUp = _pass
+  _handle_PacketIn = _pass
+  _handle_PortStatus = _pass
+  _handle_FlowRemoved = _pass
+  _handle_BarrierIn = _pass
+
+  def _handle_ConnectionDown (self, event):
+    self._inbox(event.dpid).put(("ConnectionDown", event.dpid, None))
+    return EventHalt
+
+  def _handle_FlowStatsReceived (self, event):
+    self._inbox(event.dpid).put(("FlowStatsReceived", event.dpid,
+                                 [part.pack() for part in event.ofp]))
+    return EventHalt
+
+  def _read_results (self):
+    # In our own thread, as the queue can only be read by blocking
+    while True:
+      item = self.results.get()
+      if item is None: return
+      core.callLater(self._send, *item)
+
+  def _send (self, dpid, data):
+    con = core.openflow.getConnection(dpid)
+    if con is not None:
+      con.send(data)
+
+  def _handle_GoingDownEvent (self, event):
+    for inbox in self.inboxes:
+      inbox.put(None)
+    self.results.put(None)
+    # Give them time to shut down (e.g., save snapshots) before they're
+    # killed as we exit
+    for p in self.processes:
+      p.join(_stop_timeout)
+
+
+def launch (processes = _processes):
+  """
+  Runs the components loaded with us in worker processes
+
+  processes is the number of workers (one per CPU by default).
+  """
+  global _processes
+  _processes = int(processes) if processes else multiprocessing.cpu_count()
+  if _processes < 1:
+    raise RuntimeError("Expected processes to be a positive number")
+
+  def start ():
+    core.register("WorkerPool", WorkerPool(_processes))
+
+  # Wait for the other components, so the workers get them too, and fork
+  # from the cooperative thread, which is then not in the middle of
+  # anything
+  core.addListenerByName("UpEvent", lambda event: core.callLater(start))